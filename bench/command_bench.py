@@ -0,0 +1,58 @@
+# command_bench.py
+# مقایسه تجزیه دستورات چت به روش قدیمی (lower() روی کل پیام + split("verbosity:")) با CommandRegistry.
+# پیام‌ها بزرگ هستند (مثلاً کد چسبانده‌شده در پیام) تا هزینه کپی‌های اضافه دیده شود.
+# اجرا: python -m bench.command_bench --sizes 1000 100000 1000000
+import argparse
+import timeit
+
+from function.commands import CommandRegistry
+
+LINE = "def handler(request):  # پردازش درخواست و برگرداندن پاسخ\n"
+
+
+def legacy_parse(user_message: str):
+    # منطق قبلی generate_chat_response و parse_code_command
+    lowered = user_message.lower()
+    if lowered.startswith("img:"):
+        return "img", user_message[len("img:"):].strip(), "1024x1024"
+    if lowered.startswith("code:"):
+        parts = user_message[len("code:"):].strip().split("verbosity:")
+        verbosity_level = "medium"
+        if len(parts) > 1 and parts[1].strip().lower() in ["low", "medium", "high"]:
+            verbosity_level = parts[1].strip().lower()
+        return "code", parts[0].strip(), verbosity_level
+    return "chat", user_message, None
+
+
+def make_registry() -> CommandRegistry:
+    registry = CommandRegistry()
+    registry.command("img", choices={"size": ("1024x1024", "1792x1024", "1024x1792")}, defaults={"size": "1024x1024"})
+    registry.command("code", choices={"verbosity": ("low", "medium", "high")}, defaults={"verbosity": "medium"})
+    return registry
+
+
+def make_messages(size: int):
+    body = (LINE * (size // len(LINE) + 1))[:size]
+    return {
+        "chat": body,
+        "code": f"code: refactor this\n{body}\nverbosity: high",
+        "img": f"img: {body} size: 1792x1024",
+    }
+
+
+def main(sizes, number: int):
+    registry = make_registry()
+    print(f"{'size':>9} {'kind':<5} | {'legacy µs':>10} {'registry µs':>12} {'speedup':>8}")
+    for size in sizes:
+        for kind, message in make_messages(size).items():
+            legacy = min(timeit.repeat(lambda: legacy_parse(message), number=number, repeat=3)) / number
+            current = min(timeit.repeat(lambda: registry.parse(message), number=number, repeat=3)) / number
+            print(f"{size:>9} {kind:<5} | {legacy * 1e6:>10.1f} {current * 1e6:>12.1f} {legacy / current:>7.1f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Chat command parsing micro-benchmark")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1_000, 100_000, 1_000_000])
+    parser.add_argument("--number", type=int, default=50)
+    args = parser.parse_args()
+    main(args.sizes, args.number)
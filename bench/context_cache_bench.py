@@ -0,0 +1,67 @@
+# context_cache_bench.py
+# حجم بدنه ارسالی به Gemini برای هر درخواست با و بدون cachedContents، روی سرور mock محلی، برای یک systemInstruction
+# طولانی. سپس cache در mock حذف می‌شود تا بازگشت خودکار به ارسال بدون cache و ساخت دوباره آن بررسی شود.
+# اجرا: python -m bench.context_cache_bench --requests 200 --instruction-kb 16
+import argparse
+import asyncio
+import time
+
+from bench.mock_gemini import start_mock_server_in_thread
+from function.context_cache import ContextCache
+from function.payloads import PayloadTemplate, user_contents
+from function.upstream import GeminiClient
+
+MODEL = "gemini-1.5-flash-latest"
+
+
+async def run(client: GeminiClient, cache, template: PayloadTemplate, total: int, mock_app) -> dict:
+    before = mock_app["request_bytes"]
+    started = time.perf_counter()
+    for i in range(total):
+        payload = template.build(user_contents(f"question {i}"))
+        if cache is None:
+            await client.generate_content(MODEL, payload)
+        else:
+            await cache.call(MODEL, payload, lambda sent: client.generate_content(MODEL, sent))
+    return {
+        "bytes_per_request": (mock_app["request_bytes"] - before) / total,
+        "ms_per_request": (time.perf_counter() - started) / total * 1000,
+    }
+
+
+async def main(total: int, instruction_kb: int):
+    base_url, mock_app, stop = start_mock_server_in_thread(latency=0.0, cache_min_bytes=4096)
+    client = GeminiClient(api_key="bench", base_url=base_url)
+    instruction = ("شما یک دستیار برنامه‌نویسی هستید که کد تمیز و بهینه تولید می‌کند. " * 1000)[: instruction_kb * 1024 // 2]
+    template = PayloadTemplate({
+        "generationConfig": {"responseMimeType": "text/plain"},
+        "systemInstruction": {"parts": [{"text": instruction}]},
+    })
+    cache = ContextCache(client)
+    try:
+        plain = await run(client, None, template, total, mock_app)
+        cached = await run(client, cache, template, total, mock_app)
+        print(f"without cache: {plain['bytes_per_request']:>10.0f} bytes/request  {plain['ms_per_request']:.2f} ms/request")
+        print(f"with cache:    {cached['bytes_per_request']:>10.0f} bytes/request  {cached['ms_per_request']:.2f} ms/request")
+
+        # انقضای cache در upstream: درخواست بعدی بدون cache تکرار و cache دوباره ساخته می‌شود
+        for entry in list(cache._entries.values()):
+            await client.delete_cached_content(entry.name)
+        await run(client, cache, template, 3, mock_app)
+        print(f"after upstream expiry: {cache.stats()}")
+
+        # پیشوند کوچک‌تر از حداقل: بدون تلاش برای ساخت cache
+        small = PayloadTemplate({"systemInstruction": {"parts": [{"text": "short"}]}})
+        await run(client, cache, small, 3, mock_app)
+        print(f"small prefix skipped: {cache.metrics['skipped']}")
+    finally:
+        await client.aclose()
+        stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Gemini context caching (cachedContents) benchmark")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--instruction-kb", type=int, default=16)
+    args = parser.parse_args()
+    asyncio.run(main(args.requests, args.instruction_kb))
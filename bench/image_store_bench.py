@@ -0,0 +1,66 @@
+# image_store_bench.py
+# زمان پاسخ img: برای پرامپت جدید (DALL·E mock + دانلود در پس‌زمینه) در برابر تکرار همان پرامپت (از ذخیره‌ساز)
+# و زمان سرو تصویر ذخیره‌شده از /images/{key} (پاسخ کامل، Range و 304 با If-None-Match).
+# اجرا: python -m bench.image_store_bench --prompts 20 --image-latency 0.5
+import argparse
+import os
+import statistics
+import tempfile
+import time
+
+from bench.mock_gemini import start_mock_server_in_thread
+
+
+def timed_ms(fn) -> float:
+    started = time.perf_counter()
+    fn()
+    return (time.perf_counter() - started) * 1000
+
+
+def main(prompts: int, image_latency: float, repeat: int):
+    base_url, mock_app, stop = start_mock_server_in_thread(latency=0.01, image_latency=image_latency)
+    with tempfile.TemporaryDirectory() as directory:
+        os.environ.update({
+            "GOOGLE_API_KEY": "bench",
+            "OPENAI_API_KEY": "bench",
+            "GEMINI_API_BASE_URL": base_url,
+            "OPENAI_BASE_URL": mock_app["openai_base_url"],
+            "IMAGE_STORE_DIR": os.path.join(directory, "images"),
+            "LOG_LEVEL": "WARNING",
+            # محدودیت نرخ OpenAI (پیش‌فرض 1 در ثانیه) زمان پرامپت‌های جدید را تعیین نکند
+            "OPENAI_RATE_PER_SECOND": "1000",
+        })
+        import main as gateway
+        from fastapi.testclient import TestClient
+
+        with TestClient(gateway.app) as client:
+            def ask(i: int) -> str:
+                response = client.post("/chat/gen", json={"session_id": "bench", "message": f"img: bench image {i}"})
+                return response.json()["response"].rsplit("\n", 1)[-1]
+
+            first = [timed_ms(lambda: ask(i)) for i in range(prompts)]
+            links = [ask(i) for i in range(prompts)]
+            repeated = [timed_ms(lambda: ask(i)) for i in range(prompts)]
+            print(f"img: new prompt       median {statistics.median(first):>8.1f} ms  ({mock_app['image_calls']} DALL·E calls)")
+            print(f"img: repeated prompt  median {statistics.median(repeated):>8.1f} ms  ({mock_app['image_calls']} DALL·E calls)")
+
+            etag = client.get(links[0]).headers["etag"]
+            rows = [
+                ("GET full", lambda: client.get(links[0])),
+                ("GET range", lambda: client.get(links[0], headers={"Range": "bytes=0-63"})),
+                ("GET 304", lambda: client.get(links[0], headers={"If-None-Match": etag})),
+            ]
+            for name, fn in rows:
+                times = [timed_ms(fn) for _ in range(repeat)]
+                print(f"{name:<20} median {statistics.median(times):>8.2f} ms")
+            print(f"downloads from mock: {mock_app['image_downloads']}")
+    stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Image store hit vs DALL·E generation benchmark")
+    parser.add_argument("--prompts", type=int, default=20)
+    parser.add_argument("--image-latency", type=float, default=0.5)
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+    main(args.prompts, args.image_latency, args.repeat)
@@ -0,0 +1,248 @@
+# load_test.py
+# تست بار end-to-end برای gateway: سرور mock (Gemini + تصویر OpenAI) و خود gateway (uvicorn در یک
+# پردازه جداگانه) اجرا می‌شوند و سناریوهای /chat/gen، /code/gen و img: با همزمانی مشخص اجرا می‌شوند.
+# برای هر سناریو throughput و تاخیر p50/p99 گزارش می‌شود.
+# همزمان یک probe سبک (GET /sessions/stats) مرتب فراخوانی می‌شود؛ اگر کدی event loop را مسدود کند،
+# تاخیر probe بالا می‌رود. با --max-probe-p99 در صورت عبور از آستانه، خروجی با کد 1 تمام می‌شود (برای CI).
+# اجرا: python -m bench.load_test --scenarios chat,code,img --requests 300 --concurrency 32 --latency 0.1
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+
+from bench.mock_gemini import start_mock_server_in_thread
+
+SCENARIOS = ("chat", "code", "img")
+PROBE_PATH = "/sessions/stats"
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def request_for(scenario: str, i: int, sessions: int) -> Tuple[str, Dict[str, Any]]:
+    session_id = f"load-{i % sessions}"
+    if scenario == "chat":
+        return "/chat/gen", {"session_id": session_id, "message": f"hello {i}"}
+    if scenario == "code":
+        return "/code/gen", {"prompt": f"write function number {i}", "verbosity": "low"}
+    return "/chat/gen", {"session_id": session_id, "message": f"img: a tree in the rain #{i}"}
+
+
+def is_failure(scenario: str, response: httpx.Response) -> bool:
+    if response.status_code != 200:
+        return True
+    # خطای تولید تصویر در /chat/gen به صورت پیام متنی با کد 200 برگردانده می‌شود
+    return scenario == "img" and response.json().get("response", "").startswith("❌")
+
+
+async def run_scenario(
+    client: httpx.AsyncClient, scenario: str, total: int, concurrency: int, sessions: int
+) -> Dict[str, Any]:
+    latencies: List[float] = []
+    errors = 0
+    counter = iter(range(total))
+
+    async def worker():
+        nonlocal errors
+        for i in counter:
+            path, body = request_for(scenario, i, sessions)
+            started = time.perf_counter()
+            try:
+                response = await client.post(path, json=body)
+                failed = is_failure(scenario, response)
+            except httpx.HTTPError:
+                failed = True
+            latencies.append(time.perf_counter() - started)
+            errors += failed
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    return {
+        "scenario": scenario,
+        "requests": total,
+        "errors": errors,
+        "throughput": total / elapsed,
+        "p50": percentile(latencies, 0.5),
+        "p99": percentile(latencies, 0.99),
+    }
+
+
+async def probe(client: httpx.AsyncClient, stop: asyncio.Event, interval: float) -> List[float]:
+    latencies: List[float] = []
+    while not stop.is_set():
+        started = time.perf_counter()
+        try:
+            await client.get(PROBE_PATH)
+            latencies.append(time.perf_counter() - started)
+        except httpx.HTTPError:
+            pass
+        try:
+            await asyncio.wait_for(stop.wait(), interval)
+        except asyncio.TimeoutError:
+            pass
+    return latencies
+
+
+async def drive(gateway_url: str, scenarios: List[str], total: int, concurrency: int, sessions: int, probe_interval: float):
+    limits = httpx.Limits(max_connections=concurrency + 4, max_keepalive_connections=concurrency + 4)
+    async with httpx.AsyncClient(base_url=gateway_url, timeout=120, limits=limits) as client, \
+            httpx.AsyncClient(base_url=gateway_url, timeout=30) as probe_client:
+        results = []
+        for scenario in scenarios:
+            stop = asyncio.Event()
+            probe_task = asyncio.create_task(probe(probe_client, stop, probe_interval))
+            result = await run_scenario(client, scenario, total, concurrency, sessions)
+            stop.set()
+            probe_latencies = await probe_task
+            result["probe_p50"] = percentile(probe_latencies, 0.5)
+            result["probe_p99"] = percentile(probe_latencies, 0.99)
+            results.append(result)
+        return results
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def write_bench_model_config(directory: str) -> str:
+    # نرخ‌های مدل در models.json برای تولید واقعی تنظیم شده‌اند؛ در تست بار، محدودکننده خود gateway
+    # نباید گلوگاه باشد، پس یک نسخه با نرخ بالا ساخته می‌شود (مگر با --respect-rate-limits)
+    from function.router import load_model_config
+
+    config = json.loads(json.dumps(load_model_config("models.json")))
+    for settings in config.get("models", {}).values():
+        settings["rate"] = 100_000
+        settings["concurrency"] = 1024
+    path = os.path.join(directory, "models.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(config, f)
+    return path
+
+
+def start_gateway(gemini_url: str, openai_url: str, workdir: str, respect_rate_limits: bool, workers: int):
+    port = free_port()
+    env = {
+        **os.environ,
+        "GOOGLE_API_KEY": "bench",
+        "OPENAI_API_KEY": "bench",
+        "GEMINI_API_BASE_URL": gemini_url,
+        "OPENAI_BASE_URL": openai_url,
+        "LOG_LEVEL": "WARNING",
+        "SESSION_DB_PATH": "",
+        "TRANSLATION_CACHE_PATH": "",
+        "JOBS_DB_PATH": "",
+        "CODE_CACHE_BACKEND": "off",
+    }
+    if workers > 1:
+        env.update(SESSION_BACKEND="sqlite", SESSION_DB_PATH=os.path.join(workdir, "sessions.db"))
+    if not respect_rate_limits:
+        env.update(
+            MODEL_CONFIG_PATH=write_bench_model_config(workdir),
+            GEMINI_RATE_PER_SECOND="100000",
+            OPENAI_RATE_PER_SECOND="100000",
+            UPSTREAM_MAX_CONCURRENCY="4096",
+            IMAGE_MAX_CONCURRENCY="256",
+            IMAGE_MAX_QUEUE="4096",
+        )
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--workers", str(workers), "--log-level", "warning"],
+        env=env,
+    )
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError("gateway هنگام راه‌اندازی متوقف شد.")
+        try:
+            if httpx.get(url + PROBE_PATH, timeout=1).status_code == 200:
+                return process, url
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError("gateway در 30 ثانیه آماده نشد.")
+
+
+def print_report(results: List[Dict[str, Any]]) -> None:
+    print(f"{'scenario':<8} {'reqs':>6} {'errors':>6} {'req/s':>8} {'p50 ms':>8} {'p99 ms':>8} {'probe p50':>10} {'probe p99':>10}")
+    for r in results:
+        print(
+            f"{r['scenario']:<8} {r['requests']:>6} {r['errors']:>6} {r['throughput']:>8.1f} "
+            f"{r['p50'] * 1000:>8.1f} {r['p99'] * 1000:>8.1f} {r['probe_p50'] * 1000:>10.1f} {r['probe_p99'] * 1000:>10.1f}"
+        )
+
+
+def main(args) -> int:
+    scenarios = [s.strip() for s in args.scenarios.split(",") if s.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        raise SystemExit(f"unknown scenarios: {', '.join(sorted(unknown))}")
+
+    stop_mock = None
+    process: Optional[subprocess.Popen] = None
+    with tempfile.TemporaryDirectory() as workdir:
+        try:
+            gateway_url = args.gateway_url
+            if gateway_url is None:
+                gemini_url, mock_app, stop_mock = start_mock_server_in_thread(
+                    latency=args.latency,
+                    error_rate=args.error_rate,
+                    error_status=args.error_status,
+                    image_latency=args.image_latency,
+                )
+                process, gateway_url = start_gateway(
+                    gemini_url, mock_app["openai_base_url"], workdir, args.respect_rate_limits, args.workers
+                )
+            results = asyncio.run(
+                drive(gateway_url, scenarios, args.requests, args.concurrency, args.sessions, args.probe_interval)
+            )
+        finally:
+            if process is not None:
+                process.terminate()
+                process.wait()
+            if stop_mock is not None:
+                stop_mock()
+
+    print_report(results)
+    if args.json:
+        print(json.dumps(results))
+    if args.max_probe_p99 is not None:
+        worst = max(r["probe_p99"] for r in results) * 1000
+        if worst > args.max_probe_p99:
+            print(f"FAIL: probe p99 {worst:.1f} ms > {args.max_probe_p99} ms (event loop blocked?)")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="End-to-end load test against a mock Gemini/OpenAI upstream")
+    parser.add_argument("--scenarios", default="chat,code,img", help="comma-separated: chat, code, img")
+    parser.add_argument("--requests", type=int, default=300, help="requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--sessions", type=int, default=64, help="distinct chat session ids")
+    parser.add_argument("--latency", type=float, default=0.1, help="mock Gemini latency (s)")
+    parser.add_argument("--image-latency", type=float, default=0.5, help="mock image latency (s)")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--error-status", type=int, default=503)
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn workers for the gateway")
+    parser.add_argument("--probe-interval", type=float, default=0.05)
+    parser.add_argument("--max-probe-p99", type=float, default=None, help="fail if probe p99 (ms) exceeds this")
+    parser.add_argument("--respect-rate-limits", action="store_true", help="keep the rates from models.json")
+    parser.add_argument("--gateway-url", default=None, help="test an already running gateway instead")
+    parser.add_argument("--json", action="store_true", help="also print results as JSON")
+    sys.exit(main(parser.parse_args()))
@@ -0,0 +1,236 @@
+# mock_gemini.py
+# سرور mock محلی برای Gemini API (و endpoint تولید تصویر OpenAI) که برای بنچمارک‌ها استفاده می‌شود.
+# اجرا به صورت مستقل: python -m bench.mock_gemini --port 8765 --latency 0.2 --error-rate 0.05
+import argparse
+import asyncio
+import hashlib
+import json
+import random
+import struct
+import threading
+import time
+import uuid
+import zlib
+
+from aiohttp import web
+
+
+def mock_png(seed: bytes, width: int = 64, height: int = 64) -> bytes:
+    # یک PNG معتبر تک‌رنگ (رنگ از seed) برای شبیه‌سازی فایل تصویر DALL·E
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+    row = b"\x00" + seed[:3] * width
+    header = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+    return b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header) + chunk(b"IDAT", zlib.compress(row * height)) + chunk(b"IEND", b"")
+
+
+def make_app(
+    latency: float = 0.2,
+    error_rate: float = 0.0,
+    error_status: int = 503,
+    image_latency: float = 1.0,
+    cache_min_bytes: int = 0,
+) -> web.Application:
+    """
+    یک اپلیکیشن aiohttp می‌سازد که endpoint های generateContent و streamGenerateContent را با تاخیر مشخص شبیه‌سازی می‌کند.
+    با error_rate درصدی از درخواست‌ها با error_status (همراه با Retry-After) پاسخ داده می‌شوند.
+    endpoint تولید تصویر OpenAI (/v1/images/generations) نیز با تاخیر image_latency شبیه‌سازی می‌شود.
+    cachedContents (ساخت، تمدید TTL، حذف) هم شبیه‌سازی می‌شود؛ پیشوندهای کوچک‌تر از cache_min_bytes رد می‌شوند.
+    """
+    app = web.Application()
+    app["latency"] = latency
+    app["image_latency"] = image_latency
+    app["error_rate"] = error_rate
+    app["error_status"] = error_status
+    app["calls"] = 0
+    app["image_calls"] = 0
+    app["image_downloads"] = 0
+    # cachedContents: نام ← {"model", "bytes", "expires"}؛ request_bytes مجموع حجم بدنه درخواست‌های generateContent است
+    app["cache_min_bytes"] = cache_min_bytes
+    app["cached_contents"] = {}
+    app["cache_hits"] = 0
+    app["request_bytes"] = 0
+
+    def candidate(text: str):
+        return {"candidates": [{"content": {"role": "model", "parts": [{"text": text}]}}]}
+
+    def injected_error(request: web.Request):
+        if random.random() >= request.app["error_rate"]:
+            return None
+        return web.json_response(
+            {"error": {"code": request.app["error_status"], "message": "injected error"}},
+            status=request.app["error_status"],
+            headers={"Retry-After": "0"},
+        )
+
+    async def read_payload(request: web.Request):
+        body = await request.read()
+        request.app["request_bytes"] += len(body)
+        return json.loads(body)
+
+    def cache_error(request: web.Request, payload: dict):
+        # مثل Gemini: cache ناموجود/منقضی 404، و cachedContent همراه با systemInstruction یا مدل دیگر 400
+        name = payload.get("cachedContent")
+        if name is None:
+            return None
+        model = "models/" + request.match_info["model_method"].split(":")[0]
+        cached = request.app["cached_contents"].get(name)
+        if cached is None or cached["expires"] <= time.time():
+            request.app["cached_contents"].pop(name, None)
+            return web.json_response({"error": {"code": 404, "message": "CachedContent not found"}}, status=404)
+        if "systemInstruction" in payload or cached["model"] != model:
+            return web.json_response({"error": {"code": 400, "message": "invalid cachedContent usage"}}, status=400)
+        request.app["cache_hits"] += 1
+        return None
+
+    async def generate_content(request: web.Request) -> web.StreamResponse:
+        model_method = request.match_info["model_method"]
+        if model_method.endswith(":streamGenerateContent"):
+            return await stream_generate_content(request)
+        if not model_method.endswith(":generateContent"):
+            raise web.HTTPNotFound()
+        payload = await read_payload(request)
+        request.app["calls"] += 1
+        error = cache_error(request, payload)
+        if error is not None:
+            return error
+        await asyncio.sleep(request.app["latency"])
+        error = injected_error(request)
+        if error is not None:
+            return error
+        last_text = payload["contents"][-1]["parts"][0]["text"]
+        return web.json_response(candidate(f"echo: {last_text}"))
+
+    async def stream_generate_content(request: web.Request) -> web.StreamResponse:
+        # پاسخ را کلمه به کلمه و با فرمت SSE (مانند alt=sse در Gemini) ارسال می‌کند
+        payload = await read_payload(request)
+        request.app["calls"] += 1
+        error = cache_error(request, payload) or injected_error(request)
+        if error is not None:
+            return error
+        last_text = payload["contents"][-1]["parts"][0]["text"]
+        words = f"echo: {last_text}".split(" ")
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        delay = request.app["latency"] / max(len(words), 1)
+        for i, word in enumerate(words):
+            await asyncio.sleep(delay)
+            text = word if i == 0 else " " + word
+            await response.write(f"data: {json.dumps(candidate(text))}\r\n\r\n".encode())
+        await response.write_eof()
+        return response
+
+    def parse_ttl(value: str) -> float:
+        return float(value.rstrip("s"))
+
+    async def create_cached_content(request: web.Request) -> web.Response:
+        body = await request.read()
+        payload = json.loads(body)
+        if len(body) < request.app["cache_min_bytes"]:
+            return web.json_response(
+                {"error": {"code": 400, "message": "Cached content is too small"}}, status=400
+            )
+        name = f"cachedContents/{uuid.uuid4().hex[:12]}"
+        ttl = parse_ttl(payload.get("ttl", "3600s"))
+        request.app["cached_contents"][name] = {"model": payload["model"], "bytes": len(body), "expires": time.time() + ttl}
+        return web.json_response({"name": name, "model": payload["model"], "expireTime": time.time() + ttl})
+
+    async def update_cached_content(request: web.Request) -> web.Response:
+        name = f"cachedContents/{request.match_info['cache_id']}"
+        cached = request.app["cached_contents"].get(name)
+        if cached is None or cached["expires"] <= time.time():
+            return web.json_response({"error": {"code": 404, "message": "CachedContent not found"}}, status=404)
+        if request.method == "DELETE":
+            del request.app["cached_contents"][name]
+            return web.json_response({})
+        cached["expires"] = time.time() + parse_ttl((await request.json())["ttl"])
+        return web.json_response({"name": name, "model": cached["model"], "expireTime": cached["expires"]})
+
+    async def generate_image(request: web.Request) -> web.Response:
+        # پاسخ سازگار با OpenAI images.generate؛ URL تصویر از hash پرامپت ساخته می‌شود
+        payload = await request.json()
+        request.app["image_calls"] += 1
+        await asyncio.sleep(request.app["image_latency"])
+        error = injected_error(request)
+        if error is not None:
+            return error
+        digest = hashlib.sha256(f"{payload.get('size')}:{payload['prompt']}".encode()).hexdigest()[:16]
+        # مثل لینک‌های DALL·E، فایل تصویر از یک آدرس جداگانه دانلود می‌شود
+        url = f"{request.scheme}://{request.host}/mock-images/{digest}.png"
+        return web.json_response({"created": int(time.time()), "data": [{"url": url}]})
+
+    async def download_image(request: web.Request) -> web.Response:
+        request.app["image_downloads"] += 1
+        digest = request.match_info["digest"]
+        return web.Response(body=mock_png(bytes.fromhex(digest)), content_type="image/png")
+
+    app.router.add_post("/v1beta/models/{model_method}", generate_content)
+    app.router.add_post("/v1/images/generations", generate_image)
+    app.router.add_get("/mock-images/{digest:[0-9a-f]+}.png", download_image)
+    app.router.add_post("/v1beta/cachedContents", create_cached_content)
+    app.router.add_patch("/v1beta/cachedContents/{cache_id}", update_cached_content)
+    app.router.add_delete("/v1beta/cachedContents/{cache_id}", update_cached_content)
+    return app
+
+
+async def start_mock_server(host: str = "127.0.0.1", port: int = 0, latency: float = 0.2, **options):
+    """
+    سرور mock را در event loop فعلی اجرا می‌کند و (runner, base_url, app) را برمی‌گرداند.
+    آدرس پایه سازگار با OpenAI در app["openai_base_url"] قرار می‌گیرد.
+    """
+    app = make_app(latency, **options)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    bound_port = site._server.sockets[0].getsockname()[1]
+    app["openai_base_url"] = f"http://{host}:{bound_port}/v1"
+    return runner, f"http://{host}:{bound_port}/v1beta/models", app
+
+
+def start_mock_server_in_thread(latency: float = 0.2, host: str = "127.0.0.1", **options):
+    """
+    سرور mock را در یک thread با event loop جداگانه اجرا می‌کند تا کلاینت‌های مسدودکننده
+    هم قابل اندازه‌گیری باشند. (base_url, app, stop) را برمی‌گرداند.
+    options (error_rate، error_status، image_latency) به make_app داده می‌شوند.
+    """
+    loop = asyncio.new_event_loop()
+    started = threading.Event()
+    state = {}
+
+    def run():
+        asyncio.set_event_loop(loop)
+        state["runner"], state["base_url"], state["app"] = loop.run_until_complete(
+            start_mock_server(host=host, latency=latency, **options)
+        )
+        started.set()
+        loop.run_forever()
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    started.wait()
+
+    def stop():
+        asyncio.run_coroutine_threadsafe(state["runner"].cleanup(), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+
+    return state["base_url"], state["app"], stop
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mock Gemini / OpenAI images server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--image-latency", type=float, default=1.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--error-status", type=int, default=503)
+    parser.add_argument("--cache-min-bytes", type=int, default=0)
+    args = parser.parse_args()
+    web.run_app(
+        make_app(args.latency, args.error_rate, args.error_status, args.image_latency, args.cache_min_bytes),
+        host=args.host,
+        port=args.port,
+    )
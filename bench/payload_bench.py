@@ -0,0 +1,48 @@
+# payload_bench.py
+# مقایسه حجم و زمان serialize پاسخ /chat/gen در حالت قدیمی (کل تاریخچه) و حالت delta.
+# اجرا: python -m bench.payload_bench --turns 10 100 500
+import argparse
+import os
+import time
+
+os.environ.setdefault("GOOGLE_API_KEY", "bench")
+
+from main import ChatResponse  # noqa: E402
+
+TURN_TEXT = "این یک پیام نمونه برای سنجش حجم پاسخ است. " * 8
+
+
+def make_history(turns: int):
+    return [
+        {"role": "user" if i % 2 == 0 else "model", "parts": [{"text": f"{i}: {TURN_TEXT}"}]}
+        for i in range(turns)
+    ]
+
+
+def measure(response: ChatResponse, repeat: int):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        body = response.model_dump_json(exclude_none=True)
+    elapsed = (time.perf_counter() - start) / repeat
+    return len(body.encode("utf-8")), elapsed * 1e6
+
+
+def main(turn_counts, repeat: int):
+    print(f"{'turns':>6} | {'full bytes':>11} {'full µs':>9} | {'delta bytes':>11} {'delta µs':>9}")
+    for turns in turn_counts:
+        history = make_history(turns)
+        full = ChatResponse(session_id="bench", response=history[-1]["parts"][0]["text"], history=history)
+        delta = ChatResponse(
+            session_id="bench", response=history[-1]["parts"][0]["text"], turns=history[-2:], history_version=turns
+        )
+        full_bytes, full_us = measure(full, repeat)
+        delta_bytes, delta_us = measure(delta, repeat)
+        print(f"{turns:>6} | {full_bytes:>11} {full_us:>9.1f} | {delta_bytes:>11} {delta_us:>9.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="ChatResponse payload size benchmark")
+    parser.add_argument("--turns", type=int, nargs="+", default=[10, 100, 500])
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+    main(args.turns, args.repeat)
@@ -0,0 +1,62 @@
+# singleflight_bench.py
+# تست بار برای ادغام درخواست‌های یکسان: تعداد زیادی درخواست همزمان /code/gen و ترجمه img:
+# با پرامپت یکسان ارسال می‌شود و تعداد فراخوانی‌های واقعی سرور mock Gemini شمرده می‌شود.
+# اجرا: python -m bench.singleflight_bench --burst 100 --distinct 5
+import argparse
+import asyncio
+import os
+import time
+
+from bench.mock_gemini import start_mock_server_in_thread
+
+
+async def run_burst(main, burst: int, distinct: int):
+    import httpx
+
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://gateway", timeout=60) as client:
+        requests = []
+        for i in range(burst):
+            prompt = f"write a quicksort variant {i % distinct}"
+            requests.append(client.post("/code/gen", json={"prompt": prompt, "verbosity": "low"}))
+            # ترجمه همان مسیری است که img: قبل از DALL·E طی می‌کند
+            requests.append(main.translate_prompt_if_needed(f"یک درخت در باران شماره {i % distinct}"))
+        start = time.perf_counter()
+        await asyncio.gather(*requests)
+        elapsed = time.perf_counter() - start
+    # کلاینت upstream به event loop این اجرا وابسته است
+    await main.gemini_client.aclose()
+    return elapsed
+
+
+def main(burst: int, distinct: int, latency: float):
+    base_url, mock_app, stop = start_mock_server_in_thread(latency=latency)
+    os.environ["GEMINI_API_BASE_URL"] = base_url
+    os.environ.setdefault("GOOGLE_API_KEY", "bench")
+    # cache ترجمه روی دیسک در این تست غیرفعال است تا فقط اثر single-flight دیده شود
+    os.environ["TRANSLATION_CACHE_PATH"] = ""
+    os.environ["JOBS_DB_PATH"] = ""
+    import main as gateway
+
+    try:
+        for enabled in (False, True):
+            gateway.upstream_flight = gateway.SingleFlight() if enabled else None
+            gateway.translation_cache._memory.clear()
+            mock_app["calls"] = 0
+            elapsed = asyncio.run(run_burst(gateway, burst, distinct))
+            label = "single-flight on " if enabled else "single-flight off"
+            print(
+                f"{label}: {burst * 2} requests -> {mock_app['calls']:4d} upstream calls "
+                f"in {elapsed:.2f}s"
+            )
+    finally:
+        stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Single-flight coalescing load test")
+    parser.add_argument("--burst", type=int, default=100)
+    parser.add_argument("--distinct", type=int, default=5)
+    parser.add_argument("--latency", type=float, default=0.2)
+    args = parser.parse_args()
+    main(args.burst, args.distinct, args.latency)
@@ -0,0 +1,111 @@
+# startup_bench.py
+# زمان import ماژول main و زمان cold start (import به همراه اجرای hookهای راه‌اندازی lifespan) در پروسه‌های تازه.
+# زمان import با python -X importtime اندازه‌گیری می‌شود و کندترین ماژول‌ها (زمان تجمعی) نمایش داده می‌شوند.
+# اگر ماژول ممنوعی (پیش‌فرض: openai که فقط باید با اولین درخواست img: بارگذاری شود) import شود یا زمان import
+# از --max-import-ms بیشتر شود، با کد خروج 1 تمام می‌شود تا در CI جلوی کند شدن راه‌اندازی گرفته شود.
+# اجرا: python -m bench.startup_bench --repeat 5 --top 15 --max-import-ms 800
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List, Tuple
+
+# اجرای hookهای startup و shutdown بدون سرور HTTP؛ زمان از شروع پروسه تا پایان startup چاپ می‌شود
+COLD_START_SCRIPT = """
+import asyncio, time
+started = time.perf_counter()
+import main
+async def run():
+    async with main.app.router.lifespan_context(main.app):
+        print((time.perf_counter() - started) * 1000)
+asyncio.run(run())
+"""
+
+
+def bench_env(directory: str) -> Dict[str, str]:
+    # مسیرهای cache و workspace در پوشه موقت تا اجرای بنچمارک روی داده‌های واقعی اثر نگذارد
+    env = dict(os.environ)
+    env.setdefault("GOOGLE_API_KEY", "bench")
+    env["LOG_LEVEL"] = "WARNING"
+    env["WORKSPACE_DIR"] = os.path.join(directory, "workspace")
+    env["WORKSPACE_INDEX_PATH"] = os.path.join(directory, "workspace_index.db")
+    env["JOBS_DB_PATH"] = os.path.join(directory, "jobs.db")
+    env["TRANSLATION_CACHE_PATH"] = os.path.join(directory, "translations.db")
+    return env
+
+
+def parse_importtime(stderr: str) -> Dict[str, Tuple[int, int]]:
+    """
+    خروجی -X importtime را به {ماژول: (زمان خود ماژول، زمان تجمعی)} به میکروثانیه تبدیل می‌کند.
+    """
+    modules = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        if not self_us.strip().isdigit():
+            continue  # سطر عنوان
+        modules[name.strip()] = (int(self_us), int(cumulative_us))
+    return modules
+
+
+def measure_import(env: Dict[str, str]) -> Dict[str, Tuple[int, int]]:
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main"], env=env, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"import main ناموفق بود:\n{result.stderr[-2000:]}")
+    return parse_importtime(result.stderr)
+
+
+def measure_cold_start(env: Dict[str, str]) -> float:
+    result = subprocess.run([sys.executable, "-c", COLD_START_SCRIPT], env=env, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"راه‌اندازی ناموفق بود:\n{result.stderr[-2000:]}")
+    return float(result.stdout.strip().splitlines()[-1])
+
+
+def main(repeat: int, top: int, forbidden: List[str], max_import_ms: float, cold_start: bool) -> int:
+    with tempfile.TemporaryDirectory() as directory:
+        env = bench_env(directory)
+        runs = [measure_import(env) for _ in range(repeat)]
+        totals = [run["main"][1] / 1000 for run in runs]
+        print(f"import main: median {statistics.median(totals):.1f} ms (min {min(totals):.1f}, max {max(totals):.1f}, runs {repeat})")
+
+        # کندترین ماژول‌ها بر اساس میانه زمان تجمعی (بدون خود main)
+        names = set().union(*runs) - {"main"}
+        cumulative = {name: statistics.median(run.get(name, (0, 0))[1] for run in runs) / 1000 for name in names}
+        print(f"\ntop {top} modules by cumulative import time:")
+        for name, ms in sorted(cumulative.items(), key=lambda item: item[1], reverse=True)[:top]:
+            print(f"  {ms:>8.1f} ms  {name}")
+
+        if cold_start:
+            starts = [measure_cold_start(env) for _ in range(repeat)]
+            print(f"\ncold start (import + lifespan startup): median {statistics.median(starts):.1f} ms")
+
+    failed = False
+    loaded = sorted(name for name in names if name.split(".")[0] in forbidden)
+    if loaded:
+        print(f"\nFAIL: forbidden modules imported at startup: {', '.join(loaded[:10])}")
+        failed = True
+    if max_import_ms and statistics.median(totals) > max_import_ms:
+        print(f"\nFAIL: import time {statistics.median(totals):.1f} ms exceeds {max_import_ms:.0f} ms")
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Import-time / cold-start benchmark for main:app")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--forbid", action="append", default=None, help="top-level module that must not be imported (default: openai)")
+    parser.add_argument("--max-import-ms", type=float, default=0, help="fail if median import time exceeds this (0: no limit)")
+    parser.add_argument("--no-cold-start", action="store_true", help="only measure import time")
+    args = parser.parse_args()
+    started = time.perf_counter()
+    code = main(args.repeat, args.top, args.forbid or ["openai"], args.max_import_ms, not args.no_cold_start)
+    print(f"\n(bench finished in {time.perf_counter() - started:.1f}s)")
+    sys.exit(code)
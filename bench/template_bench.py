@@ -0,0 +1,70 @@
+# template_bench.py
+# مقایسه ساخت و serialize payload کد/چت به روش قدیمی (ساخت کامل dict + json.dumps مثل httpx) با
+# قالب‌های از پیش encode‌شده (function/payloads.py) و همچنین decode پاسخ Gemini با json و decoder سریع.
+# اجرا: python -m bench.template_bench --turns 1 20 100
+import argparse
+import json
+import os
+import timeit
+
+os.environ.setdefault("GOOGLE_API_KEY", "bench")
+
+from function.payloads import ORJSON_AVAILABLE, encode_payload, loads  # noqa: E402
+from main import build_chat_payload, build_code_payload, chat_system_instruction_text, get_code_system_instruction  # noqa: E402
+
+TURN_TEXT = "این یک پیام نمونه برای سنجش ساخت payload است. " * 8
+
+
+def legacy_code_body(prompt: str, verbosity: str) -> bytes:
+    payload = {
+        "contents": [{"role": "user", "parts": [{"text": prompt}]}],
+        "generationConfig": {"responseMimeType": "text/plain"},
+        "systemInstruction": {"parts": [{"text": get_code_system_instruction(verbosity)}]},
+    }
+    return json.dumps(payload).encode("utf-8")
+
+
+def legacy_chat_body(history) -> bytes:
+    payload = {"contents": history, "systemInstruction": {"parts": [{"text": chat_system_instruction_text}]}}
+    return json.dumps(payload).encode("utf-8")
+
+
+def make_history(turns: int):
+    return [
+        {"role": "user" if i % 2 == 0 else "model", "parts": [{"text": f"{i}: {TURN_TEXT}"}]}
+        for i in range(turns)
+    ]
+
+
+def per_call_us(fn, number: int) -> float:
+    return min(timeit.repeat(fn, number=number, repeat=3)) / number * 1e6
+
+
+def main(turn_counts, number: int):
+    print(f"orjson: {'yes' if ORJSON_AVAILABLE else 'no (stdlib json)'}")
+    print(f"{'payload':<12} | {'legacy µs':>10} {'template µs':>12}")
+    prompt = "Write a function that parses a CSV file and returns rows as dicts."
+    legacy = per_call_us(lambda: legacy_code_body(prompt, "medium"), number)
+    current = per_call_us(lambda: encode_payload(build_code_payload(prompt, "medium")), number)
+    print(f"{'code':<12} | {legacy:>10.1f} {current:>12.1f}")
+    for turns in turn_counts:
+        history = make_history(turns)
+        legacy = per_call_us(lambda: legacy_chat_body(history), number)
+        current = per_call_us(lambda: encode_payload(build_chat_payload(history)), number)
+        print(f"{f'chat/{turns}':<12} | {legacy:>10.1f} {current:>12.1f}")
+
+    response = json.dumps({
+        "candidates": [{"content": {"role": "model", "parts": [{"text": TURN_TEXT * 20}]}, "finishReason": "STOP"}],
+        "usageMetadata": {"promptTokenCount": 100, "candidatesTokenCount": 2000},
+    }).encode("utf-8")
+    legacy = per_call_us(lambda: json.loads(response), number)
+    current = per_call_us(lambda: loads(response), number)
+    print(f"{'decode':<12} | {legacy:>10.1f} {current:>12.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Gemini request payload build/encode benchmark")
+    parser.add_argument("--turns", type=int, nargs="+", default=[1, 20, 100])
+    parser.add_argument("--number", type=int, default=2000)
+    args = parser.parse_args()
+    main(args.turns, args.number)
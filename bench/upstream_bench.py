@@ -0,0 +1,64 @@
+# upstream_bench.py
+# مقایسه توان عملیاتی (throughput) درخواست‌های همزمان به Gemini:
+# روش قدیمی (requests.post مسدودکننده بدون session) در برابر GeminiClient مشترک async.
+# اجرا: python -m bench.upstream_bench --requests 200 --concurrency 50 --latency 0.1
+import argparse
+import asyncio
+import time
+
+import requests
+
+from bench.mock_gemini import start_mock_server_in_thread
+from function.upstream import GeminiClient
+
+MODEL = "gemini-1.5-flash-latest"
+
+
+def make_payload(i: int):
+    return {"contents": [{"role": "user", "parts": [{"text": f"hello {i}"}]}]}
+
+
+async def run_blocking(base_url: str, total: int, concurrency: int) -> float:
+    # همان الگوی قدیمی call_gemini_api: requests.post داخل coroutine
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(i: int):
+        async with semaphore:
+            response = requests.post(f"{base_url}/{MODEL}:generateContent?key=bench", json=make_payload(i))
+            response.raise_for_status()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(total)))
+    return time.perf_counter() - start
+
+
+async def run_pooled(base_url: str, total: int, concurrency: int) -> float:
+    client = GeminiClient(api_key="bench", base_url=base_url, default_model_limit=concurrency)
+    try:
+        start = time.perf_counter()
+        await asyncio.gather(*(client.generate_content(MODEL, make_payload(i)) for i in range(total)))
+        return time.perf_counter() - start
+    finally:
+        await client.aclose()
+
+
+def main(total: int, concurrency: int, latency: float, skip_blocking: bool):
+    base_url, _, stop = start_mock_server_in_thread(latency=latency)
+    try:
+        if not skip_blocking:
+            blocking = asyncio.run(run_blocking(base_url, total, concurrency))
+            print(f"blocking requests.post : {total / blocking:8.1f} req/s ({blocking:.2f}s)")
+        pooled = asyncio.run(run_pooled(base_url, total, concurrency))
+        print(f"pooled GeminiClient    : {total / pooled:8.1f} req/s ({pooled:.2f}s)")
+    finally:
+        stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Upstream client throughput benchmark")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--latency", type=float, default=0.1)
+    parser.add_argument("--skip-blocking", action="store_true")
+    args = parser.parse_args()
+    main(args.requests, args.concurrency, args.latency, args.skip_blocking)
@@ -0,0 +1,62 @@
+# workspace_index_bench.py
+# زمان لیست صفحه‌بندی‌شده و جستجوی محتوا/مسیر در WorkspaceIndex با تعداد زیادی فایل.
+# ردیف‌های ایندکس مستقیماً ساخته می‌شوند (بدون ساخت فایل روی دیسک) تا فقط هزینه پرس‌وجوها سنجیده شود.
+# اجرا: python -m bench.workspace_index_bench --files 200000
+import argparse
+import random
+import tempfile
+import time
+
+from function.workspace_index import WorkspaceIndex
+
+WORDS = ("request", "session", "handler", "payload", "router", "cache", "stream", "worker", "token", "image")
+
+
+def make_rows(count: int, seed: int = 7):
+    rng = random.Random(seed)
+    for i in range(count):
+        words = " ".join(rng.choice(WORDS) for _ in range(40))
+        body = f"def generated_{i}():\n    # {words}\n    return 'marker_{i:06d}'\n"
+        yield f"project_{i % 100:02d}/module_{i // 100:04d}/file_{i:06d}.py", len(body), time.time(), body
+
+
+def timed_ms(fn, repeat: int = 20) -> float:
+    started = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - started) / repeat * 1000
+
+
+def main(files: int):
+    with tempfile.TemporaryDirectory() as root:
+        index = WorkspaceIndex(root)
+        started = time.perf_counter()
+        batch = []
+        for row in make_rows(files):
+            batch.append(row)
+            if len(batch) >= 5000:
+                index._write_batch(batch)
+                batch = []
+        index._write_batch(batch)
+        print(f"indexed {files} files in {time.perf_counter() - started:.1f}s (trigram={index.fts})")
+
+        _, cursor = index.list(limit=100)
+        deep_cursor = f"project_50/module_{files // 200:04d}/"
+        rows = [
+            ("list first page", lambda: index.list(limit=100)),
+            ("list next page", lambda: index.list(cursor=cursor, limit=100)),
+            ("list deep page", lambda: index.list(cursor=deep_cursor, limit=100)),
+            ("list prefix", lambda: index.list(prefix="project_42/", limit=100)),
+            ("search rare", lambda: index.search(f"marker_{files // 2:06d}")),
+            ("search common", lambda: index.search("payload router", limit=50)),
+            ("search path", lambda: index.search(f"file_{files // 3:06d}", field="path")),
+        ]
+        for name, fn in rows:
+            print(f"{name:<16} {timed_ms(fn):>8.2f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Workspace index list/search benchmark")
+    parser.add_argument("--files", type=int, default=200_000)
+    args = parser.parse_args()
+    main(args.files)
@@ -1,18 +1,217 @@
 # bot.py
+import asyncio
+import io
+import json
+import re
 import discord
 import aiohttp
 import os
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, List, Optional, Set, Tuple
 from dotenv import load_dotenv
 
 load_dotenv()
 TOKEN = os.getenv("DISCORD_BOT_TOKEN")
-API_URL = "http://localhost:8000/chat/gen"
+GATEWAY_URL = os.getenv("GATEWAY_URL", "http://localhost:8000").rstrip("/")
+# پاسخ‌ها به صورت stream (SSE) دریافت و به تدریج در دیسکورد نمایش داده می‌شوند
+STREAM_URL = f"{GATEWAY_URL}/chat/stream"
+
+# سقف درخواست‌های همزمان بات به gateway (کل) و برای هر کاربر، و تعداد پیام‌های در انتظار هر کاربر
+BOT_MAX_CONCURRENCY = int(os.getenv("BOT_MAX_CONCURRENCY", "8"))
+BOT_PER_USER_CONCURRENCY = int(os.getenv("BOT_PER_USER_CONCURRENCY", "1"))
+BOT_MAX_QUEUED_PER_USER = int(os.getenv("BOT_MAX_QUEUED_PER_USER", "3"))
+BOT_REQUEST_TIMEOUT = float(os.getenv("BOT_REQUEST_TIMEOUT", "180"))
+# حداقل فاصله بین ویرایش پیام‌ها هنگام stream (محدودیت نرخ دیسکورد)
+BOT_EDIT_INTERVAL = float(os.getenv("BOT_EDIT_INTERVAL", "1.0"))
+# پاسخ‌های طولانی‌تر از این مقدار به جای چند پیام به صورت فایل ضمیمه ارسال می‌شوند
+BOT_ATTACH_THRESHOLD = int(os.getenv("BOT_ATTACH_THRESHOLD", "6000"))
+# حداکثر طول هر پیام (سقف دیسکورد 2000 کاراکتر است؛ کمی فضا برای بستن code fence می‌ماند)
+MESSAGE_LIMIT = 1900
+IMAGE_URL_RE = re.compile(r"https://\S+?\.(?:png|jpe?g|webp)\S*", re.IGNORECASE)
+# لینک تصاویر ذخیره‌شده در gateway (/images/{key}.{ext})؛ فایل از gateway دریافت و به صورت ضمیمه ارسال می‌شود
+STORED_IMAGE_RE = re.compile(r"/images/([0-9a-f]{32})(?:\.(png|jpg|webp))?\b")
 
 intents = discord.Intents.default()
 intents.messages = True
 intents.message_content = True
 
-client = discord.Client(intents=intents)
+
+class UserQueueFull(Exception):
+    pass
+
+
+class RequestLimiter:
+    """
+    محدودکننده همزمانی با صف: هر کاربر حداکثر per_user_limit درخواست همزمان و max_queued پیام در انتظار
+    دارد و کل بات حداکثر global_limit درخواست همزمان به gateway می‌فرستد. پیام‌های اضافه منتظر می‌مانند
+    تا انفجار پیام در سرورهای شلوغ به gateway منتقل نشود.
+    """
+
+    def __init__(self, global_limit: int, per_user_limit: int, max_queued_per_user: int):
+        self.per_user_limit = per_user_limit
+        self.max_queued_per_user = max_queued_per_user
+        self._global = asyncio.Semaphore(global_limit)
+        self._user_semaphores: Dict[str, asyncio.Semaphore] = {}
+        self._pending: Dict[str, int] = {}
+
+    @asynccontextmanager
+    async def slot(self, user_id: str):
+        pending = self._pending.get(user_id, 0)
+        if pending >= self.per_user_limit + self.max_queued_per_user:
+            raise UserQueueFull()
+        self._pending[user_id] = pending + 1
+        semaphore = self._user_semaphores.setdefault(user_id, asyncio.Semaphore(self.per_user_limit))
+        try:
+            async with semaphore, self._global:
+                yield
+        finally:
+            self._pending[user_id] -= 1
+            if not self._pending[user_id]:
+                # وقتی کاربر هیچ پیام فعال یا در انتظاری ندارد، وضعیت او حذف می‌شود
+                del self._pending[user_id]
+                del self._user_semaphores[user_id]
+
+
+def _fence_state(text: str, open_fence: Optional[str]) -> Optional[str]:
+    # وضعیت code fence پس از text: خط باز کننده (مثلاً ```python) یا None اگر بلوک کدی باز نباشد
+    for line in text.split("\n"):
+        stripped = line.strip()
+        if stripped.startswith("```"):
+            open_fence = None if open_fence else stripped
+    return open_fence
+
+
+def _cut_point(text: str, budget: int) -> int:
+    """
+    بهترین نقطه برش در budget کاراکتر اول: انتهای یک code fence، سپس خط خالی، سپس هر خط جدید.
+    """
+    window = text[:budget]
+    fence = max(window.rfind("\n```\n"), -1)
+    if fence > budget // 2:
+        return fence + len("\n```")
+    for separator in ("\n\n", "\n"):
+        index = window.rfind(separator)
+        if index > budget // 2:
+            return index
+    return budget
+
+
+def split_message(text: str, limit: int = MESSAGE_LIMIT) -> List[str]:
+    """
+    متن را به پیام‌هایی با حداکثر limit کاراکتر تقسیم می‌کند. برش ترجیحاً در مرز بلوک‌های کد انجام می‌شود؛
+    اگر بلوک کدی بین دو پیام شکسته شود، در پایان پیام بسته و در ابتدای پیام بعد دوباره باز می‌شود.
+    برش هر پیام فقط به متن قبل از آن بستگی دارد، پس پیام‌های قبلی با رسیدن متن جدید تغییر نمی‌کنند.
+    """
+    chunks: List[str] = []
+    open_fence: Optional[str] = None
+    remaining = text
+    while remaining:
+        prefix = f"{open_fence}\n" if open_fence else ""
+        if len(prefix) + len(remaining) <= limit:
+            chunks.append(prefix + remaining)
+            break
+        cut = _cut_point(remaining, limit - len(prefix) - len("\n```"))
+        piece, remaining = remaining[:cut], remaining[cut:]
+        if remaining.startswith("\n"):
+            remaining = remaining[1:]
+        open_fence = _fence_state(piece, open_fence)
+        chunks.append(prefix + piece + ("\n```" if open_fence else ""))
+    return chunks
+
+
+async def sse_events(response: aiohttp.ClientResponse) -> AsyncIterator[Tuple[str, dict]]:
+    """
+    رویدادهای SSE پاسخ gateway را به صورت (نام رویداد، داده JSON) برمی‌گرداند.
+    """
+    event = "message"
+    async for raw_line in response.content:
+        line = raw_line.decode("utf-8").rstrip("\r\n")
+        if line.startswith("event:"):
+            event = line[len("event:"):].strip()
+        elif line.startswith("data:"):
+            yield event, json.loads(line[len("data:"):].strip())
+            event = "message"
+
+
+class StreamedReply:
+    """
+    پاسخ در حال stream: با هر update فقط پیام‌هایی که متنشان تغییر کرده ویرایش و پیام‌های جدید ارسال می‌شوند.
+    """
+
+    def __init__(self, channel, http_session: Optional[aiohttp.ClientSession] = None):
+        self.channel = channel
+        self.http_session = http_session
+        self.messages: List[discord.Message] = []
+        self.rendered: List[str] = []
+
+    async def update(self, text: str):
+        for index, chunk in enumerate(split_message(text)):
+            if index < len(self.messages):
+                if self.rendered[index] != chunk:
+                    await self.messages[index].edit(content=chunk)
+                    self.rendered[index] = chunk
+            else:
+                self.messages.append(await self.channel.send(chunk))
+                self.rendered.append(chunk)
+
+    async def send_stored_image(self, key: str, extension: str = "png") -> bool:
+        filename = f"{key}.{extension}"
+        async with self.http_session.get(f"{GATEWAY_URL}/images/{filename}") as resp:
+            if resp.status != 200:
+                return False
+            data = await resp.read()
+        embed = discord.Embed(title="🎨 تصویر تولیدشده توسط AI")
+        embed.set_image(url=f"attachment://{filename}")
+        await self.channel.send(embed=embed, file=discord.File(io.BytesIO(data), filename=filename))
+        return True
+
+    async def finish(self, text: str):
+        stored_image = STORED_IMAGE_RE.search(text)
+        if stored_image and not self.messages and self.http_session is not None:
+            if await self.send_stored_image(stored_image.group(1), stored_image.group(2) or "png"):
+                return
+        image_url = IMAGE_URL_RE.search(text)
+        if image_url and not self.messages:
+            embed = discord.Embed(title="🎨 تصویر تولیدشده توسط AI")
+            embed.set_image(url=image_url.group(0))
+            await self.channel.send(embed=embed)
+        elif len(text) > BOT_ATTACH_THRESHOLD:
+            # پاسخ خیلی طولانی: پیام‌های موقت حذف و کل پاسخ به صورت فایل ارسال می‌شود
+            for sent in self.messages:
+                await sent.delete()
+            await self.channel.send(
+                "📎 پاسخ طولانی است و به صورت فایل ارسال شد.",
+                file=discord.File(io.BytesIO(text.encode("utf-8")), filename="response.md"),
+            )
+        else:
+            await self.update(text or "❓پاسخی دریافت نشد.")
+
+
+class O2DreamBot(discord.Client):
+    """
+    کلاینت دیسکورد با یک aiohttp.ClientSession مشترک (اتصال‌های pool‌شده به gateway در تمام عمر بات).
+    """
+
+    def __init__(self, **options):
+        super().__init__(**options)
+        self.http_session: aiohttp.ClientSession = None
+        self.limiter = RequestLimiter(BOT_MAX_CONCURRENCY, BOT_PER_USER_CONCURRENCY, BOT_MAX_QUEUED_PER_USER)
+        # پیام‌های تکراری (همان کاربر و همان متن) تا وقتی پیام قبلی در حال پردازش است ادغام می‌شوند
+        self.in_flight: Set[Tuple[str, str]] = set()
+
+    async def setup_hook(self):
+        self.http_session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=BOT_MAX_CONCURRENCY, keepalive_timeout=60),
+            timeout=aiohttp.ClientTimeout(total=BOT_REQUEST_TIMEOUT),
+        )
+
+    async def close(self):
+        if self.http_session is not None:
+            await self.http_session.close()
+        await super().close()
+
+
+client = O2DreamBot(intents=intents)
 
 @client.event
 async def on_ready():
@@ -26,36 +225,62 @@ async def on_message(message):
     user_id = str(message.author.id)
     user_prompt = message.content.strip()
 
-    # نمایش typing هنگام پردازش
-    async with message.channel.typing():
-        payload = {
-            "session_id": f"discord_{user_id}",
-            "message": user_prompt
-        }
+    dedupe_key = (user_id, " ".join(user_prompt.split()).lower())
+    if dedupe_key in client.in_flight:
+        # همین پیام هنوز در حال پردازش است؛ پاسخ پیام قبلی برای این پیام هم کافی است
+        await message.add_reaction("⏳")
+        return
 
-        try:
-            async with aiohttp.ClientSession() as session:
-                async with session.post(API_URL, json=payload) as resp:
-                    if resp.status != 200:
-                        await message.channel.send("❌ خطا در دریافت پاسخ از مدل هوش مصنوعی.")
-                        return
-
-                    data = await resp.json()
-                    response = data.get("response", "❓پاسخی دریافت نشد.")
-
-                    # اگر پاسخ شامل لینک تصویر باشد
-                    if "https://" in response and (".png" in response or ".jpg" in response):
-                        embed = discord.Embed(title="🎨 تصویر تولیدشده توسط AI")
-                        embed.set_image(url=response.strip())
-                        await message.channel.send(embed=embed)
-                    else:
-                        # برای جلوگیری از ارور دیسکورد اگه متن زیاد بود کوتاه کنیم
-                        if len(response) > 1900:
-                            response = response[:1900] + "..."
-                        await message.channel.send(f"{response}")
-
-        except Exception as e:
-            await message.channel.send(f"⛔️ خطای غیرمنتظره:\n{e}")
-            
-            
-client.run(TOKEN)
\ No newline at end of file
+    client.in_flight.add(dedupe_key)
+    try:
+        async with client.limiter.slot(user_id):
+            # نمایش typing هنگام پردازش
+            async with message.channel.typing():
+                await reply(message, user_id, user_prompt)
+    except UserQueueFull:
+        await message.channel.send("⏳ پیام‌های قبلی شما هنوز در حال پردازش هستند. لطفاً کمی صبر کنید.")
+    finally:
+        client.in_flight.discard(dedupe_key)
+
+async def reply(message, user_id: str, user_prompt: str):
+    payload = {
+        "session_id": f"discord_{user_id}",
+        "message": user_prompt
+    }
+
+    try:
+        async with client.http_session.post(STREAM_URL, json=payload) as resp:
+            if resp.status in (429, 503):
+                await message.channel.send("⏳ سرور در حال حاضر شلوغ است. لطفاً چند لحظه دیگر دوباره تلاش کنید.")
+                return
+            if resp.status != 200:
+                await message.channel.send("❌ خطا در دریافت پاسخ از مدل هوش مصنوعی.")
+                return
+
+            streamed = StreamedReply(message.channel, client.http_session)
+            # پاسخ تصویر یک لینک است و نمایش تدریجی ندارد
+            progressive = not user_prompt.lower().startswith("img:")
+            loop = asyncio.get_running_loop()
+            last_update = loop.time()
+            response = ""
+            async for event, data in sse_events(resp):
+                if event == "error":
+                    await message.channel.send(f"❌ {data.get('detail', 'خطا در دریافت پاسخ از مدل هوش مصنوعی.')}")
+                    return
+                if event == "done":
+                    response = data.get("response", response)
+                    break
+                response += data.get("text", "")
+                # تا وقتی پاسخ به اندازه ارسال فایل نرسیده، پیام‌ها حداکثر هر BOT_EDIT_INTERVAL ثانیه به‌روز می‌شوند
+                if progressive and len(response) <= BOT_ATTACH_THRESHOLD and loop.time() - last_update >= BOT_EDIT_INTERVAL:
+                    await streamed.update(response)
+                    last_update = loop.time()
+
+            await streamed.finish(response)
+
+    except Exception as e:
+        await message.channel.send(f"⛔️ خطای غیرمنتظره:\n{e}")
+
+
+if __name__ == "__main__":
+    client.run(TOKEN)
@@ -0,0 +1,124 @@
+# commands.py
+# تجزیه و dispatch دستورات پیام چت (مثل 'img:' و 'code:').
+# هر پیام فقط یک بار تجزیه می‌شود: پیشوند از چند کاراکتر اول خوانده می‌شود (بدون lower() روی کل پیام)
+# و گزینه‌ها (مثل 'verbosity: high' یا 'size: 1792x1024') با regexهای از پیش کامپایل‌شده استخراج می‌شوند.
+# گزینه نامعتبر باعث توقف درخواست نمی‌شود: مقدار پیش‌فرض استفاده و یک هشدار در command.warnings ثبت می‌شود.
+# برای افزودن دستور جدید کافی است آن را با registry.command(...) ثبت و یک handler در Dispatcher اضافه کنید.
+import re
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence
+
+# پیشوند دستور باید در این تعداد کاراکتر اول پیام باشد (مثلاً 'code:')
+MAX_PREFIX_LENGTH = 16
+# نام دستور برای پیام‌هایی که پیشوند ثبت‌شده‌ای ندارند
+CHAT_COMMAND = "chat"
+
+
+class Command:
+    """
+    نتیجه تجزیه یک پیام: نام دستور، متن اصلی (بدون پیشوند و گزینه‌ها)، گزینه‌های معتبر و هشدارها.
+    """
+
+    __slots__ = ("name", "text", "options", "warnings")
+
+    def __init__(self, name: str, text: str, options: Dict[str, str], warnings: List[str]):
+        self.name = name
+        self.text = text
+        self.options = options
+        self.warnings = warnings
+
+    def __repr__(self) -> str:
+        return f"Command({self.name!r}, text={self.text[:40]!r}, options={self.options!r}, warnings={self.warnings!r})"
+
+
+class CommandSpec:
+    __slots__ = ("name", "choices", "defaults", "patterns")
+
+    def __init__(self, name: str, choices: Dict[str, Sequence[str]], defaults: Dict[str, str]):
+        self.name = name
+        self.choices = {option.lower(): tuple(values) for option, values in choices.items()}
+        self.defaults = defaults
+        # برای هر گزینه یک regex که با نام گزینه شروع می‌شود (مثل verbosity\s*:\s*(\S*))؛ الگویی که با متن ثابت
+        # شروع شود با جستجوی سریع پیشوند اجرا می‌شود. نام گزینه مثل قبل حساس به حروف است؛ مقدار آن نه
+        self.patterns = [
+            (option, re.compile(re.escape(option) + r"\s*:\s*(\S*)")) for option in self.choices
+        ]
+
+
+def invalid_option_message(option: str, value: str, default: str, allowed: Sequence[str]) -> str:
+    return f"⚠️ مقدار {option} نامعتبر است ('{value}'). از '{default}' استفاده می‌شود. مقادیر مجاز: {', '.join(allowed)}."
+
+
+class CommandRegistry:
+    def __init__(self):
+        self._specs: Dict[str, CommandSpec] = {}
+
+    def command(
+        self, name: str, choices: Optional[Dict[str, Sequence[str]]] = None, defaults: Optional[Dict[str, str]] = None
+    ) -> None:
+        """
+        دستور name با پیشوند 'name:' و گزینه‌های مجاز آن (choices) و مقادیر پیش‌فرض را ثبت می‌کند.
+        """
+        self._specs[name.lower()] = CommandSpec(name.lower(), choices or {}, defaults or {})
+
+    def parse(self, message: str) -> Command:
+        colon = message.find(":", 0, MAX_PREFIX_LENGTH)
+        spec = self._specs.get(message[:colon].strip().lower()) if colon > 0 else None
+        if spec is None:
+            return Command(CHAT_COMMAND, message, {}, [])
+
+        body = message[colon + 1:]
+        options = dict(spec.defaults)
+        warnings: List[str] = []
+        matches = []
+        for option, pattern in spec.patterns:
+            for match in pattern.finditer(body):
+                start = match.start()
+                # نام گزینه باید یک کلمه مستقل باشد ('xverbosity:' گزینه نیست)
+                if start == 0 or not body[start - 1].isalnum():
+                    matches.append((start, match.end(), option, match.group(1).lower()))
+        if not matches:
+            return Command(spec.name, body.strip(), options, warnings)
+
+        # بقیه متن از فاصله بین گزینه‌ها بدون کپی‌های میانی دوباره سرهم می‌شود
+        matches.sort()
+        pieces: List[str] = []
+        position = 0
+        for start, end, option, value in matches:
+            pieces.append(body[position:start])
+            position = end
+            allowed = spec.choices[option]
+            if value in allowed:
+                options[option] = value
+            else:
+                warnings.append(invalid_option_message(option, value, options.get(option, allowed[0]), allowed))
+        pieces.append(body[position:])
+        return Command(spec.name, " ".join(piece.strip() for piece in pieces if piece.strip()), options, warnings)
+
+
+Handler = Callable[..., Awaitable[Any]]
+
+
+class Dispatcher:
+    """
+    نگاشت نام دستور به handler. دستورهایی که handler ندارند (از جمله چت عادی) به fallback می‌روند.
+    برای handlerهای async generator (مثل stream) به جای dispatch از handler(name) استفاده کنید.
+    """
+
+    def __init__(self, fallback: Optional[Handler] = None):
+        self.fallback = fallback
+        self._handlers: Dict[str, Handler] = {}
+
+    def on(self, name: str) -> Callable[[Handler], Handler]:
+        def register(handler: Handler) -> Handler:
+            self._handlers[name] = handler
+            return handler
+        return register
+
+    def handler(self, name: str) -> Handler:
+        handler = self._handlers.get(name, self.fallback)
+        if handler is None:
+            raise LookupError(f"هیچ handler برای دستور '{name}' ثبت نشده است.")
+        return handler
+
+    async def dispatch(self, command: Command, *args: Any) -> Any:
+        return await self.handler(command.name)(command, *args)
@@ -0,0 +1,193 @@
+# context.py
+# مدیریت پنجره context برای تاریخچه چت با بودجه توکن.
+# به جای ارسال کل تاریخچه در هر نوبت، فقط نوبت‌های اخیر در محدوده بودجه ارسال می‌شوند و
+# نوبت‌های قدیمی‌تر در یک خلاصه (که با مدل flash ساخته و cache می‌شود) ادغام می‌شوند.
+import asyncio
+import hashlib
+import time
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from function.logs import get_logger
+
+logger = get_logger("context")
+
+Turn = Dict[str, Any]
+# تابع خلاصه‌ساز: (خلاصه قبلی، نوبت‌های جدید برای ادغام) -> خلاصه جدید
+Summarizer = Callable[[Optional[str], List[Turn]], Awaitable[str]]
+
+SUMMARY_PREFIX = "خلاصه بخش‌های قبلی این گفتگو:\n"
+SUMMARY_ACK = "متوجه شدم. گفتگو را با در نظر گرفتن این خلاصه ادامه می‌دهم."
+
+
+@lru_cache(maxsize=65536)
+def estimate_text_tokens(text: str) -> int:
+    """
+    تخمین ارزان تعداد توکن‌های یک متن (حدود ۴ بایت UTF-8 برای هر توکن).
+    نتیجه برای هر متن cache می‌شود، پس هر نوبت فقط یک بار شمرده می‌شود.
+    """
+    return len(text.encode("utf-8")) // 4 + 1
+
+
+def estimate_turn_tokens(turn: Turn) -> int:
+    # چند توکن اضافه برای نقش و ساختار هر نوبت
+    return 4 + sum(estimate_text_tokens(part.get("text", "")) for part in turn.get("parts", []))
+
+
+def turn_fingerprint(turn: Turn) -> str:
+    text = "".join(part.get("text", "") for part in turn.get("parts", []))
+    return hashlib.sha1(f"{turn.get('role')}:{text}".encode("utf-8")).hexdigest()
+
+
+class _SummaryState:
+    __slots__ = ("text", "covered", "fingerprint", "tokens")
+
+    def __init__(self, text: str, covered: int, fingerprint: str):
+        self.text = text
+        self.covered = covered  # تعداد نوبت‌های ابتدای تاریخچه که در خلاصه ادغام شده‌اند
+        self.fingerprint = fingerprint  # اثر انگشت آخرین نوبت ادغام‌شده
+        self.tokens = estimate_text_tokens(text) if text else 0
+
+
+class ContextManager:
+    """
+    تاریخچه را به بودجه توکن محدود می‌کند.
+
+    - budget_tokens: حداکثر توکن تاریخچه ارسالی (شامل خلاصه)
+    - keep_ratio: پس از عبور از بودجه، نوبت‌های اخیر تا این نسبت از بودجه نگه داشته می‌شوند
+      و بقیه خلاصه می‌شوند؛ به این ترتیب خلاصه‌سازی فقط گاه‌به‌گاه و نه در هر نوبت انجام می‌شود.
+    - summarizer: در صورت None، نوبت‌های قدیمی فقط حذف می‌شوند.
+    - retry_seconds: پس از خطای خلاصه‌ساز، تلاش بعدی برای همان جلسه حداقل این مدت
+      (و با هر خطای پیاپی دو برابر، تا max_retry_seconds) به تعویق می‌افتد.
+    """
+
+    def __init__(
+        self,
+        budget_tokens: int = 8000,
+        keep_ratio: float = 0.5,
+        summarizer: Optional[Summarizer] = None,
+        max_cached_summaries: int = 10_000,
+        retry_seconds: float = 30.0,
+        max_retry_seconds: float = 600.0,
+    ):
+        self.budget_tokens = budget_tokens
+        self.keep_ratio = keep_ratio
+        self.summarizer = summarizer
+        self.max_cached_summaries = max_cached_summaries
+        self._summaries: "OrderedDict[str, _SummaryState]" = OrderedDict()
+        self.retry_seconds = retry_seconds
+        self.max_retry_seconds = max_retry_seconds
+        self._pending: Dict[str, asyncio.Task] = {}
+        # session_id -> (تعداد خطاهای پیاپی، زمان مجاز تلاش بعدی)
+        self._failures: "OrderedDict[str, Tuple[int, float]]" = OrderedDict()
+        self.metrics: Dict[str, int] = {"summaries_created": 0, "summary_failures": 0, "trimmed_requests": 0}
+
+    async def build(self, session_id: str, history: List[Turn]) -> List[Turn]:
+        """
+        تاریخچه‌ای که باید به Gemini ارسال شود را برمی‌گرداند (آخرین نوبت همیشه حفظ می‌شود).
+        """
+        state = self._state_for(session_id, history)
+        start = state.covered if state else 0
+        summary_tokens = state.tokens if state else 0
+        recent_tokens = sum(estimate_turn_tokens(turn) for turn in history[start:])
+
+        if summary_tokens + recent_tokens > self.budget_tokens:
+            self.metrics["trimmed_requests"] += 1
+            cut = self._find_cut(history, start, int(self.budget_tokens * self.keep_ratio))
+            if cut > start:
+                if self.summarizer is None:
+                    state = self._store(session_id, state.text if state else "", history, cut)
+                elif session_id not in self._pending and not self._backing_off(session_id):
+                    # خلاصه‌سازی در پس‌زمینه انجام می‌شود تا زمان پاسخ این نوبت افزایش نیابد؛
+                    # تا آماده شدن خلاصه جدید، خلاصه قبلی و نوبت‌های اخیر ارسال می‌شوند
+                    task = asyncio.create_task(self._fold(session_id, state, history[:cut]))
+                    self._pending[session_id] = task
+                    task.add_done_callback(lambda _: self._pending.pop(session_id, None))
+                start = cut
+
+        if state is None or not state.text:
+            return history[start:]
+        return self._summary_turns(state.text) + history[start:]
+
+    def forget(self, session_id: str) -> None:
+        self._summaries.pop(session_id, None)
+        self._failures.pop(session_id, None)
+        task = self._pending.pop(session_id, None)
+        if task is not None:
+            task.cancel()
+
+    def _state_for(self, session_id: str, history: List[Turn]) -> Optional[_SummaryState]:
+        state = self._summaries.get(session_id)
+        if state is None:
+            return None
+        self._summaries.move_to_end(session_id)
+        # اگر ذخیره‌ساز جلسه نوبت‌های ابتدایی را حذف کرده باشد، جایگاه آخرین نوبت خلاصه‌شده جابه‌جا می‌شود
+        index = state.covered - 1
+        if 0 <= index < len(history) and turn_fingerprint(history[index]) == state.fingerprint:
+            return state
+        for i in range(min(index, len(history) - 1), -1, -1):
+            if turn_fingerprint(history[i]) == state.fingerprint:
+                state.covered = i + 1
+                return state
+        self._summaries.pop(session_id)
+        return None
+
+    def _find_cut(self, history: List[Turn], start: int, keep_tokens: int) -> int:
+        """
+        اندیس اولین نوبتی که نگه داشته می‌شود؛ نوبت‌های اخیر تا keep_tokens حفظ می‌شوند
+        و بخش نگه‌داشته‌شده همیشه با نوبت کاربر شروع می‌شود.
+        """
+        total = 0
+        cut = len(history)
+        for i in range(len(history) - 1, start - 1, -1):
+            total += estimate_turn_tokens(history[i])
+            if total > keep_tokens and cut < len(history):
+                break
+            cut = i
+        while cut < len(history) - 1 and history[cut].get("role") != "user":
+            cut += 1
+        return cut
+
+    async def _fold(self, session_id: str, state: Optional[_SummaryState], history: List[Turn]) -> None:
+        previous = state.text if state else None
+        start = state.covered if state else 0
+        try:
+            text = await self.summarizer(previous, history[start:])
+        except Exception as e:
+            # وضعیت قبلی دست نمی‌خورد تا این نوبت‌ها از دست نروند و در نوبت بعدی (پس از backoff) دوباره خلاصه شوند
+            logger.warning("خطا در خلاصه‌سازی تاریخچه", extra={"session_id": session_id, "error": str(e)})
+            self.metrics["summary_failures"] += 1
+            self._record_failure(session_id)
+            return
+        self.metrics["summaries_created"] += 1
+        self._failures.pop(session_id, None)
+        self._store(session_id, text, history, len(history))
+
+    def _backing_off(self, session_id: str) -> bool:
+        failure = self._failures.get(session_id)
+        return failure is not None and time.monotonic() < failure[1]
+
+    def _record_failure(self, session_id: str) -> None:
+        count = self._failures.pop(session_id, (0, 0.0))[0] + 1
+        delay = min(self.retry_seconds * 2 ** (count - 1), self.max_retry_seconds)
+        self._failures[session_id] = (count, time.monotonic() + delay)
+        while len(self._failures) > self.max_cached_summaries:
+            self._failures.popitem(last=False)
+
+    def _store(self, session_id: str, text: str, history: List[Turn], cut: int) -> _SummaryState:
+        state = _SummaryState(text, cut, turn_fingerprint(history[cut - 1]))
+        self._summaries[session_id] = state
+        self._summaries.move_to_end(session_id)
+        while len(self._summaries) > self.max_cached_summaries:
+            self._summaries.popitem(last=False)
+        return state
+
+    @staticmethod
+    def _summary_turns(text: str) -> List[Turn]:
+        if not text:
+            return []
+        return [
+            {"role": "user", "parts": [{"text": SUMMARY_PREFIX + text}]},
+            {"role": "model", "parts": [{"text": SUMMARY_ACK}]},
+        ]
@@ -0,0 +1,264 @@
+# context_cache.py
+# cache پیشوند ثابت پرامپت در Gemini (cachedContents) تا دستورالعمل‌های سیستمی طولانی (و در صورت فعال بودن،
+# ابتدای تاریخچه‌های طولانی) در هر درخواست دوباره ارسال و به عنوان توکن ورودی کامل محاسبه نشوند.
+# برای هر (مدل، پیشوند) یک cachedContent ساخته و نام آن نگهداری می‌شود؛ درخواست‌ها به جای systemInstruction
+# فقط cachedContent و بقیه contents را می‌فرستند. اگر تا انقضای cache کمتر از renew_seconds مانده باشد TTL آن
+# در پس‌زمینه تمدید می‌شود. اگر cache در upstream منقضی یا حذف شده باشد (400/403/404 با پیام مربوط به
+# cachedContent)، همان درخواست بدون cache دوباره ارسال می‌شود و درخواست بعدی cache را از نو می‌سازد؛ خطاهای دیگر
+# (مثلاً 400 برای درخواست نامعتبر) بدون ارسال دوباره برگردانده می‌شوند. Gemini پیشوندهای کوچک‌تر از حداقل تعداد توکن را
+# نمی‌پذیرد، پس پیشوندهای کوچک‌تر از min_bytes اصلاً cache نمی‌شوند و ساخت ناموفق تا failure_backoff ثانیه
+# تکرار نمی‌شود.
+import asyncio
+import hashlib
+import time
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+import httpx
+
+from function.logs import get_logger
+from function.payloads import Payload, PayloadTemplate, dumps
+from function.singleflight import SingleFlight
+from function.upstream import GeminiClient
+
+logger = get_logger("context_cache")
+
+# کلیدهایی از payload که بخشی از cachedContent هستند (بقیه، مثل generationConfig، در هر درخواست ارسال می‌شوند)
+CACHED_KEYS = ("systemInstruction", "tools", "toolConfig")
+# وضعیت‌هایی که یعنی cachedContent در upstream وجود ندارد یا قابل استفاده نیست
+CACHE_MISSING_STATUSES = (400, 403, 404)
+# پیام خطای upstream باید به cachedContent اشاره کند (مثلاً "CachedContent not found" یا
+# "Permission denied on resource cachedContents/...")
+CACHE_ERROR_MARKERS = ("cachedcontent", "cached content")
+
+
+def is_cache_error(error: BaseException) -> bool:
+    """
+    آیا خطای درخواست cache‌شده مربوط به خود cachedContent است (و ارسال دوباره بدون cache معنی دارد)؟
+    """
+    if not isinstance(error, httpx.HTTPStatusError) or error.response.status_code not in CACHE_MISSING_STATUSES:
+        return False
+    try:
+        message = error.response.text.lower()
+    except httpx.ResponseNotRead:
+        return False
+    return any(marker in message for marker in CACHE_ERROR_MARKERS)
+
+
+class CachedPrefix:
+    __slots__ = ("key", "name", "model", "frozen", "template", "expires_at", "renewing")
+
+    def __init__(self, key: str, name: str, model: str, frozen: int, template: PayloadTemplate, expires_at: float):
+        self.key = key
+        self.name = name
+        self.model = model
+        # تعداد turnهای ابتدای contents که داخل cache هستند
+        self.frozen = frozen
+        # بخش ثابت درخواست‌ها: cachedContent به همراه کلیدهای غیر cache (مثل generationConfig)
+        self.template = template
+        self.expires_at = expires_at
+        self.renewing = False
+
+    def payload(self, payload: Dict[str, Any]) -> Payload:
+        return self.template.build(payload["contents"][self.frozen:])
+
+
+class ContextCache:
+    def __init__(
+        self,
+        client: GeminiClient,
+        ttl_seconds: float = 3600.0,
+        renew_seconds: float = 300.0,
+        min_bytes: int = 4096,
+        history_turns: int = 0,
+        max_entries: int = 256,
+        failure_backoff: float = 600.0,
+    ):
+        self.client = client
+        self.ttl_seconds = ttl_seconds
+        self.renew_seconds = renew_seconds
+        self.min_bytes = min_bytes
+        # اگر بیشتر از صفر باشد، ابتدای تاریخچه در گام‌های history_turns تایی همراه پیشوند cache می‌شود
+        self.history_turns = history_turns
+        self.max_entries = max_entries
+        self.failure_backoff = failure_backoff
+        self._entries: "OrderedDict[str, CachedPrefix]" = OrderedDict()
+        self._unavailable: Dict[str, float] = {}
+        # بخش cache‌شدنی هر قالب payload فقط یک بار جدا و encode می‌شود (کلید: fragment قالب)
+        self._split: Dict[bytes, Tuple[Dict[str, Any], bytes, Dict[str, Any]]] = {}
+        self._flight = SingleFlight()
+        self._renewals: Set[asyncio.Task] = set()
+        self.metrics: Dict[str, int] = {
+            "hits": 0, "created": 0, "create_failures": 0, "skipped": 0,
+            "renewed": 0, "renew_failures": 0, "fallbacks": 0,
+        }
+
+    # --- استفاده در درخواست‌ها ---
+    async def call(
+        self, model_name: str, payload: Dict[str, Any], send: Callable[[Dict[str, Any]], Awaitable[Any]]
+    ) -> Any:
+        """
+        send(payload) را با نسخه cache‌شده payload فراخوانی می‌کند؛ اگر cache در upstream وجود نداشته باشد
+        همان درخواست با payload اصلی تکرار می‌شود.
+        """
+        entry = await self.acquire(model_name, payload)
+        if entry is None:
+            return await send(payload)
+        try:
+            return await send(entry.payload(payload))
+        except httpx.HTTPStatusError as e:
+            if not is_cache_error(e):
+                raise
+            self._expired(entry, e)
+            return await send(payload)
+
+    async def stream(
+        self, model_name: str, payload: Dict[str, Any], open_stream: Callable[[Dict[str, Any]], AsyncIterator[Any]]
+    ) -> AsyncIterator[Any]:
+        """
+        نسخه stream از call؛ بازگشت به payload اصلی فقط تا قبل از رسیدن اولین تکه ممکن است.
+        """
+        entry = await self.acquire(model_name, payload)
+        if entry is None:
+            async for chunk in open_stream(payload):
+                yield chunk
+            return
+        started = False
+        try:
+            async for chunk in open_stream(entry.payload(payload)):
+                started = True
+                yield chunk
+            return
+        except httpx.HTTPStatusError as e:
+            if started or not is_cache_error(e):
+                raise
+            self._expired(entry, e)
+        async for chunk in open_stream(payload):
+            yield chunk
+
+    async def acquire(self, model_name: str, payload: Dict[str, Any]) -> Optional[CachedPrefix]:
+        """
+        cachedContent معتبر برای پیشوند ثابت payload روی این مدل (در صورت نیاز ساخته می‌شود)، یا None.
+        """
+        prefix = self._prefix(model_name, payload)
+        if prefix is None:
+            return None
+        key, cached_static, request_static, frozen, size = prefix
+        now = time.monotonic()
+        entry = self._entries.get(key)
+        if entry is not None and entry.expires_at > now:
+            self._entries.move_to_end(key)
+            self.metrics["hits"] += 1
+            if entry.expires_at - now < self.renew_seconds and not entry.renewing:
+                entry.renewing = True
+                task = asyncio.create_task(self._renew(entry))
+                self._renewals.add(task)
+                task.add_done_callback(self._renewals.discard)
+            return entry
+        if size < self.min_bytes:
+            self.metrics["skipped"] += 1
+            return None
+        if self._unavailable.get(key, 0) > now:
+            return None
+        contents = payload["contents"][:frozen]
+        return await self._flight.do(key, lambda: self._create(key, model_name, cached_static, request_static, contents))
+
+    def _prefix(self, model_name: str, payload: Dict[str, Any]):
+        # (کلید، بخش cache‌شدنی، بخش ثابت درخواست، تعداد turnهای ثابت، اندازه پیشوند به بایت) یا None
+        if isinstance(payload, Payload):
+            split = self._split.get(payload.template.fragment)
+            if split is None:
+                split = self._split[payload.template.fragment] = self._split_static(payload.template.static)
+        else:
+            split = self._split_static({k: v for k, v in payload.items() if k != "contents"})
+        cached_static, cached_bytes, request_static = split
+        if not cached_static:
+            return None
+        contents: List[Dict[str, Any]] = payload["contents"]
+        frozen = self._frozen_turns(contents)
+        digest = hashlib.sha256(model_name.encode() + b"\x00" + cached_bytes)
+        size = len(cached_bytes)
+        if frozen:
+            history = dumps(contents[:frozen])
+            digest.update(b"\x00" + history)
+            size += len(history)
+        return digest.hexdigest(), cached_static, request_static, frozen, size
+
+    @staticmethod
+    def _split_static(static: Dict[str, Any]) -> Tuple[Dict[str, Any], bytes, Dict[str, Any]]:
+        cached = {k: v for k, v in static.items() if k in CACHED_KEYS}
+        request = {k: v for k, v in static.items() if k not in CACHED_KEYS}
+        return cached, dumps(cached, sort_keys=True) if cached else b"", request
+
+    def _frozen_turns(self, contents: List[Dict[str, Any]]) -> int:
+        if self.history_turns <= 0:
+            return 0
+        # آخرین پیام (پیام جدید کاربر) هرگز cache نمی‌شود و پیشوند ثابت باید به یک پاسخ مدل ختم شود
+        frozen = (len(contents) - 1) // self.history_turns * self.history_turns
+        while frozen > 0 and contents[frozen - 1].get("role") != "model":
+            frozen -= 1
+        return frozen
+
+    # --- مدیریت cacheها ---
+    async def _create(
+        self, key: str, model_name: str, cached_static: Dict[str, Any], request_static: Dict[str, Any],
+        contents: List[Dict[str, Any]],
+    ) -> Optional[CachedPrefix]:
+        body = {"model": f"models/{model_name}", "ttl": f"{self.ttl_seconds:.0f}s", **cached_static}
+        if contents:
+            body["contents"] = contents
+        started = time.monotonic()
+        try:
+            created = await self.client.create_cached_content(body)
+        except (httpx.HTTPError, KeyError, ValueError) as e:
+            # مثلاً پیشوند کوچک‌تر از حداقل توکن مدل، یا مدلی که از cache پشتیبانی نمی‌کند
+            self.metrics["create_failures"] += 1
+            self._unavailable[key] = time.monotonic() + self.failure_backoff
+            logger.info("ساخت cachedContent ناموفق بود؛ درخواست‌ها بدون cache ارسال می‌شوند",
+                        extra={"model": model_name, "error": str(e)})
+            return None
+        entry = CachedPrefix(
+            key, created["name"], model_name, len(contents),
+            PayloadTemplate({"cachedContent": created["name"], **request_static}),
+            started + self.ttl_seconds,
+        )
+        self._entries[key] = entry
+        self._unavailable.pop(key, None)
+        self.metrics["created"] += 1
+        while len(self._entries) > self.max_entries:
+            # cacheهای قدیمی در upstream با پایان TTL خودشان حذف می‌شوند
+            self._entries.popitem(last=False)
+        return entry
+
+    async def _renew(self, entry: CachedPrefix) -> None:
+        started = time.monotonic()
+        try:
+            await self.client.update_cached_content_ttl(entry.name, self.ttl_seconds)
+            entry.expires_at = started + self.ttl_seconds
+            self.metrics["renewed"] += 1
+        except httpx.HTTPError as e:
+            self.metrics["renew_failures"] += 1
+            if isinstance(e, httpx.HTTPStatusError) and e.response.status_code in CACHE_MISSING_STATUSES:
+                self._drop(entry)
+            logger.info("تمدید cachedContent ناموفق بود", extra={"cache": entry.name, "error": str(e)})
+        finally:
+            entry.renewing = False
+
+    def _expired(self, entry: CachedPrefix, error: Exception) -> None:
+        self.metrics["fallbacks"] += 1
+        self._drop(entry)
+        logger.info("cachedContent در upstream در دسترس نیست؛ درخواست بدون cache تکرار شد",
+                    extra={"cache": entry.name, "error": str(error)})
+
+    def _drop(self, entry: CachedPrefix) -> None:
+        if self._entries.get(entry.key) is entry:
+            del self._entries[entry.key]
+
+    def stats(self) -> Dict[str, Any]:
+        return {"entries": len(self._entries), **self.metrics}
+
+    async def aclose(self) -> None:
+        # cacheهای upstream حذف نمی‌شوند (ممکن است workerهای دیگر از آن‌ها استفاده کنند) و با TTL منقضی می‌شوند
+        for task in list(self._renewals):
+            task.cancel()
+        self._entries.clear()
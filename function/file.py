@@ -1,5 +1,11 @@
+import codecs
 import os
 
+from function.workspace import Workspace
+
+# فایل‌های این ابزار نسبت به پوشه جاری هستند
+current_dir = Workspace(".")
+
 def create_file(name, format):
     """
     ساخت فایل با نام و فرمت مشخص. اگر فایل وجود داشته باشد، اخطار می‌دهد.
@@ -26,9 +32,12 @@ def show_file(name, format):
         return
 
     try:
-        with open(filename, "r", encoding="utf-8") as f:
-            content = f.read()
-        print(f"📄 محتوای فایل '{filename}':\n{'-'*40}\n{content}\n{'-'*40}")
+        # فایل تکه‌تکه خوانده و چاپ می‌شود تا فایل‌های بزرگ کامل در حافظه بارگذاری نشوند
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        print(f"📄 محتوای فایل '{filename}':\n{'-'*40}")
+        for chunk in current_dir.iter_chunks(filename):
+            print(decoder.decode(chunk), end="")
+        print(f"{decoder.decode(b'', final=True)}\n{'-'*40}")
     except Exception as e:
         print(f"❌ خطا در خواندن فایل: {e}")
 
@@ -44,8 +53,8 @@ def edit_file(name, format):
     new_content = input(f"📝 محتوای جدید برای '{filename}':\n")
 
     try:
-        with open(filename, "w", encoding="utf-8") as f:
-            f.write(new_content)
+        # جایگزینی اتمیک: فایل قبلی تا پایان نوشتن نسخه جدید دست نمی‌خورد
+        current_dir.write_atomic(filename, new_content.encode("utf-8"))
         print(f"✅ محتوای فایل '{filename}' بروزرسانی شد.")
     except Exception as e:
         print(f"❌ خطا در ویرایش فایل: {e}")
\ No newline at end of file
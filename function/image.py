@@ -1,32 +1,180 @@
 # image.py
-import openai # کتابخانه رسمی OpenAI
-import os # برای دسترسی به متغیرهای محیطی
+# SDK openai (بزرگ‌ترین بخش زمان import برنامه) فقط هنگام ساخت اولین ImageGenerator، یعنی در اولین
+# درخواست img:، بارگذاری می‌شود.
+import asyncio
+from typing import Any, Dict, Optional
+
+from function.logs import get_logger
+from function.resilience import Resilience, parse_retry_after
+from function.settings import get_settings
+from function.singleflight import SingleFlight
+
+logger = get_logger("image")
+
+
+def classify_openai_error(exc: BaseException):
+    """
+    طبقه‌بندی خطاهای OpenAI برای لایه resilience: (قابل تلاش مجدد؟، Retry-After، کد وضعیت).
+    """
+    import openai # کتابخانه رسمی OpenAI (در این نقطه قبلاً توسط ImageGenerator بارگذاری شده است)
+
+    if isinstance(exc, openai.APIStatusError):
+        status = exc.status_code
+        retry_after = parse_retry_after(exc.response.headers.get("Retry-After")) if exc.response is not None else None
+        return status in (408, 409, 429) or status >= 500, retry_after, status
+    if isinstance(exc, (openai.APIConnectionError, openai.APITimeoutError)):
+        return True, None, None
+    return False, None, None
+
+
+class ImageQueueFull(Exception):
+    """
+    صف تولید تصویر پر است و درخواست جدید پذیرفته نمی‌شود.
+    """
+
+
+class ImageGenerator:
+    """
+    کلاینت اختصاصی تولید تصویر با DALL·E 3.
+    از یک AsyncOpenAI مشترک استفاده می‌کند (بدون تغییر openai.api_key سراسری) تا event loop مسدود نشود.
+    تعداد درخواست‌های همزمان با max_concurrency و طول صف انتظار با max_queue محدود می‌شود.
+    """
+
+    def __init__(
+        self,
+        api_key: str,
+        model: str = "dall-e-3",
+        max_concurrency: int = 4,
+        max_queue: int = 32,
+        timeout: float = 120.0,
+        resilience: Optional[Resilience] = None,
+    ):
+        if not api_key:
+            raise ValueError("کلید API OpenAI (openai_api_key) ارائه نشده است.")
+        self.model = model
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.resilience = resilience
+        import openai # کتابخانه رسمی OpenAI
+
+        # وقتی لایه resilience فعال است، تلاش مجدد داخلی SDK غیرفعال می‌شود تا دو بار تکرار نشود
+        self._client = openai.AsyncOpenAI(
+            api_key=api_key, timeout=timeout, max_retries=0 if resilience is not None else 2
+        )
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._queued = 0
+        self._in_flight = 0
+        # درخواست‌های همزمان با پرامپت و اندازه یکسان فقط یک بار به DALL·E ارسال می‌شوند
+        self._flight = SingleFlight()
+        self.metrics: Dict[str, int] = {"completed": 0, "failed": 0, "rejected": 0}
+
+    async def generate(self, prompt: str, size: str = "1024x1024") -> str:
+        """
+        تصویر را تولید می‌کند و URL آن را برمی‌گرداند. اگر صف پر باشد ImageQueueFull پرتاب می‌شود.
+        """
+        return await self._flight.do(f"{size}\x00{prompt}", lambda: self._generate(prompt, size))
+
+    async def _generate(self, prompt: str, size: str) -> str:
+        if self._queued >= self.max_queue:
+            self.metrics["rejected"] += 1
+            raise ImageQueueFull("صف تولید تصویر پر است. لطفاً کمی بعد دوباره تلاش کنید.")
+
+        self._queued += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self._queued -= 1
+
+        self._in_flight += 1
+        try:
+            # فراخوانی API DALL·E 3
+            request = lambda: self._client.images.generate(
+                model=self.model,
+                prompt=prompt,
+                size=size,
+                quality="standard", # کیفیت تصویر (standard یا hd)
+                n=1, # تعداد تصاویر (برای dall-e-3 همیشه 1 است)
+            )
+            if self.resilience is not None:
+                response = await self.resilience.call(self.model, request)
+            else:
+                response = await request()
+            self.metrics["completed"] += 1
+            return response.data[0].url # بازگرداندن URL تصویر ساخته شده
+        except Exception:
+            self.metrics["failed"] += 1
+            raise
+        finally:
+            self._in_flight -= 1
+            self._semaphore.release()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "queue_depth": self._queued,
+            "in_flight": self._in_flight,
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+            "coalesced": self._flight.metrics["followers"],
+            **self.metrics,
+            **({"resilience": self.resilience.stats()} if self.resilience is not None else {}),
+        }
+
+    async def aclose(self) -> None:
+        await self._client.close()
+
+
+# برای هر کلید API یک ImageGenerator مشترک نگهداری می‌شود
+_generators: Dict[str, ImageGenerator] = {}
+
+
+def get_image_generator(openai_api_key: str) -> ImageGenerator:
+    generator = _generators.get(openai_api_key)
+    if generator is None:
+        settings = get_settings()
+        generator = _generators[openai_api_key] = ImageGenerator(
+            openai_api_key,
+            max_concurrency=settings.image_max_concurrency,
+            max_queue=settings.image_max_queue,
+            timeout=settings.image_timeout,
+            resilience=Resilience(
+                "openai",
+                classify_openai_error,
+                key_rate=settings.openai_rate_per_second,
+                default_model_rate=settings.openai_rate_per_second,
+                retries=settings.upstream_retries,
+            ),
+        )
+    return generator
+
+
+def image_generator_stats(openai_api_key: Optional[str]) -> Optional[Dict[str, Any]]:
+    """
+    آمار ImageGenerator در صورت وجود؛ برخلاف get_image_generator آن را نمی‌سازد (و openai را import نمی‌کند).
+    """
+    generator = _generators.get(openai_api_key) if openai_api_key else None
+    return generator.stats() if generator is not None else None
+
+
+async def close_image_generators() -> None:
+    for generator in _generators.values():
+        await generator.aclose()
+    _generators.clear()
+
 
 # تابع create_img حالا کلید API را به عنوان آرگومان دریافت می‌کند
-async def create_img(prompt: str, size: str = "1024x1024", openai_api_key: str = None) -> str:
+async def create_img(prompt: str, size: str = "1024x1024", openai_api_key: Optional[str] = None) -> str:
     """
     تصویر ایجاد می‌کند با استفاده از DALL·E 3 بر اساس پرامپت.
     کلید API OpenAI باید به تابع ارسال شود.
     """
     if not openai_api_key:
         raise ValueError("کلید API OpenAI (openai_api_key) ارائه نشده است.")
-    
-    # مقداردهی کلید API OpenAI به صورت موقت برای این فراخوانی
-    # این روش امن‌تر از تنظیم سراسری در ابتدای فایل است.
-    openai.api_key = openai_api_key
 
     try:
-        # فراخوانی API DALL·E 3
-        response = openai.images.generate(
-            model="dall-e-3",
-            prompt=prompt,
-            size=size,
-            quality="standard", # کیفیت تصویر (standard یا hd)
-            n=1, # تعداد تصاویر (برای dall-e-3 همیشه 1 است)
-        )
-        return response.data[0].url # بازگرداندن URL تصویر ساخته شده
+        return await get_image_generator(openai_api_key).generate(prompt, size=size)
+    except ImageQueueFull:
+        raise
     except Exception as e:
-        print(f"[❌] خطا در ساخت تصویر: {e}")
+        logger.warning("خطا در ساخت تصویر", extra={"error": str(e)})
         # در صورت خطا، یک استثنا را مجدداً پرتاب می‌کند تا در main.py مدیریت شود
         raise Exception(f"خطا در تولید تصویر: {e}")
-
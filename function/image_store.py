@@ -0,0 +1,260 @@
+# image_store.py
+# ذخیره محلی تصاویر تولیدشده به جای لینک موقت DALL·E که پس از مدتی منقضی می‌شود.
+# هر تصویر با کلید (پرامپت ترجمه‌شده، اندازه) شناخته می‌شود و فایل آن بر اساس hash محتوا (sha256) ذخیره
+# می‌شود، پس تصاویر یکسان فقط یک بار روی دیسک قرار می‌گیرند و hash محتوا همان ETag پاسخ HTTP است.
+# دانلود تصویر در پس‌زمینه (async) انجام می‌شود و نوشتن فایل و ساخت thumbnail در thread جداگانه تا event loop
+# مسدود نشود. ساخت thumbnail به Pillow نیاز دارد (pip install Pillow)؛ اگر نصب نباشد thumbnail ساخته نمی‌شود
+# و نسخه اصلی تصویر استفاده می‌شود. Pillow فقط هنگام ساخت اولین thumbnail import می‌شود (زمان راه‌اندازی).
+import asyncio
+import hashlib
+import importlib.util
+import io
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from typing import Any, Dict, Optional
+
+import httpx
+
+from function.logs import get_logger
+
+PILLOW_AVAILABLE = importlib.util.find_spec("PIL") is not None
+
+logger = get_logger("image_store")
+
+DEFAULT_THUMBNAIL_SIZE = 256
+DEFAULT_MAX_IMAGE_BYTES = 20 * 1024 * 1024
+# تعداد لینک‌های اصلی دانلودهای ناموفق که برای redirect نگه داشته می‌شوند
+MAX_FAILED_SOURCES = 1000
+EXTENSIONS = {"image/png": "png", "image/jpeg": "jpg", "image/webp": "webp"}
+# پسوند لینک تصویری که هنوز در حال دانلود است (خروجی DALL·E همیشه PNG است)
+DEFAULT_EXTENSION = "png"
+
+
+def image_filename(key: str, content_type: Optional[str] = None) -> str:
+    # نام فایل در لینک عمومی تصویر (/images/<key>.<ext>)؛ کلاینت‌ها تصویر را از روی پسوند تشخیص می‌دهند
+    return f"{key}.{EXTENSIONS.get(content_type, DEFAULT_EXTENSION)}"
+
+
+def image_key(prompt: str, size: str) -> str:
+    return hashlib.sha256(f"{size}\x00{prompt}".encode("utf-8")).hexdigest()[:32]
+
+
+class ImageStore:
+    """
+    رکورد هر کلید در SQLite (root/index.db) نگهداری می‌شود و فایل‌ها در root/<دو حرف اول hash>/ قرار می‌گیرند.
+    """
+
+    def __init__(
+        self,
+        root: str,
+        thumbnail_size: int = DEFAULT_THUMBNAIL_SIZE,
+        max_bytes: int = DEFAULT_MAX_IMAGE_BYTES,
+        timeout: float = 60.0,
+    ):
+        self.root = os.path.realpath(root)
+        self.thumbnail_size = thumbnail_size
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        os.makedirs(self.root, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(os.path.join(self.root, "index.db"), check_same_thread=False, timeout=10)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS images ("
+            "key TEXT PRIMARY KEY, digest TEXT NOT NULL, content_type TEXT NOT NULL, bytes INTEGER NOT NULL, "
+            "thumbnail INTEGER NOT NULL, prompt TEXT NOT NULL, size TEXT NOT NULL, created REAL NOT NULL)"
+        )
+        self._conn.commit()
+        self._client: Optional[httpx.AsyncClient] = None
+        # دانلودهای در جریان (کلید ← task) و لینک اصلی دانلودهای ناموفق
+        self._pending: Dict[str, asyncio.Task] = {}
+        self._failed: Dict[str, str] = {}
+        self.metrics: Dict[str, int] = {"hits": 0, "misses": 0, "downloads": 0, "download_failures": 0, "thumbnails": 0}
+
+    # --- جستجو ---
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT digest, content_type, bytes, thumbnail, prompt, size, created FROM images WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None:
+            return None
+        digest, content_type, size_bytes, thumbnail, prompt, size, created = row
+        record = {
+            "key": key, "digest": digest, "content_type": content_type, "bytes": size_bytes,
+            "thumbnail": bool(thumbnail), "prompt": prompt, "size": size, "created": created,
+        }
+        # رکوردی که فایلش (مثلاً به دست کاربر) حذف شده، وجود ندارد
+        return record if os.path.isfile(self.path(record)) else None
+
+    async def aget(self, key: str) -> Optional[Dict[str, Any]]:
+        # پرس‌وجوی SQLite و بررسی فایل در thread اجرا می‌شوند تا event loop مسدود نشود
+        return await asyncio.to_thread(self.get, key)
+
+    def lookup(self, prompt: str, size: str) -> Optional[str]:
+        """
+        اگر تصویر این پرامپت و اندازه ذخیره شده یا در حال دانلود باشد نام فایل آن (کلید و پسوند) را
+        برمی‌گرداند، وگرنه None (مسدودکننده؛ در مسیرهای async از alookup استفاده شود).
+        """
+        key = image_key(prompt, size)
+        if key in self._pending:
+            return self._hit(key)
+        return self._lookup_result(key, self.get(key))
+
+    async def alookup(self, prompt: str, size: str) -> Optional[str]:
+        key = image_key(prompt, size)
+        if key in self._pending:
+            return self._hit(key)
+        return self._lookup_result(key, await self.aget(key))
+
+    def _hit(self, key: str, content_type: Optional[str] = None) -> str:
+        self.metrics["hits"] += 1
+        return image_filename(key, content_type)
+
+    def _lookup_result(self, key: str, record: Optional[Dict[str, Any]]) -> Optional[str]:
+        if record is not None:
+            return self._hit(key, record["content_type"])
+        self.metrics["misses"] += 1
+        return None
+
+    def pending(self, key: str) -> bool:
+        return key in self._pending
+
+    def source_url(self, key: str) -> Optional[str]:
+        # لینک اصلی (موقت) تصویری که دانلود آن ناموفق بوده است
+        return self._failed.get(key)
+
+    def path(self, record: Dict[str, Any], thumbnail: bool = False) -> str:
+        digest = record["digest"]
+        extension = EXTENSIONS.get(record["content_type"], "bin")
+        name = f"{digest}.thumb{self.thumbnail_size}.png" if thumbnail and record["thumbnail"] else f"{digest}.{extension}"
+        return os.path.join(self.root, digest[:2], name)
+
+    # --- ذخیره ---
+    def save_from_url(self, prompt: str, size: str, url: str) -> str:
+        """
+        دانلود تصویر را در پس‌زمینه شروع می‌کند و نام فایل آن (کلید و پسوند) را بلافاصله برمی‌گرداند.
+        """
+        key = image_key(prompt, size)
+        if key not in self._pending:
+            task = asyncio.create_task(self._download(key, prompt, size, url))
+            self._pending[key] = task
+            task.add_done_callback(lambda _: self._pending.pop(key, None))
+        return image_filename(key)
+
+    async def wait(self, key: str, timeout: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        """
+        اگر تصویر در حال دانلود باشد تا پایان آن (حداکثر timeout ثانیه) صبر می‌کند؛ رکورد تصویر یا None.
+        """
+        task = self._pending.get(key)
+        if task is not None:
+            try:
+                await asyncio.wait_for(asyncio.shield(task), timeout)
+            except asyncio.TimeoutError:
+                return None
+        return await self.aget(key)
+
+    async def _download(self, key: str, prompt: str, size: str, url: str) -> None:
+        if self._client is None:
+            self._client = httpx.AsyncClient(timeout=self.timeout, follow_redirects=True)
+        try:
+            chunks = []
+            received = 0
+            async with self._client.stream("GET", url) as response:
+                response.raise_for_status()
+                content_type = response.headers.get("content-type", "image/png").split(";")[0].strip()
+                async for chunk in response.aiter_bytes():
+                    received += len(chunk)
+                    if received > self.max_bytes:
+                        raise ValueError(f"تصویر بزرگ‌تر از {self.max_bytes} بایت است.")
+                    chunks.append(chunk)
+            await asyncio.to_thread(self.put, prompt, size, b"".join(chunks), content_type)
+            self.metrics["downloads"] += 1
+            self._failed.pop(key, None)
+        except Exception as e:
+            self.metrics["download_failures"] += 1
+            if len(self._failed) >= MAX_FAILED_SOURCES:
+                self._failed.pop(next(iter(self._failed)))
+            self._failed[key] = url
+            logger.warning("خطا در دانلود تصویر", extra={"key": key, "error": str(e)})
+
+    def put(self, prompt: str, size: str, data: bytes, content_type: str = "image/png") -> Dict[str, Any]:
+        """
+        تصویر را ذخیره و رکورد آن را برمی‌گرداند (مسدودکننده؛ در مسیرهای async در thread اجرا شود).
+        """
+        key = image_key(prompt, size)
+        digest = hashlib.sha256(data).hexdigest()
+        record = {
+            "key": key, "digest": digest, "content_type": content_type, "bytes": len(data),
+            "thumbnail": False, "prompt": prompt, "size": size, "created": time.time(),
+        }
+        full = self.path(record)
+        if not os.path.isfile(full):
+            self._write_atomic(full, data)
+        record["thumbnail"] = self._make_thumbnail(record, data)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO images (key, digest, content_type, bytes, thumbnail, prompt, size, created) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, digest, content_type, len(data), int(record["thumbnail"]), prompt, size, record["created"]),
+            )
+            self._conn.commit()
+        return record
+
+    def _make_thumbnail(self, record: Dict[str, Any], data: bytes) -> bool:
+        if not PILLOW_AVAILABLE:
+            return False
+        record = {**record, "thumbnail": True}
+        full = self.path(record, thumbnail=True)
+        if os.path.isfile(full):
+            return True
+        from PIL import Image
+
+        try:
+            with Image.open(io.BytesIO(data)) as image:
+                image.thumbnail((self.thumbnail_size, self.thumbnail_size))
+                output = io.BytesIO()
+                image.save(output, format="PNG", optimize=True)
+        except Exception as e:
+            logger.warning("خطا در ساخت thumbnail", extra={"digest": record["digest"], "error": str(e)})
+            return False
+        self._write_atomic(full, output.getvalue())
+        self.metrics["thumbnails"] += 1
+        return True
+
+    @staticmethod
+    def _write_atomic(full: str, data: bytes) -> None:
+        directory = os.path.dirname(full)
+        os.makedirs(directory, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix=".", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(temp_path, full)
+        except BaseException:
+            try:
+                os.unlink(temp_path)
+            except FileNotFoundError:
+                pass
+            raise
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            images, total_bytes = self._conn.execute("SELECT count(*), coalesce(sum(bytes), 0) FROM images").fetchone()
+        return {
+            "images": images,
+            "total_bytes": total_bytes,
+            "pending": len(self._pending),
+            "thumbnails_enabled": PILLOW_AVAILABLE,
+            **self.metrics,
+        }
+
+    async def aclose(self) -> None:
+        for task in list(self._pending.values()):
+            task.cancel()
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
@@ -0,0 +1,352 @@
+# jobs.py
+# صف کارهای پس‌زمینه (مثلاً ترجمه + تولید تصویر) با شناسه کار، اولویت‌بندی و ذخیره در SQLite.
+# ارسال کار بلافاصله یک job_id برمی‌گرداند؛ workerها کار را در پس‌زمینه اجرا می‌کنند و
+# کلاینت وضعیت را با polling، long-poll یا SSE دنبال می‌کند.
+# کارهایی که هنگام خاموش شدن سرور هنوز تمام نشده بودند، در راه‌اندازی بعدی دوباره در صف قرار می‌گیرند.
+# چند worker (پروسه) می‌توانند یک پایگاه‌داده مشترک داشته باشند: هر کار با lease به یک worker تعلق دارد و فقط
+# کارهای با lease منقضی (worker متوقف‌شده) بازیابی می‌شوند؛ وضعیت کارهای worker دیگر از پایگاه‌داده خوانده می‌شود.
+import asyncio
+import itertools
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from function.logs import get_logger
+
+logger = get_logger("jobs")
+
+# مسیرهای اولویت: عدد کمتر یعنی اولویت بیشتر
+PRIORITY_LANES = {"high": 0, "normal": 1, "low": 2}
+TERMINAL_STATUSES = ("succeeded", "failed")
+JOB_COLUMNS = "id, kind, payload, priority, status, result, error, created_at, updated_at"
+
+JobHandler = Callable[[Dict[str, Any]], Awaitable[Dict[str, Any]]]
+
+
+class Job:
+    __slots__ = ("id", "kind", "payload", "priority", "status", "result", "error", "created_at", "updated_at")
+
+    def __init__(
+        self,
+        kind: str,
+        payload: Dict[str, Any],
+        priority: str = "normal",
+        id: Optional[str] = None,
+        status: str = "queued",
+        result: Optional[Dict[str, Any]] = None,
+        error: Optional[str] = None,
+        created_at: Optional[float] = None,
+        updated_at: Optional[float] = None,
+    ):
+        self.id = id or uuid.uuid4().hex
+        self.kind = kind
+        self.payload = payload
+        self.priority = priority
+        self.status = status
+        self.result = result
+        self.error = error
+        self.created_at = created_at or time.time()
+        self.updated_at = updated_at or self.created_at
+
+    @property
+    def done(self) -> bool:
+        return self.status in TERMINAL_STATUSES
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "job_id": self.id,
+            "kind": self.kind,
+            "priority": self.priority,
+            "status": self.status,
+            "result": self.result,
+            "error": self.error,
+            "created_at": self.created_at,
+            "updated_at": self.updated_at,
+        }
+
+
+class SqliteJobBackend:
+    """
+    ذخیره‌سازی کارها در SQLite برای بازیابی پس از راه‌اندازی مجدد.
+    هر کار ناتمام یک مالک (owner، شناسه JobQueue یک worker) و مهلت lease دارد که مالک آن را مرتب تمدید می‌کند؛
+    worker دیگر فقط کارهایی را برمی‌دارد که lease آن‌ها منقضی شده (مالکشان متوقف یا خاموش شده است).
+    """
+
+    def __init__(self, path: str):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=10, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id TEXT PRIMARY KEY, kind TEXT NOT NULL, payload TEXT NOT NULL, priority TEXT NOT NULL, "
+            "status TEXT NOT NULL, result TEXT, error TEXT, created_at REAL NOT NULL, updated_at REAL NOT NULL, "
+            "owner TEXT, lease_until REAL NOT NULL DEFAULT 0)"
+        )
+        # پایگاه‌داده‌های ساخته‌شده پیش از اضافه شدن lease
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(jobs)")}
+        if "owner" not in columns:
+            self._conn.execute("ALTER TABLE jobs ADD COLUMN owner TEXT")
+            self._conn.execute("ALTER TABLE jobs ADD COLUMN lease_until REAL NOT NULL DEFAULT 0")
+
+    def save(self, job: Job, owner: str, lease_until: float) -> bool:
+        """
+        کار را ذخیره می‌کند؛ کار موجود فقط توسط مالک فعلی آن به‌روز می‌شود. False یعنی کار به worker دیگری رسیده است.
+        """
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT INTO jobs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(id) DO UPDATE SET status = excluded.status, result = excluded.result, "
+                "error = excluded.error, updated_at = excluded.updated_at, lease_until = excluded.lease_until "
+                "WHERE jobs.owner = excluded.owner",
+                (
+                    job.id, job.kind, json.dumps(job.payload, ensure_ascii=False), job.priority, job.status,
+                    json.dumps(job.result, ensure_ascii=False) if job.result is not None else None,
+                    job.error, job.created_at, job.updated_at, owner, lease_until,
+                ),
+            )
+        return cursor.rowcount > 0
+
+    def load(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            row = self._conn.execute(f"SELECT {JOB_COLUMNS} FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._row_to_job(row) if row else None
+
+    def claim_expired(self, owner: str, lease_until: float) -> List[Job]:
+        """
+        کارهای ناتمامی را که lease آن‌ها منقضی شده به صورت اتمی به owner منتقل و برمی‌گرداند.
+        """
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                rows = self._conn.execute(
+                    f"SELECT {JOB_COLUMNS} FROM jobs WHERE status NOT IN (?, ?) AND lease_until < ? ORDER BY created_at",
+                    (*TERMINAL_STATUSES, time.time()),
+                ).fetchall()
+                self._conn.executemany(
+                    "UPDATE jobs SET owner = ?, lease_until = ? WHERE id = ?",
+                    [(owner, lease_until, row[0]) for row in rows],
+                )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return [self._row_to_job(row) for row in rows]
+
+    def renew(self, owner: str, lease_until: float) -> int:
+        # تمدید lease همه کارهای ناتمام این مالک با یک دستور
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE jobs SET lease_until = ? WHERE owner = ? AND status NOT IN (?, ?)",
+                (lease_until, owner, *TERMINAL_STATUSES),
+            )
+        return cursor.rowcount
+
+    def purge_finished_before(self, timestamp: float) -> int:
+        with self._lock:
+            cursor = self._conn.execute(
+                "DELETE FROM jobs WHERE status IN (?, ?) AND updated_at < ?", (*TERMINAL_STATUSES, timestamp)
+            )
+        return cursor.rowcount
+
+    @staticmethod
+    def _row_to_job(row) -> Job:
+        job_id, kind, payload, priority, status, result, error, created_at, updated_at = row
+        return Job(
+            kind, json.loads(payload), priority, id=job_id, status=status,
+            result=json.loads(result) if result else None, error=error,
+            created_at=created_at, updated_at=updated_at,
+        )
+
+
+class JobQueue:
+    """
+    صف کار با اولویت و تعداد worker محدود.
+    handlers: نگاشت نوع کار (مثلاً 'image') به تابع async اجراکننده آن.
+    """
+
+    def __init__(
+        self,
+        handlers: Dict[str, JobHandler],
+        workers: int = 2,
+        max_pending: int = 1000,
+        retention_seconds: float = 3600,
+        backend: Optional[SqliteJobBackend] = None,
+        lease_seconds: float = 60.0,
+        poll_interval: float = 0.5,
+        purge_interval: float = 300.0,
+    ):
+        self.handlers = handlers
+        self.workers = workers
+        self.max_pending = max_pending
+        self.retention_seconds = retention_seconds
+        self.backend = backend
+        self.lease_seconds = lease_seconds
+        # فاصله polling پایگاه‌داده در wait برای کارهایی که در worker دیگری اجرا می‌شوند
+        self.poll_interval = poll_interval
+        # فاصله حذف دوره‌ای کارهای تمام‌شده قدیمی از SQLite (در حلقه تمدید lease)
+        self.purge_interval = purge_interval
+        self._next_purge = 0.0
+        self.owner = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._jobs: Dict[str, Job] = {}
+        self._events: Dict[str, asyncio.Event] = {}
+        self._queue: Optional[asyncio.PriorityQueue] = None
+        self._tasks: List[asyncio.Task] = []
+        self._lease_task: Optional[asyncio.Task] = None
+        self._sequence = itertools.count()
+        self._running = 0
+        self.metrics: Dict[str, int] = {
+            "submitted": 0, "succeeded": 0, "failed": 0, "rejected": 0, "recovered": 0, "purged": 0,
+        }
+
+    async def start(self) -> None:
+        self._queue = asyncio.PriorityQueue()
+        if self.backend is not None:
+            await self._purge_expired()
+            await self._recover()
+            self._lease_task = asyncio.create_task(self._keep_leases())
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self) -> None:
+        tasks = self._tasks + ([self._lease_task] if self._lease_task is not None else [])
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._tasks = []
+        self._lease_task = None
+        if self.backend is not None:
+            # lease کارهای ناتمام آزاد می‌شود تا worker دیگر (یا راه‌اندازی بعدی) بدون انتظار آن‌ها را بردارد
+            await asyncio.to_thread(self.backend.renew, self.owner, 0)
+
+    async def submit(self, kind: str, payload: Dict[str, Any], priority: str = "normal") -> Job:
+        if kind not in self.handlers:
+            raise ValueError(f"نوع کار نامعتبر است: '{kind}'")
+        if priority not in PRIORITY_LANES:
+            raise ValueError(f"اولویت نامعتبر است: '{priority}'. مقادیر مجاز: {', '.join(PRIORITY_LANES)}")
+        if self._queue is None:
+            raise RuntimeError("صف کارها هنوز راه‌اندازی نشده است.")
+        if self._queue.qsize() >= self.max_pending:
+            self.metrics["rejected"] += 1
+            raise OverflowError("صف کارها پر است. لطفاً کمی بعد دوباره تلاش کنید.")
+        job = Job(kind, payload, priority)
+        await self._persist(job)
+        self._enqueue(job)
+        self.metrics["submitted"] += 1
+        return job
+
+    async def get(self, job_id: str) -> Optional[Job]:
+        job = self._jobs.get(job_id)
+        if job is None and self.backend is not None:
+            job = await asyncio.to_thread(self.backend.load, job_id)
+        return job
+
+    async def wait(self, job_id: str, timeout: float) -> Optional[Job]:
+        """
+        تا پایان کار یا گذشتن timeout صبر می‌کند (long-poll) و وضعیت فعلی کار را برمی‌گرداند.
+        """
+        job = await self.get(job_id)
+        if job is None or job.done:
+            return job
+        event = self._events.get(job_id)
+        if event is not None:
+            try:
+                await asyncio.wait_for(event.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+            return self._jobs.get(job_id, job)
+        # کار در worker دیگری اجرا می‌شود: polling پایگاه‌داده
+        deadline = time.monotonic() + timeout
+        while not job.done:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            await asyncio.sleep(min(self.poll_interval, remaining))
+            job = await self.get(job_id) or job
+        return job
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "queue_depth": self._queue.qsize() if self._queue is not None else 0,
+            "running": self._running,
+            "workers": self.workers,
+            **self.metrics,
+        }
+
+    def _enqueue(self, job: Job) -> None:
+        self._jobs[job.id] = job
+        self._events[job.id] = asyncio.Event()
+        self._queue.put_nowait((PRIORITY_LANES.get(job.priority, 1), next(self._sequence), job.id))
+
+    async def _persist(self, job: Job) -> None:
+        job.updated_at = time.time()
+        if self.backend is not None:
+            saved = await asyncio.to_thread(self.backend.save, job, self.owner, time.time() + self.lease_seconds)
+            if not saved:
+                logger.warning("کار به worker دیگری منتقل شده است؛ وضعیت آن ذخیره نشد", extra={"job_id": job.id})
+
+    async def _recover(self) -> None:
+        # کارهای ناتمامی که lease آن‌ها منقضی شده (از اجرای قبلی یا worker متوقف‌شده) دوباره در صف قرار می‌گیرند
+        jobs = await asyncio.to_thread(self.backend.claim_expired, self.owner, time.time() + self.lease_seconds)
+        for job in jobs:
+            if job.id in self._jobs:
+                continue
+            job.status = "queued"
+            self._enqueue(job)
+            self.metrics["recovered"] += 1
+
+    async def _keep_leases(self) -> None:
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            try:
+                await asyncio.to_thread(self.backend.renew, self.owner, time.time() + self.lease_seconds)
+                await self._recover()
+                if time.monotonic() >= self._next_purge:
+                    await self._purge_expired()
+            except sqlite3.Error as e:
+                logger.warning("خطا در تمدید lease کارها", extra={"error": str(e)})
+
+    async def _purge_expired(self) -> None:
+        # بدون این کار، ردیف کارهای تمام‌شده در یک worker طولانی‌مدت تا راه‌اندازی بعدی انباشته می‌شوند
+        self._next_purge = time.monotonic() + self.purge_interval
+        purged = await asyncio.to_thread(self.backend.purge_finished_before, time.time() - self.retention_seconds)
+        self.metrics["purged"] += purged
+        self._purge_finished()
+
+    async def _worker(self) -> None:
+        while True:
+            _, _, job_id = await self._queue.get()
+            job = self._jobs.get(job_id)
+            if job is None:
+                continue
+            self._running += 1
+            try:
+                job.status = "running"
+                await self._persist(job)
+                try:
+                    job.result = await self.handlers[job.kind](job.payload)
+                    job.status = "succeeded"
+                except asyncio.CancelledError:
+                    # هنگام خاموش شدن، کار در وضعیت running در دیسک باقی می‌ماند و بعداً بازیابی می‌شود
+                    raise
+                except Exception as e:
+                    job.status = "failed"
+                    job.error = str(e)
+                self.metrics[job.status] += 1
+                await self._persist(job)
+                self._events.pop(job_id).set()
+                self._purge_finished()
+            finally:
+                self._running -= 1
+
+    def _purge_finished(self) -> None:
+        # کارهای تمام‌شده پس از retention_seconds از حافظه حذف می‌شوند (در SQLite باقی می‌مانند تا purge)
+        deadline = time.time() - self.retention_seconds
+        expired = [job_id for job_id, job in self._jobs.items() if job.done and job.updated_at < deadline]
+        for job_id in expired:
+            del self._jobs[job_id]
@@ -0,0 +1,50 @@
+# lifespan.py
+# hookهای راه‌اندازی و خاموش شدن برنامه به صورت صریح و مرتب (جایگزین app.on_event).
+# هر بخش main.py hookهای خود را کنار کد خودش ثبت می‌کند؛ hookهای startup به ترتیب ثبت و hookهای shutdown
+# به ترتیب معکوس اجرا می‌شوند (آخرین منبع راه‌اندازی‌شده، اولین منبعی است که بسته می‌شود).
+import inspect
+import time
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Callable, List
+
+from function.logs import get_logger
+
+logger = get_logger("lifespan")
+
+Hook = Callable[[], Any]
+
+
+class Lifespan:
+    def __init__(self):
+        self._startup: List[Hook] = []
+        self._shutdown: List[Hook] = []
+
+    def on_startup(self, hook: Hook) -> Hook:
+        self._startup.append(hook)
+        return hook
+
+    def on_shutdown(self, hook: Hook) -> Hook:
+        self._shutdown.append(hook)
+        return hook
+
+    @asynccontextmanager
+    async def __call__(self, app) -> AsyncIterator[None]:
+        for hook in self._startup:
+            started = time.perf_counter()
+            await _run(hook)
+            logger.debug("hook راه‌اندازی اجرا شد", extra={"hook": hook.__name__, "seconds": round(time.perf_counter() - started, 4)})
+        try:
+            yield
+        finally:
+            for hook in reversed(self._shutdown):
+                try:
+                    await _run(hook)
+                except Exception:
+                    # خطای یک hook نباید مانع بسته شدن بقیه منابع شود
+                    logger.exception("خطا در hook خاموش شدن", extra={"hook": hook.__name__})
+
+
+async def _run(hook: Hook) -> None:
+    result = hook()
+    if inspect.isawaitable(result):
+        await result
@@ -0,0 +1,64 @@
+# logs.py
+# لاگ ساخت‌یافته و کم‌هزینه به جای print در مسیرهای پرتکرار.
+# رکوردها فقط در یک صف درون حافظه قرار می‌گیرند (QueueHandler) و نوشتن روی stderr در یک thread
+# جداگانه (QueueListener) انجام می‌شود تا event loop هرگز منتظر I/O ترمینال یا فایل نماند.
+# فیلدهای اضافه با extra={...} ارسال می‌شوند و در حالت LOG_FORMAT=json به صورت کلید جداگانه ثبت می‌شوند.
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+import time
+from typing import Optional
+
+# ویژگی‌های استاندارد LogRecord؛ بقیه ویژگی‌ها فیلدهای extra هستند
+_RESERVED = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RESERVED and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        fields = " ".join(
+            f"{key}={value}" for key, value in record.__dict__.items() if key not in _RESERVED and not key.startswith("_")
+        )
+        line = f"{time.strftime('%H:%M:%S', time.localtime(record.created))} {record.levelname:<7} {record.name}: {record.getMessage()}"
+        if fields:
+            line += f" | {fields}"
+        if record.exc_info:
+            line += "\n" + self.formatException(record.exc_info)
+        return line
+
+
+def setup_logging(level: str = "INFO", fmt: str = "text", name: str = "o2dream") -> logging.handlers.QueueListener:
+    """
+    logger ریشه پروژه را پیکربندی می‌کند و QueueListener را (که باید هنگام خاموش شدن stop شود) برمی‌گرداند.
+    """
+    handler = logging.StreamHandler(sys.stderr)
+    handler.setFormatter(JsonFormatter() if fmt == "json" else TextFormatter())
+    log_queue: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(log_queue, handler, respect_handler_level=True)
+    logger = logging.getLogger(name)
+    logger.handlers[:] = [logging.handlers.QueueHandler(log_queue)]
+    logger.setLevel(level.upper())
+    logger.propagate = False
+    listener.start()
+    return listener
+
+
+def get_logger(component: Optional[str] = None) -> logging.Logger:
+    return logging.getLogger(f"o2dream.{component}" if component else "o2dream")
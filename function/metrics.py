@@ -0,0 +1,242 @@
+# metrics.py
+# متریک‌های سبک با فرمت متنی Prometheus (بدون وابستگی خارجی).
+# شمارنده‌ها، gaugeها و histogramها در حافظه نگهداری می‌شوند و با render() برای endpoint /metrics
+# به فرمت text/plain; version=0.0.4 تبدیل می‌شوند. ثبت هر مشاهده فقط یک جستجوی دیکشنری و bisect است.
+# collectorها (مثلاً stats() ذخیره‌ساز جلسه یا cache) فقط هنگام scrape فراخوانی می‌شوند؛ collectorهایی که
+# SQLite را می‌خوانند با blocking=True ثبت می‌شوند و arender() آن‌ها را در thread اجرا می‌کند.
+import asyncio
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+# مرزهای پیش‌فرض histogram بر حسب ثانیه (از چند میلی‌ثانیه تا فراخوانی‌های طولانی مدل pro)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+LabelValues = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+    def _key(self, labels: Dict[str, Any]) -> LabelValues:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels: Any) -> None:
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> List[str]:
+        return self.header() + [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+            for key, value in self._values.items()
+        ]
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def set(self, value: float, **labels: Any) -> None:
+        self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels: Any) -> None:
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels: Any) -> None:
+        self.inc(-amount, **labels)
+
+    @contextmanager
+    def track(self, **labels: Any) -> Iterator[None]:
+        # تعداد کارهای در حال اجرا (in-flight) را در طول بلوک یک واحد افزایش می‌دهد
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+    def render(self) -> List[str]:
+        return self.header() + [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+            for key, value in self._values.items()
+        ]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(
+        self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # برای هر ترکیب label: [تعداد در هر bucket (غیرتجمعی) + overflow، مجموع]
+        self._values: Dict[LabelValues, List[Any]] = {}
+
+    def observe(self, value: float, **labels: Any) -> None:
+        key = self._key(labels)
+        entry = self._values.get(key)
+        if entry is None:
+            entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+        entry[0][bisect_left(self.buckets, value)] += 1
+        entry[1] += value
+
+    @contextmanager
+    def time(self, **labels: Any) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def render(self) -> List[str]:
+        lines = self.header()
+        for key, (counts, total) in self._values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Registry:
+    """
+    مجموعه متریک‌ها و collectorها. collector تابعی است که یک دیکشنری آمار (مثل خروجی stats())
+    برمی‌گرداند؛ مقادیر عددی آن با پیشوند داده‌شده به صورت gauge گزارش می‌شوند.
+    collector مسدودکننده (blocking=True) در arender() خارج از event loop فراخوانی می‌شود.
+    """
+
+    def __init__(self, namespace: str = ""):
+        self.namespace = namespace
+        self._metrics: List[_Metric] = []
+        self._collectors: List[Tuple[str, Callable[[], Optional[Dict[str, Any]]], bool]] = []
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(self._name(name), documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._register(Gauge(self._name(name), documentation, labelnames))
+
+    def histogram(
+        self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS
+    ) -> Histogram:
+        return self._register(Histogram(self._name(name), documentation, labelnames, buckets))
+
+    def register_collector(
+        self, prefix: str, collect: Callable[[], Optional[Dict[str, Any]]], blocking: bool = False
+    ) -> None:
+        self._collectors.append((self._name(prefix), collect, blocking))
+
+    def render(self) -> str:
+        return self._render({})
+
+    async def arender(self) -> str:
+        """
+        مانند render()، ولی collectorهای مسدودکننده همه با هم در یک thread اجرا می‌شوند.
+        """
+        blocking = [(prefix, collect) for prefix, collect, is_blocking in self._collectors if is_blocking]
+        snapshots = await asyncio.to_thread(lambda: {prefix: self._collect(collect) for prefix, collect in blocking})
+        return self._render(snapshots)
+
+    def _render(self, snapshots: Dict[str, Optional[Dict[str, Any]]]) -> str:
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for prefix, collect, _ in self._collectors:
+            stats = snapshots[prefix] if prefix in snapshots else self._collect(collect)
+            for key, value in (stats or {}).items():
+                # فقط مقادیر عددی گزارش می‌شوند (bool هم عدد حساب می‌شود)
+                if isinstance(value, (int, float)):
+                    name = f"{prefix}_{key}"
+                    lines.append(f"# TYPE {name} gauge")
+                    lines.append(f"{name} {_format_value(float(value))}")
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def _collect(collect: Callable[[], Optional[Dict[str, Any]]]) -> Optional[Dict[str, Any]]:
+        try:
+            return collect()
+        except Exception:
+            # خطای یک collector نباید کل خروجی /metrics را خراب کند
+            return None
+
+    def _name(self, name: str) -> str:
+        return f"{self.namespace}_{name}" if self.namespace else name
+
+    def _register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+
+class MetricsMiddleware:
+    """
+    middleware سطح ASGI: مدت هر درخواست HTTP (تا ارسال آخرین بایت، حتی برای stream) را بر اساس
+    الگوی مسیر (مثلاً /jobs/{job_id}) و کد وضعیت ثبت می‌کند و تعداد درخواست‌های در جریان را نگه می‌دارد.
+    """
+
+    def __init__(self, app, duration: Histogram, in_flight: Gauge):
+        self.app = app
+        self.duration = duration
+        self.in_flight = in_flight
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        started = time.perf_counter()
+        self.in_flight.inc()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            self.in_flight.dec()
+            route = scope.get("route")
+            endpoint = getattr(route, "path", None) or "unmatched"
+            self.duration.observe(time.perf_counter() - started, endpoint=endpoint, status=status["code"])
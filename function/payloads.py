@@ -0,0 +1,87 @@
+# payloads.py
+# ساخت payloadهای Gemini از قالب‌های از پیش آماده.
+# بخش‌های ثابت هر نوع درخواست (systemInstruction و generationConfig برای هر task/verbosity) فقط یک بار
+# ساخته و به صورت یک تکه JSON از پیش encode‌شده نگه داشته می‌شوند؛ برای هر درخواست فقط contents
+# encode و بین این تکه‌ها قرار می‌گیرد. اگر پکیج orjson نصب باشد (pip install orjson) برای encode و
+# decode از آن استفاده می‌شود، وگرنه از json استاندارد.
+import json
+from typing import Any, Dict, List, Optional
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+ORJSON_AVAILABLE = orjson is not None
+
+
+def dumps(obj: Any, sort_keys: bool = False) -> bytes:
+    """
+    JSON فشرده (بدون فاصله اضافه) و UTF-8 به صورت bytes.
+    """
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_SORT_KEYS if sort_keys else 0)
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"), sort_keys=sort_keys).encode("utf-8")
+
+
+def loads(data) -> Any:
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+class PayloadTemplate:
+    """
+    بخش ثابت یک payload (همه کلیدها به جز contents). static نباید پس از ساخت تغییر کند.
+    """
+
+    __slots__ = ("static", "fragment")
+
+    def __init__(self, static: Optional[Dict[str, Any]] = None):
+        self.static = dict(static or {})
+        # '"generationConfig":{...},"systemInstruction":{...}' بدون آکولادهای بیرونی
+        self.fragment = dumps(self.static)[1:-1] if self.static else b""
+
+    def build(self, contents: List[Dict[str, Any]]) -> "Payload":
+        return Payload(self, contents)
+
+
+class Payload(dict):
+    """
+    payload آماده ارسال که مثل یک dict معمولی خوانده می‌شود و body() آن بدنه JSON را فقط با encode
+    کردن contents می‌سازد. بدنه پس از اولین فراخوانی نگه داشته می‌شود، پس payload نباید تغییر کند.
+    """
+
+    __slots__ = ("template", "_body")
+
+    def __init__(self, template: PayloadTemplate, contents: List[Dict[str, Any]]):
+        super().__init__(contents=contents, **template.static)
+        self.template = template
+        self._body: Optional[bytes] = None
+
+    def body(self) -> bytes:
+        if self._body is None:
+            fragment = self.template.fragment
+            self._body = b'{"contents":' + dumps(self["contents"]) + (b"," + fragment if fragment else b"") + b"}"
+        return self._body
+
+
+def encode_payload(payload: Dict[str, Any]) -> bytes:
+    # payloadهای ساخته‌شده از قالب بدنه آماده دارند؛ dictهای معمولی کامل encode می‌شوند
+    if isinstance(payload, Payload):
+        return payload.body()
+    return dumps(payload)
+
+
+def user_contents(text: str) -> List[Dict[str, Any]]:
+    return [{"role": "user", "parts": [{"text": text}]}]
+
+
+def extract_text(response: Dict[str, Any]) -> Optional[str]:
+    """
+    متن اولین candidate را از پاسخ Gemini (کامل یا یک chunk از stream) استخراج می‌کند.
+    """
+    try:
+        return response["candidates"][0]["content"]["parts"][0]["text"]
+    except (KeyError, IndexError, TypeError):
+        return None
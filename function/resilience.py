@@ -0,0 +1,297 @@
+# resilience.py
+# لایه مقاومت در برابر خطاهای upstream (Gemini و OpenAI):
+# - محدودکننده نرخ token bucket برای هر کلید API و هر مدل، با تنظیم تطبیقی (AIMD):
+#   با هر 429 نرخ نصف می‌شود و با پاسخ‌های موفق به تدریج به نرخ اصلی برمی‌گردد
+# - تلاش مجدد با تاخیر نمایی jitter‌دار که هدر Retry-After را رعایت می‌کند
+# - circuit breaker برای هر مدل تا در زمان قطعی upstream، درخواست‌ها سریع رد شوند
+# - زمان‌بندی منصفانه بین جلسه‌ها تا یک کاربر پرمصرف بقیه را گرسنه نگذارد
+import asyncio
+import random
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Awaitable, Callable, Deque, Dict, Optional, Tuple
+
+# تابع طبقه‌بندی خطا: (قابل تلاش مجدد؟، Retry-After بر حسب ثانیه، کد وضعیت HTTP)
+Classifier = Callable[[BaseException], Tuple[bool, Optional[float], Optional[int]]]
+
+
+class CircuitOpenError(Exception):
+    """
+    circuit breaker باز است؛ درخواست بدون ارسال به upstream رد می‌شود.
+    """
+
+    def __init__(self, name: str, retry_after: float):
+        super().__init__(f"سرویس '{name}' موقتاً در دسترس نیست. {retry_after:.0f} ثانیه دیگر دوباره تلاش کنید.")
+        self.retry_after = retry_after
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """
+    هدر Retry-After را (فقط حالت ثانیه) به عدد تبدیل می‌کند.
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        return None
+
+
+class TokenBucket:
+    """
+    token bucket با نرخ تطبیقی. rate تعداد درخواست در ثانیه و capacity حداکثر burst است.
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None, min_rate: Optional[float] = None):
+        self.max_rate = rate
+        self.rate = rate
+        self.min_rate = min_rate if min_rate is not None else rate / 16
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def penalize(self) -> None:
+        # کاهش ضربی نرخ پس از throttle شدن توسط upstream
+        self.rate = max(self.min_rate, self.rate / 2)
+
+    def reward(self) -> None:
+        # افزایش جمعی نرخ پس از پاسخ موفق تا رسیدن به نرخ اصلی
+        self.rate = min(self.max_rate, self.rate + self.max_rate / 20)
+
+
+class CircuitBreaker:
+    """
+    پس از failure_threshold خطای متوالی باز می‌شود و تا recovery_timeout ثانیه همه درخواست‌ها را رد می‌کند؛
+    سپس یک درخواست آزمایشی (half-open) اجازه عبور دارد.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = 5, recovery_timeout: float = 30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.state = "closed"
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+
+    def before_call(self) -> None:
+        if self.state == "open":
+            elapsed = time.monotonic() - self._opened_at
+            if elapsed < self.recovery_timeout:
+                raise CircuitOpenError(self.name, self.recovery_timeout - elapsed)
+            self.state = "half_open"
+        if self.state == "half_open":
+            if self._probe_in_flight:
+                raise CircuitOpenError(self.name, 1.0)
+            self._probe_in_flight = True
+
+    def record_success(self) -> None:
+        self.state = "closed"
+        self._failures = 0
+        self._probe_in_flight = False
+
+    def record_failure(self) -> None:
+        self._failures += 1
+        self._probe_in_flight = False
+        if self.state == "half_open" or self._failures >= self.failure_threshold:
+            self.state = "open"
+            self._opened_at = time.monotonic()
+
+    def release(self) -> None:
+        # درخواستی که نه موفق بود و نه خطای upstream داشت (مثلاً خطای 400 یا لغو)
+        self._probe_in_flight = False
+
+
+class FairScheduler:
+    """
+    محدودکننده همزمانی با صف منصفانه (round-robin) بین جلسه‌ها.
+    وقتی همه ظرفیت پر است، منتظرها به ترتیب نوبتی بین جلسه‌ها آزاد می‌شوند، نه به ترتیب ورود.
+    """
+
+    def __init__(self, max_concurrency: int):
+        self.max_concurrency = max_concurrency
+        self._active = 0
+        self._waiters: "OrderedDict[str, Deque[asyncio.Future]]" = OrderedDict()
+
+    @asynccontextmanager
+    async def slot(self, session_id: Optional[str]) -> AsyncIterator[None]:
+        await self._acquire(session_id or "")
+        try:
+            yield
+        finally:
+            self._release()
+
+    def queued(self) -> int:
+        return sum(len(waiters) for waiters in self._waiters.values())
+
+    async def _acquire(self, session_id: str) -> None:
+        if self._active < self.max_concurrency and not self._waiters:
+            self._active += 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(session_id, deque()).append(future)
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # ظرفیت به ما داده شده بود ولی لغو شدیم؛ آن را به منتظر بعدی می‌دهیم
+                self._release()
+            else:
+                waiters = self._waiters.get(session_id)
+                if waiters is not None and future in waiters:
+                    waiters.remove(future)
+                    if not waiters:
+                        del self._waiters[session_id]
+            raise
+
+    def _release(self) -> None:
+        while self._waiters:
+            session_id, waiters = next(iter(self._waiters.items()))
+            future = waiters.popleft()
+            # جلسه به انتهای نوبت منتقل می‌شود (round-robin)
+            del self._waiters[session_id]
+            if waiters:
+                self._waiters[session_id] = waiters
+            if not future.done():
+                future.set_result(None)
+                return
+        self._active -= 1
+
+
+class Resilience:
+    """
+    ترکیب محدودکننده نرخ، تلاش مجدد و circuit breaker برای یک سرویس upstream.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        classify: Classifier,
+        key_rate: float = 20.0,
+        model_rates: Optional[Dict[str, float]] = None,
+        default_model_rate: float = 10.0,
+        retries: int = 3,
+        base_delay: float = 0.5,
+        max_delay: float = 8.0,
+        max_retry_after: float = 30.0,
+        failure_threshold: int = 5,
+        recovery_timeout: float = 30.0,
+    ):
+        self.name = name
+        self.classify = classify
+        self.key_rate = key_rate
+        self.model_rates = dict(model_rates or {})
+        self.default_model_rate = default_model_rate
+        self.retries = retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_retry_after = max_retry_after
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self._key_buckets: Dict[str, TokenBucket] = {}
+        self._model_buckets: Dict[str, TokenBucket] = {}
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self.metrics: Dict[str, int] = {"retries": 0, "throttled": 0, "failures": 0, "rejected_open_circuit": 0}
+
+    async def call(
+        self, model: str, fn: Callable[[], Awaitable[Any]], api_key: str = "default", retries: Optional[int] = None
+    ) -> Any:
+        """
+        fn را با رعایت محدودیت نرخ، circuit breaker و تلاش مجدد اجرا می‌کند.
+        retries در صورت تنظیم، تعداد تلاش مجدد پیش‌فرض را برای این فراخوانی جایگزین می‌کند.
+        """
+        retries = self.retries if retries is None else retries
+        attempt = 0
+        while True:
+            try:
+                async with self.admit(model, api_key):
+                    return await fn()
+            except Exception as e:
+                retryable, retry_after, _ = self.classify(e)
+                if not retryable or attempt >= retries:
+                    raise
+            attempt += 1
+            self.metrics["retries"] += 1
+            await asyncio.sleep(self._delay(attempt, retry_after))
+
+    @asynccontextmanager
+    async def admit(self, model: str, api_key: str = "default") -> AsyncIterator[None]:
+        """
+        یک تلاش را پذیرش می‌کند: بررسی circuit breaker، گرفتن token و ثبت نتیجه.
+        برای فراخوانی‌های streaming که قابل تلاش مجدد نیستند مستقیماً استفاده می‌شود.
+        """
+        breaker = self._breaker(model)
+        try:
+            breaker.before_call()
+        except CircuitOpenError:
+            self.metrics["rejected_open_circuit"] += 1
+            raise
+        key_bucket = self._bucket(self._key_buckets, api_key, self.key_rate)
+        model_bucket = self._bucket(self._model_buckets, model, self.model_rates.get(model, self.default_model_rate))
+        try:
+            await key_bucket.acquire()
+            await model_bucket.acquire()
+            yield
+        except Exception as e:
+            retryable, _, status = self.classify(e)
+            if status == 429:
+                # throttle نشانه قطعی نیست؛ فقط نرخ کاهش می‌یابد و circuit باز نمی‌شود
+                self.metrics["throttled"] += 1
+                key_bucket.penalize()
+                model_bucket.penalize()
+                breaker.release()
+            elif retryable:
+                self.metrics["failures"] += 1
+                breaker.record_failure()
+            else:
+                breaker.release()
+            raise
+        except BaseException:
+            breaker.release()
+            raise
+        else:
+            breaker.record_success()
+            key_bucket.reward()
+            model_bucket.reward()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "circuits": {model: breaker.state for model, breaker in self._breakers.items()},
+            "model_rates": {model: round(bucket.rate, 3) for model, bucket in self._model_buckets.items()},
+            **self.metrics,
+        }
+
+    def _delay(self, attempt: int, retry_after: Optional[float]) -> float:
+        # full jitter: تاخیر تصادفی بین صفر و سقف نمایی، ولی نه کمتر از Retry-After
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, self.max_retry_after))
+        return delay
+
+    def _breaker(self, model: str) -> CircuitBreaker:
+        breaker = self._breakers.get(model)
+        if breaker is None:
+            breaker = self._breakers[model] = CircuitBreaker(
+                f"{self.name}:{model}", self.failure_threshold, self.recovery_timeout
+            )
+        return breaker
+
+    @staticmethod
+    def _bucket(buckets: Dict[str, TokenBucket], key: str, rate: float) -> TokenBucket:
+        bucket = buckets.get(key)
+        if bucket is None:
+            bucket = buckets[key] = TokenBucket(rate)
+        return bucket
@@ -0,0 +1,193 @@
+# response_cache.py
+# cache پاسخ برای درخواست‌های قطعی (deterministic) مانند /code/gen.
+# کلید cache یک hash نرمال‌شده از کل payload ارسالی به مدل است، پس تغییر مدل، پرامپت،
+# verbosity یا system instruction به طور خودکار کلید جدیدی می‌سازد.
+# از stale-while-revalidate پشتیبانی می‌کند: پاسخ کمی قدیمی فوراً برگردانده می‌شود و
+# نسخه تازه در پس‌زمینه از مدل گرفته می‌شود.
+# تابع محاسبه می‌تواند با UncacheableResponse پاسخی را برگرداند که نباید ذخیره شود (مثلاً پاسخ مدل fallback).
+import asyncio
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from function.logs import get_logger
+from function.payloads import Payload, dumps
+
+logger = get_logger("response_cache")
+
+# (مقدار، زمان ذخیره)
+Entry = Tuple[str, float]
+
+
+class UncacheableResponse(Exception):
+    """
+    پاسخ معتبری که به درخواست‌دهنده برگردانده می‌شود اما در cache ذخیره نمی‌شود.
+    """
+
+    def __init__(self, value: str):
+        super().__init__(value)
+        self.value = value
+
+
+def payload_key(model_name: str, payload: Dict[str, Any]) -> str:
+    """
+    hash پایدار از مدل و payload (کلیدها مرتب و بدون فاصله اضافه serialize می‌شوند).
+    برای payloadهای ساخته‌شده از قالب، بدنه آماده ارسال (که قطعی است) مستقیماً hash می‌شود.
+    """
+    if isinstance(payload, Payload):
+        normalized = model_name.encode("utf-8") + b"\n" + payload.body()
+    else:
+        normalized = dumps({"model": model_name, "payload": payload}, sort_keys=True)
+    return hashlib.sha256(normalized).hexdigest()
+
+
+class MemoryCacheBackend:
+    def __init__(self, max_entries: int = 1000):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Entry]" = OrderedDict()
+
+    def get(self, key: str) -> Optional[Entry]:
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+        return entry
+
+    def set(self, key: str, value: str, stored_at: float) -> None:
+        self._entries[key] = (value, stored_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def delete(self, key: str) -> None:
+        self._entries.pop(key, None)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class SqliteCacheBackend:
+    """
+    backend دیسکی؛ بین workerها مشترک است و پس از راه‌اندازی مجدد باقی می‌ماند.
+    """
+
+    def __init__(self, path: str, max_entries: int = 10_000):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=10)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, stored_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed_at)")
+        self._conn.commit()
+
+    def get(self, key: str) -> Optional[Entry]:
+        with self._lock:
+            row = self._conn.execute("SELECT value, stored_at FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                self._conn.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (time.time(), key))
+                self._conn.commit()
+        return (row[0], row[1]) if row else None
+
+    def set(self, key: str, value: str, stored_at: float) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, value, stored_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, value, stored_at, time.time()),
+            )
+            # حذف قدیمی‌ترین ورودی‌ها (بر اساس آخرین دسترسی) در صورت عبور از سقف
+            self._conn.execute(
+                "DELETE FROM responses WHERE key IN ("
+                "SELECT key FROM responses ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+            self._conn.commit()
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            self._conn.commit()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+
+class ResponseCache:
+    """
+    cache پاسخ با TTL و stale-while-revalidate.
+
+    - ttl_seconds: پاسخ تا این مدت تازه است
+    - stale_seconds: پس از TTL تا این مدت پاسخ قدیمی برگردانده و در پس‌زمینه تازه می‌شود
+    """
+
+    def __init__(self, backend, ttl_seconds: float = 3600, stale_seconds: float = 600):
+        self.backend = backend
+        self.ttl_seconds = ttl_seconds
+        self.stale_seconds = stale_seconds
+        self._refreshing: Dict[str, asyncio.Task] = {}
+        self._blocking = isinstance(backend, SqliteCacheBackend)
+        self.metrics: Dict[str, int] = {
+            "hits": 0, "stale_hits": 0, "misses": 0, "refreshes": 0, "refresh_failures": 0, "uncacheable": 0,
+        }
+
+    async def get_or_compute(self, key: str, compute: Callable[[], Awaitable[str]]) -> Tuple[str, bool]:
+        """
+        مقدار cache شده یا محاسبه‌شده را برمی‌گرداند: (مقدار، آیا از cache آمده است).
+        """
+        entry = await self._call(self.backend.get, key)
+        if entry is not None:
+            value, stored_at = entry
+            age = time.time() - stored_at
+            if age <= self.ttl_seconds:
+                self.metrics["hits"] += 1
+                return value, True
+            if age <= self.ttl_seconds + self.stale_seconds:
+                self.metrics["stale_hits"] += 1
+                if key not in self._refreshing:
+                    task = asyncio.create_task(self._refresh(key, compute))
+                    self._refreshing[key] = task
+                    task.add_done_callback(lambda _: self._refreshing.pop(key, None))
+                return value, True
+
+        self.metrics["misses"] += 1
+        try:
+            value = await compute()
+        except UncacheableResponse as e:
+            self.metrics["uncacheable"] += 1
+            return e.value, False
+        await self._call(self.backend.set, key, value, time.time())
+        return value, False
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.metrics["hits"] + self.metrics["stale_hits"] + self.metrics["misses"]
+        hit_rate = (self.metrics["hits"] + self.metrics["stale_hits"]) / lookups if lookups else 0.0
+        return {"entries": len(self.backend), "hit_rate": round(hit_rate, 4), **self.metrics}
+
+    async def _refresh(self, key: str, compute: Callable[[], Awaitable[str]]) -> None:
+        try:
+            value = await compute()
+        except UncacheableResponse:
+            # نسخه قبلی تا پایان دوره stale باقی می‌ماند
+            self.metrics["uncacheable"] += 1
+            return
+        except Exception as e:
+            logger.warning("خطا در تازه‌سازی cache پاسخ", extra={"error": str(e)})
+            self.metrics["refresh_failures"] += 1
+            return
+        await self._call(self.backend.set, key, value, time.time())
+        self.metrics["refreshes"] += 1
+
+    async def _call(self, func, *args):
+        # عملیات SQLite در thread جداگانه اجرا می‌شود تا event loop مسدود نشود
+        if self._blocking:
+            return await asyncio.to_thread(func, *args)
+        return func(*args)
@@ -0,0 +1,280 @@
+# router.py
+# مسیریابی مدل‌ها: برای هر نوع کار (chat، code، translate، ...) یک لیست از مدل‌های کاندید در فایل
+# تنظیمات (models.json) تعریف می‌شود. برای هر مدل تاخیر p50/p95 و نرخ خطا در یک پنجره لغزان ثبت می‌شود
+# و هر درخواست به سالم‌ترین/سریع‌ترین کاندید فرستاده می‌شود. اگر مدل اصلی کند، پر (429) یا از دسترس
+# خارج باشد، درخواست به کاندید بعدی منتقل می‌شود. تغییر مدل‌ها فقط با ویرایش فایل تنظیمات انجام می‌شود.
+import json
+import os
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Tuple
+
+# تنظیمات پیش‌فرض در صورت نبودن فایل تنظیمات
+DEFAULT_CONFIG: Dict[str, Any] = {
+    "models": {
+        "gemini-1.5-flash-latest": {"concurrency": 32, "timeout": 30, "rate": 10},
+        "gemini-1.5-pro-latest": {"concurrency": 8, "timeout": 120, "rate": 2},
+    },
+    "routes": {
+        "chat": {"models": ["gemini-1.5-flash-latest", "gemini-1.5-pro-latest"], "strategy": "ordered"},
+        "code": {"models": ["gemini-1.5-pro-latest", "gemini-1.5-flash-latest"], "strategy": "ordered"},
+        "code:low": {"models": ["gemini-1.5-flash-latest", "gemini-1.5-pro-latest"], "strategy": "ordered"},
+        "translate": {"models": ["gemini-1.5-flash-latest", "gemini-1.5-pro-latest"], "strategy": "fastest"},
+        "summary": {"models": ["gemini-1.5-flash-latest", "gemini-1.5-pro-latest"], "strategy": "fastest"},
+    },
+}
+STRATEGIES = ("ordered", "fastest")
+
+
+def load_model_config(path: Optional[str]) -> Dict[str, Any]:
+    """
+    فایل تنظیمات مدل‌ها را می‌خواند؛ اگر مسیر خالی باشد یا فایل وجود نداشته باشد تنظیمات پیش‌فرض برمی‌گردد.
+    """
+    if not path or not os.path.exists(path):
+        return DEFAULT_CONFIG
+    with open(path, encoding="utf-8") as f:
+        config = json.load(f)
+    for name, route in config.get("routes", {}).items():
+        if not route.get("models"):
+            raise ValueError(f"مسیر '{name}' در {path} هیچ مدلی ندارد.")
+        if route.get("strategy", "ordered") not in STRATEGIES:
+            raise ValueError(f"strategy نامعتبر برای مسیر '{name}'. مقادیر مجاز: {', '.join(STRATEGIES)}")
+    return config
+
+
+class ModelStats:
+    """
+    آمار پنجره لغزان یک مدل: تاخیر درخواست‌های موفق و نتیجه (موفق/ناموفق) آخرین درخواست‌ها.
+    """
+
+    def __init__(self, window: int = 100):
+        self._latencies: Deque[float] = deque(maxlen=window)
+        self._outcomes: Deque[bool] = deque(maxlen=window)
+        self._sorted: Optional[List[float]] = None
+        self.cooldown_until = 0.0
+        self.requests = 0
+        self.failures = 0
+
+    def record(self, latency: float, ok: bool) -> None:
+        self.requests += 1
+        self._outcomes.append(ok)
+        if ok:
+            self._latencies.append(latency)
+            self._sorted = None
+        else:
+            self.failures += 1
+
+    def reset(self) -> None:
+        self._latencies.clear()
+        self._outcomes.clear()
+        self._sorted = None
+        self.cooldown_until = 0.0
+
+    @property
+    def samples(self) -> int:
+        return len(self._latencies)
+
+    def percentile(self, q: float) -> Optional[float]:
+        if not self._latencies:
+            return None
+        if self._sorted is None:
+            self._sorted = sorted(self._latencies)
+        return self._sorted[min(len(self._sorted) - 1, int(q * len(self._sorted)))]
+
+    @property
+    def error_rate(self) -> float:
+        if not self._outcomes:
+            return 0.0
+        return self._outcomes.count(False) / len(self._outcomes)
+
+    def to_dict(self) -> Dict[str, Any]:
+        p50, p95 = self.percentile(0.5), self.percentile(0.95)
+        return {
+            "p50_ms": round(p50 * 1000, 1) if p50 is not None else None,
+            "p95_ms": round(p95 * 1000, 1) if p95 is not None else None,
+            "error_rate": round(self.error_rate, 4),
+            "cooling_down": self.cooldown_until > time.monotonic(),
+            "requests": self.requests,
+            "failures": self.failures,
+        }
+
+
+class ModelRouter:
+    """
+    انتخاب مدل برای هر مسیر و fallback به کاندید بعدی.
+
+    - strategy='ordered': اولین مدل سالم به ترتیب فایل تنظیمات (مدل اصلی ترجیح دارد)
+    - strategy='fastest': مدل سالم با کمترین p50؛ مدل‌های بدون نمونه کافی ابتدا امتحان می‌شوند
+    مدل ناسالم است اگر در cooldown باشد (پس از 429 یا circuit باز)، نرخ خطای آن از max_error_rate بیشتر
+    باشد، یا p95 آن از max_p95 مسیر (بر حسب ثانیه) بیشتر باشد.
+    """
+
+    def __init__(
+        self,
+        config: Dict[str, Any],
+        should_fallback: Callable[[BaseException], Tuple[bool, bool]],
+        window: int = 100,
+        min_samples: int = 5,
+        max_error_rate: float = 0.5,
+        cooldown_seconds: float = 30.0,
+    ):
+        self.models: Dict[str, Dict[str, Any]] = dict(config.get("models", {}))
+        self.routes: Dict[str, Dict[str, Any]] = dict(config.get("routes", {}))
+        # should_fallback(خطا) -> (انتقال به کاندید بعدی؟، آیا مدل پر/throttle شده است؟)
+        self.should_fallback = should_fallback
+        self.window = window
+        self.min_samples = min_samples
+        self.max_error_rate = max_error_rate
+        self.cooldown_seconds = cooldown_seconds
+        self._stats: Dict[str, ModelStats] = {}
+        self.metrics: Dict[str, int] = {"fallbacks": 0}
+
+    def route(self, task: str, variant: Optional[str] = None) -> str:
+        """
+        نام مسیر برای یک کار؛ اگر مسیر اختصاصی (مثلاً 'code:low') تعریف شده باشد همان برگردانده می‌شود.
+        """
+        if variant is not None and f"{task}:{variant}" in self.routes:
+            return f"{task}:{variant}"
+        if task not in self.routes:
+            raise KeyError(f"مسیر مدل '{task}' در تنظیمات تعریف نشده است.")
+        return task
+
+    def primary(self, route: str) -> str:
+        return self.routes[route]["models"][0]
+
+    def preferred(self, route: str) -> str:
+        # مدلی که درخواست بعدی این مسیر (اگر خطایی رخ ندهد) به آن فرستاده می‌شود
+        return self.candidates(route)[0]
+
+    def model_settings(self, key: str) -> Dict[str, Any]:
+        """
+        نگاشت نام مدل به یک تنظیم (مثلاً 'concurrency'، 'timeout' یا 'rate') برای مدل‌هایی که آن را دارند.
+        """
+        return {model: settings[key] for model, settings in self.models.items() if key in settings}
+
+    def candidates(self, route: str) -> List[str]:
+        """
+        کاندیدهای مسیر به ترتیب انتخاب: ابتدا مدل‌های سالم (طبق strategy) و سپس بقیه به عنوان آخرین چاره.
+        فقط خواندنی است (برای آمار و کلید single-flight)؛ شروع cooldown و پاک کردن آمار فقط در select() انجام می‌شود.
+        """
+        config = self.routes[route]
+        now = time.monotonic()
+        states = self._health(route, now)
+        healthy, degraded = [], []
+        for model, health in states:
+            if health in ("healthy", "recovered"):
+                healthy.append(model)
+            else:
+                degraded.append(model)
+        if config.get("strategy", "ordered") == "fastest":
+            # آمار مدلی که cooldown آن تمام شده در select() پاک می‌شود، پس مانند مدل بدون نمونه رتبه می‌گیرد
+            recovered = {model for model, health in states if health == "recovered"}
+            healthy.sort(key=lambda model: 0.0 if model in recovered else self._speed_key(model))
+        # مدل‌های ناسالم به ترتیب زمان پایان cooldown (یا cooldown‌ای که select() شروع می‌کند) و سپس سرعت امتحان می‌شوند
+        degraded.sort(key=lambda model: (self._cooldown_end(model, now), self._speed_key(model)))
+        return healthy + degraded
+
+    def select(self, route: str) -> List[str]:
+        """
+        تغییرات وضعیت سلامت مدل‌های مسیر را اعمال می‌کند و کاندیدها را برمی‌گرداند؛ فقط هنگام ارسال درخواست.
+        """
+        now = time.monotonic()
+        for model, health in self._health(route, now):
+            stats = self._model_stats(model)
+            if health == "tripped":
+                stats.cooldown_until = now + self.cooldown_seconds
+            elif health == "recovered":
+                # cooldown تمام شده است؛ مدلی که ترافیک نمی‌گیرد آماری برای بهبود ندارد، پس از نو شروع می‌کند
+                stats.reset()
+            elif health == "healthy":
+                stats.cooldown_until = 0.0
+        return self.candidates(route)
+
+    def _health(self, route: str, now: float) -> List[Tuple[str, str]]:
+        """
+        وضعیت هر مدل مسیر: healthy، cooling (در cooldown)، tripped (ناسالم؛ cooldown باید شروع شود)
+        یا recovered (ناسالم ولی cooldown آن تمام شده؛ آمارش باید پاک شود).
+        """
+        config = self.routes[route]
+        max_p95 = config.get("max_p95")
+        states = []
+        for model in config["models"]:
+            stats = self._model_stats(model)
+            p95 = stats.percentile(0.95)
+            if stats.cooldown_until > now:
+                states.append((model, "cooling"))
+            elif stats.error_rate > self.max_error_rate or (max_p95 is not None and p95 is not None and p95 > max_p95):
+                states.append((model, "recovered" if stats.cooldown_until else "tripped"))
+            else:
+                states.append((model, "healthy"))
+        return states
+
+    def _cooldown_end(self, model: str, now: float) -> float:
+        cooldown_until = self._model_stats(model).cooldown_until
+        return cooldown_until if cooldown_until > now else now + self.cooldown_seconds
+
+    async def call(self, route: str, fn: Callable[[str, bool], Awaitable[Any]]) -> Any:
+        """
+        fn(model, has_fallback) را با اولین کاندید اجرا می‌کند و در صورت خطای قابل fallback کاندید بعدی را
+        امتحان می‌کند. has_fallback نشان می‌دهد که بعد از این مدل کاندید دیگری وجود دارد
+        (مثلاً تا به جای تلاش مجدد طولانی روی مدل پر، سریع‌تر به مدل بعدی برود).
+        """
+        _, result = await self.serve(route, fn)
+        return result
+
+    async def serve(self, route: str, fn: Callable[[str, bool], Awaitable[Any]]) -> Tuple[str, Any]:
+        """
+        مانند call، اما (نام مدلی که پاسخ را داده، نتیجه) را برمی‌گرداند؛ مثلاً تا پاسخ مدل fallback
+        با پاسخ مدل اصلی اشتباه گرفته و cache نشود.
+        """
+        candidates = self.select(route)
+        last_error: Optional[BaseException] = None
+        for index, model in enumerate(candidates):
+            if index:
+                self.metrics["fallbacks"] += 1
+            started = time.monotonic()
+            try:
+                result = await fn(model, index < len(candidates) - 1)
+            except Exception as e:
+                fallback = self.failed(model, e)
+                if not fallback:
+                    raise
+                last_error = e
+                continue
+            self.succeeded(model, time.monotonic() - started)
+            return model, result
+        raise last_error
+
+    def succeeded(self, model: str, latency: float) -> None:
+        self._model_stats(model).record(latency, True)
+
+    def failed(self, model: str, exc: BaseException) -> bool:
+        """
+        خطای یک مدل را ثبت می‌کند و برمی‌گرداند آیا باید به کاندید بعدی رفت.
+        """
+        fallback, over_quota = self.should_fallback(exc)
+        if fallback:
+            stats = self._model_stats(model)
+            stats.record(0.0, False)
+            if over_quota:
+                stats.cooldown_until = time.monotonic() + self.cooldown_seconds
+        return fallback
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "routes": {route: self.candidates(route) for route in self.routes},
+            "models": {model: stats.to_dict() for model, stats in self._stats.items()},
+            **self.metrics,
+        }
+
+    def _speed_key(self, model: str) -> float:
+        stats = self._model_stats(model)
+        if stats.samples < self.min_samples:
+            return 0.0
+        return stats.percentile(0.5)
+
+    def _model_stats(self, model: str) -> ModelStats:
+        stats = self._stats.get(model)
+        if stats is None:
+            stats = self._stats[model] = ModelStats(self.window)
+        return stats
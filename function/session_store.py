@@ -0,0 +1,529 @@
+# session_store.py
+# ذخیره‌ساز تاریخچه جلسه‌های چت با محدودیت حافظه و حذف خودکار (LRU / TTL).
+# جلسه‌های بیکار یا حذف‌شده در صورت تنظیم backend دیسکی (SQLite) به دیسک منتقل می‌شوند
+# و در درخواست بعدی دوباره بارگذاری می‌شوند، بنابراین از دست نمی‌روند.
+# در مسیرهای async از متدهای aget/aversion/aget_page/aappend استفاده شود: اگر ذخیره‌ساز به SQLite دسترسی
+# داشته باشد، فراخوانی در thread جداگانه اجرا می‌شود تا event loop منتظر قفل یا busy timeout پایگاه‌داده نماند.
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # ویندوز: فقط قفل درون‌پردازه‌ای در دسترس است
+    fcntl = None
+
+Turn = Dict[str, Any]
+
+
+def turn_size(turn: Turn) -> int:
+    """
+    اندازه تقریبی یک نوبت گفتگو بر حسب بایت (متن UTF-8 همه partها).
+    """
+    return sum(len(part.get("text", "").encode("utf-8")) for part in turn.get("parts", []))
+
+
+class SqliteSessionBackend:
+    """
+    backend دیسکی ساده برای نگهداری جلسه‌هایی که از حافظه خارج شده‌اند.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        # isolation_level=None: تراکنش‌ها به صورت صریح مدیریت می‌شوند (لازم برای BEGIN IMMEDIATE)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=10, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            "session_id TEXT PRIMARY KEY, history TEXT NOT NULL, "
+            "history_offset INTEGER NOT NULL DEFAULT 0, updated_at REAL NOT NULL, turns INTEGER NOT NULL DEFAULT 0)"
+        )
+        # تعداد نوبت‌ها در ستون جداگانه تا version بدون decode کل تاریخچه خوانده شود
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(sessions)")}
+        if "turns" not in columns:
+            self._conn.execute("ALTER TABLE sessions ADD COLUMN turns INTEGER NOT NULL DEFAULT 0")
+            self._conn.execute("UPDATE sessions SET turns = json_array_length(history)")
+
+    def load(self, session_id: str) -> Optional[Tuple[List[Turn], int]]:
+        """
+        (تاریخچه، offset) جلسه را برمی‌گرداند؛ offset تعداد نوبت‌های حذف‌شده از ابتدای تاریخچه است.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT history, history_offset FROM sessions WHERE session_id = ?", (session_id,)
+            ).fetchone()
+        return (json.loads(row[0]), row[1]) if row else None
+
+    def version(self, session_id: str) -> int:
+        """
+        offset + تعداد نوبت‌های جلسه (۰ اگر جلسه وجود نداشته باشد).
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT history_offset + turns FROM sessions WHERE session_id = ?", (session_id,)
+            ).fetchone()
+        return row[0] if row else 0
+
+    def save(self, session_id: str, history: List[Turn], offset: int = 0) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO sessions (session_id, history, history_offset, updated_at, turns) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (session_id, json.dumps(history, ensure_ascii=False), offset, time.time(), len(history)),
+            )
+            self._conn.commit()
+
+    def update(
+        self, session_id: str, fn: Callable[[List[Turn], int], Tuple[List[Turn], int]]
+    ) -> Tuple[List[Turn], int]:
+        """
+        خواندن و نوشتن اتمیک یک جلسه در یک تراکنش (BEGIN IMMEDIATE)، امن بین چند پردازه.
+        fn تاریخچه و offset فعلی را می‌گیرد و مقدار جدید را برمی‌گرداند.
+        """
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT history, history_offset FROM sessions WHERE session_id = ?", (session_id,)
+                ).fetchone()
+                history, offset = (json.loads(row[0]), row[1]) if row else ([], 0)
+                history, offset = fn(history, offset)
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO sessions (session_id, history, history_offset, updated_at, turns) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (session_id, json.dumps(history, ensure_ascii=False), offset, time.time(), len(history)),
+                )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return history, offset
+
+    def delete(self, session_id: str) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+            self._conn.commit()
+
+    def purge_older_than(self, timestamp: float) -> int:
+        with self._lock:
+            cursor = self._conn.execute("DELETE FROM sessions WHERE updated_at < ?", (timestamp,))
+            self._conn.commit()
+        return cursor.rowcount
+
+    def count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+class _Session:
+    __slots__ = ("history", "offset", "size", "last_access")
+
+    def __init__(self, history: List[Turn], offset: int = 0):
+        self.history = history
+        # تعداد نوبت‌هایی که از ابتدای تاریخچه حذف شده‌اند؛ offset + len(history) نسخه جلسه است
+        self.offset = offset
+        self.size = sum(turn_size(turn) for turn in history)
+        self.last_access = time.monotonic()
+
+
+def trim_session(session: _Session, max_turns: int, max_bytes: int) -> Tuple[int, int]:
+    """
+    قدیمی‌ترین نوبت‌ها را تا رعایت سقف تعداد/حجم حذف می‌کند: (تعداد نوبت‌های حذف‌شده، بایت‌های آزادشده).
+    """
+    trimmed = removed_bytes = 0
+
+    def pop_oldest():
+        nonlocal trimmed, removed_bytes
+        size = turn_size(session.history.pop(0))
+        session.offset += 1
+        session.size -= size
+        removed_bytes += size
+        trimmed += 1
+
+    while session.history and (len(session.history) > max_turns or session.size > max_bytes):
+        pop_oldest()
+    # تاریخچه Gemini باید با نوبت کاربر شروع شود
+    while session.history and session.history[0].get("role") != "user":
+        pop_oldest()
+    return trimmed, removed_bytes
+
+
+class SessionLocks:
+    """
+    قفل جداگانه برای هر جلسه تا نوبت‌های همزمان یک کاربر با هم تداخل نکنند.
+    قفل درون‌پردازه‌ای با asyncio.Lock است؛ اگر lock_dir تنظیم شود، قفل فایل (fcntl) نیز گرفته می‌شود
+    تا workerهای مختلف uvicorn روی یک میزبان هم یکدیگر را رعایت کنند.
+    """
+
+    def __init__(self, lock_dir: Optional[str] = None, buckets: int = 1024, poll_interval: float = 0.01):
+        self.lock_dir = lock_dir if fcntl is not None else None
+        self.buckets = buckets
+        self.poll_interval = poll_interval
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._waiters: Dict[str, int] = {}
+        if self.lock_dir:
+            os.makedirs(self.lock_dir, exist_ok=True)
+
+    @asynccontextmanager
+    async def lock(self, session_id: str) -> AsyncIterator[None]:
+        lock = self._locks.get(session_id)
+        if lock is None:
+            lock = self._locks[session_id] = asyncio.Lock()
+        self._waiters[session_id] = self._waiters.get(session_id, 0) + 1
+        try:
+            async with lock:
+                if self.lock_dir:
+                    fd = await self._acquire_file_lock(session_id)
+                    try:
+                        yield
+                    finally:
+                        fcntl.flock(fd, fcntl.LOCK_UN)
+                        os.close(fd)
+                else:
+                    yield
+        finally:
+            # قفل‌های بدون منتظر حذف می‌شوند تا دیکشنری قفل‌ها بی‌نهایت رشد نکند
+            self._waiters[session_id] -= 1
+            if not self._waiters[session_id]:
+                del self._waiters[session_id]
+                del self._locks[session_id]
+
+    async def _acquire_file_lock(self, session_id: str) -> int:
+        bucket = int(hashlib.sha1(session_id.encode("utf-8")).hexdigest(), 16) % self.buckets
+        fd = os.open(os.path.join(self.lock_dir, f"{bucket:04d}.lock"), os.O_CREAT | os.O_RDWR)
+        # قفل غیرمسدودکننده با polling تا هیچ thread یا event loopی منتظر نماند
+        while True:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return fd
+            except BlockingIOError:
+                await asyncio.sleep(self.poll_interval)
+            except BaseException:
+                os.close(fd)
+                raise
+
+
+class AsyncSessionAccess:
+    """
+    نسخه‌های async متدهای خواندن/نوشتن جلسه؛ اگر blocking باشد (دسترسی به SQLite) در thread اجرا می‌شوند.
+    """
+
+    blocking = False
+
+    async def aget(self, session_id: str, default: Optional[List[Turn]] = None) -> List[Turn]:
+        return await self._call(self.get, session_id, default)
+
+    async def aversion(self, session_id: str) -> int:
+        return await self._call(self.version, session_id)
+
+    async def aget_page(self, session_id: str, cursor: int = 0, limit: int = 50) -> Tuple[List[Turn], int, int]:
+        return await self._call(self.get_page, session_id, cursor, limit)
+
+    async def aappend(self, session_id: str, *turns: Turn) -> int:
+        return await self._call(self.append, session_id, *turns)
+
+    async def _call(self, func, *args):
+        if self.blocking:
+            return await asyncio.to_thread(func, *args)
+        return func(*args)
+
+
+class SessionStore(AsyncSessionAccess):
+    """
+    ذخیره‌ساز درون‌حافظه‌ای جلسه‌ها با حذف LRU/TTL و سقف حافظه برای هر جلسه و کل جلسه‌ها.
+
+    - max_sessions: حداکثر تعداد جلسه‌های درون حافظه
+    - ttl_seconds: جلسه‌ای که بیش از این مدت استفاده نشده از حافظه خارج می‌شود
+    - max_turns_per_session / max_bytes_per_session: قدیمی‌ترین نوبت‌ها حذف می‌شوند
+    - max_total_bytes: سقف کل حافظه؛ جلسه‌های LRU تا رسیدن به سقف خارج می‌شوند
+    - backend: در صورت تنظیم، جلسه‌های خارج‌شده به جای حذف روی دیسک ذخیره می‌شوند
+    """
+
+    def __init__(
+        self,
+        max_sessions: int = 10_000,
+        ttl_seconds: Optional[float] = 24 * 3600,
+        max_turns_per_session: int = 200,
+        max_bytes_per_session: int = 256 * 1024,
+        max_total_bytes: int = 256 * 1024 * 1024,
+        backend: Optional[SqliteSessionBackend] = None,
+    ):
+        self.max_sessions = max_sessions
+        self.ttl_seconds = ttl_seconds
+        self.max_turns_per_session = max_turns_per_session
+        self.max_bytes_per_session = max_bytes_per_session
+        self.max_total_bytes = max_total_bytes
+        self.backend = backend
+        # جلسه‌های خارج‌شده از حافظه از دیسک بارگذاری یا روی آن ذخیره می‌شوند
+        self.blocking = backend is not None
+        self._sessions: "OrderedDict[str, _Session]" = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.RLock()
+        self.locks = SessionLocks()
+        self.metrics: Dict[str, int] = {
+            "evictions_lru": 0,
+            "evictions_ttl": 0,
+            "evictions_memory": 0,
+            "trimmed_turns": 0,
+            "spilled_to_disk": 0,
+            "restored_from_disk": 0,
+        }
+
+    # --- دسترسی به جلسه‌ها ---
+    def lock(self, session_id: str):
+        """
+        قفل async جلسه؛ خواندن تاریخچه، فراخوانی مدل و افزودن نوبت‌ها باید داخل آن انجام شود.
+        """
+        return self.locks.lock(session_id)
+
+    def __contains__(self, session_id: str) -> bool:
+        with self._lock:
+            return self._load(session_id) is not None
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def get(self, session_id: str, default: Optional[List[Turn]] = None) -> List[Turn]:
+        """
+        یک کپی از تاریخچه جلسه را برمی‌گرداند (یا default اگر جلسه وجود نداشته باشد).
+        """
+        with self._lock:
+            session = self._load(session_id)
+            if session is None:
+                return [] if default is None else default
+            return list(session.history)
+
+    def version(self, session_id: str) -> int:
+        """
+        نسخه (cursor) فعلی جلسه: تعداد کل نوبت‌هایی که تاکنون به جلسه اضافه شده‌اند.
+        """
+        with self._lock:
+            session = self._load(session_id)
+            return session.offset + len(session.history) if session else 0
+
+    def get_page(self, session_id: str, cursor: int = 0, limit: int = 50) -> Tuple[List[Turn], int, int]:
+        """
+        بخشی از تاریخچه را از اندیس مطلق cursor برمی‌گرداند: (نوبت‌ها، اندیس اولین نوبت، نسخه جلسه).
+        اگر نوبت‌های ابتدایی حذف شده باشند، صفحه از اولین نوبت موجود شروع می‌شود.
+        """
+        with self._lock:
+            session = self._load(session_id)
+            if session is None:
+                return [], 0, 0
+            start = max(cursor, session.offset)
+            index = start - session.offset
+            return session.history[index:index + limit], start, session.offset + len(session.history)
+
+    def append(self, session_id: str, *turns: Turn) -> int:
+        """
+        نوبت‌های جدید را به انتهای تاریخچه جلسه اضافه می‌کند، محدودیت‌ها را اعمال می‌کند
+        و نسخه جدید جلسه را برمی‌گرداند.
+        """
+        with self._lock:
+            session = self._load(session_id)
+            if session is None:
+                session = self._sessions[session_id] = _Session([])
+            for turn in turns:
+                session.history.append(turn)
+                size = turn_size(turn)
+                session.size += size
+                self._total_bytes += size
+            self._trim(session)
+            self._enforce_limits()
+            return session.offset + len(session.history)
+
+    def set(self, session_id: str, history: List[Turn]) -> None:
+        with self._lock:
+            self._drop(session_id)
+            session = self._sessions[session_id] = _Session(list(history))
+            self._total_bytes += session.size
+            self._trim(session)
+            self._enforce_limits()
+
+    def delete(self, session_id: str) -> None:
+        with self._lock:
+            self._drop(session_id)
+            if self.backend is not None:
+                self.backend.delete(session_id)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats: Dict[str, Any] = {
+                "sessions_in_memory": len(self._sessions),
+                "bytes_in_memory": self._total_bytes,
+                **self.metrics,
+            }
+        if self.backend is not None:
+            stats["sessions_on_disk"] = self.backend.count()
+        return stats
+
+    # --- حذف و مدیریت حافظه ---
+    def evict_expired(self) -> int:
+        """
+        جلسه‌هایی که TTL آن‌ها گذشته را از حافظه خارج می‌کند و تعدادشان را برمی‌گرداند.
+        """
+        if self.ttl_seconds is None:
+            return 0
+        deadline = time.monotonic() - self.ttl_seconds
+        evicted = 0
+        with self._lock:
+            # OrderedDict به ترتیب دسترسی مرتب است؛ قدیمی‌ترین‌ها در ابتدا هستند
+            while self._sessions:
+                session_id, session = next(iter(self._sessions.items()))
+                if session.last_access > deadline:
+                    break
+                self._evict(session_id, "evictions_ttl")
+                evicted += 1
+        return evicted
+
+    def flush(self) -> None:
+        """
+        همه جلسه‌های درون حافظه را روی backend دیسکی ذخیره می‌کند (مثلاً هنگام خاموش شدن).
+        """
+        if self.backend is None:
+            return
+        with self._lock:
+            for session_id, session in self._sessions.items():
+                self.backend.save(session_id, session.history, session.offset)
+
+    def _load(self, session_id: str) -> Optional[_Session]:
+        session = self._sessions.get(session_id)
+        if session is not None:
+            if self.ttl_seconds is not None and time.monotonic() - session.last_access > self.ttl_seconds:
+                self._evict(session_id, "evictions_ttl")
+                session = None
+            else:
+                session.last_access = time.monotonic()
+                self._sessions.move_to_end(session_id)
+                return session
+        if self.backend is None:
+            return None
+        stored = self.backend.load(session_id)
+        if stored is None:
+            return None
+        self.metrics["restored_from_disk"] += 1
+        session = self._sessions[session_id] = _Session(*stored)
+        self._total_bytes += session.size
+        self._enforce_limits()
+        return session
+
+    def _trim(self, session: _Session) -> None:
+        trimmed, removed_bytes = trim_session(session, self.max_turns_per_session, self.max_bytes_per_session)
+        self._total_bytes -= removed_bytes
+        self.metrics["trimmed_turns"] += trimmed
+
+    def _enforce_limits(self) -> None:
+        while len(self._sessions) > self.max_sessions:
+            self._evict(next(iter(self._sessions)), "evictions_lru")
+        while self._total_bytes > self.max_total_bytes and len(self._sessions) > 1:
+            self._evict(next(iter(self._sessions)), "evictions_memory")
+
+    def _evict(self, session_id: str, reason: str) -> None:
+        session = self._sessions.pop(session_id)
+        self._total_bytes -= session.size
+        self.metrics[reason] += 1
+        if self.backend is not None and session.history:
+            self.backend.save(session_id, session.history, session.offset)
+            self.metrics["spilled_to_disk"] += 1
+
+    def _drop(self, session_id: str) -> None:
+        session = self._sessions.pop(session_id, None)
+        if session is not None:
+            self._total_bytes -= session.size
+
+
+class SharedSessionStore(AsyncSessionAccess):
+    """
+    ذخیره‌ساز جلسه مشترک بین چند worker: همه خواندن/نوشتن‌ها مستقیماً روی SQLite (WAL) انجام می‌شود،
+    پس هر worker آخرین نسخه تاریخچه را می‌بیند. API آن با SessionStore یکسان است.
+    قفل جلسه‌ها علاوه بر asyncio.Lock از قفل فایل استفاده می‌کند تا نوبت‌های همزمان در workerهای
+    مختلف با هم تداخل نکنند. برای چند میزبان، backendی شبکه‌ای با همین رابط (load/save/update) لازم است.
+    """
+
+    blocking = True
+
+    def __init__(
+        self,
+        backend: SqliteSessionBackend,
+        ttl_seconds: Optional[float] = 24 * 3600,
+        max_turns_per_session: int = 200,
+        max_bytes_per_session: int = 256 * 1024,
+        lock_dir: Optional[str] = None,
+    ):
+        self.backend = backend
+        self.ttl_seconds = ttl_seconds
+        self.max_turns_per_session = max_turns_per_session
+        self.max_bytes_per_session = max_bytes_per_session
+        self.locks = SessionLocks(lock_dir or f"{backend.path}.locks")
+        self.metrics: Dict[str, int] = {"evictions_ttl": 0, "trimmed_turns": 0}
+
+    def lock(self, session_id: str):
+        return self.locks.lock(session_id)
+
+    def __contains__(self, session_id: str) -> bool:
+        return self.backend.load(session_id) is not None
+
+    def get(self, session_id: str, default: Optional[List[Turn]] = None) -> List[Turn]:
+        stored = self.backend.load(session_id)
+        if stored is None:
+            return [] if default is None else default
+        return stored[0]
+
+    def version(self, session_id: str) -> int:
+        return self.backend.version(session_id)
+
+    def get_page(self, session_id: str, cursor: int = 0, limit: int = 50) -> Tuple[List[Turn], int, int]:
+        stored = self.backend.load(session_id)
+        if stored is None:
+            return [], 0, 0
+        history, offset = stored
+        start = max(cursor, offset)
+        index = start - offset
+        return history[index:index + limit], start, offset + len(history)
+
+    def append(self, session_id: str, *turns: Turn) -> int:
+        def apply(history: List[Turn], offset: int) -> Tuple[List[Turn], int]:
+            session = _Session(history + list(turns), offset)
+            trimmed, _ = trim_session(session, self.max_turns_per_session, self.max_bytes_per_session)
+            self.metrics["trimmed_turns"] += trimmed
+            return session.history, session.offset
+
+        history, offset = self.backend.update(session_id, apply)
+        return offset + len(history)
+
+    def set(self, session_id: str, history: List[Turn]) -> None:
+        session = _Session(list(history))
+        trim_session(session, self.max_turns_per_session, self.max_bytes_per_session)
+        self.backend.save(session_id, session.history, session.offset)
+
+    def delete(self, session_id: str) -> None:
+        self.backend.delete(session_id)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"backend": "sqlite", "sessions_on_disk": self.backend.count(), **self.metrics}
+
+    def evict_expired(self) -> int:
+        if self.ttl_seconds is None:
+            return 0
+        evicted = self.backend.purge_older_than(time.time() - self.ttl_seconds)
+        self.metrics["evictions_ttl"] += evicted
+        return evicted
+
+    def flush(self) -> None:
+        # همه تغییرات بلافاصله در SQLite نوشته می‌شوند
+        pass
@@ -0,0 +1,122 @@
+# settings.py
+# پیکربندی gateway در یک شیء تایپ‌دار که فقط یک بار (در اولین get_settings) از متغیرهای محیطی و فایل .env
+# خوانده می‌شود. نام متغیر محیطی هر فیلد همان نام فیلد با حروف بزرگ است (مگر در metadata مشخص شده باشد)
+# و مقدار آن بر اساس نوع فیلد (int، float، bool، str) تبدیل می‌شود. مقدار نامعتبر هنگام بارگذاری خطا می‌دهد.
+# اعتبارسنجی کلیدهای API در import انجام نمی‌شود؛ main.py آن را در hook راه‌اندازی (lifespan) انجام می‌دهد.
+import os
+from dataclasses import dataclass, field, fields
+from functools import lru_cache
+from typing import Mapping, Optional, get_type_hints
+
+from function.upstream import DEFAULT_BASE_URL
+
+TRUE_VALUES = ("1", "true", "yes", "on")
+
+
+@dataclass(frozen=True)
+class Settings:
+    # --- کلیدها و Gemini ---
+    gemini_api_key: Optional[str] = field(default=None, metadata={"env": "GOOGLE_API_KEY"})
+    openai_api_key: Optional[str] = None
+    gemini_api_base_url: str = DEFAULT_BASE_URL
+    gemini_timeout: float = 60.0
+    gemini_max_connections: int = 100
+    log_level: str = "INFO"
+    log_format: str = "text"
+
+    # --- مسیریابی مدل و resilience ---
+    model_config_path: str = "models.json"
+    model_max_error_rate: float = 0.5
+    model_cooldown_seconds: float = 30.0
+    gemini_rate_per_second: float = 20.0
+    upstream_retries: int = 3
+    circuit_failure_threshold: int = 5
+    circuit_recovery_seconds: float = 30.0
+    upstream_max_concurrency: int = 64
+    upstream_singleflight: bool = True
+
+    # --- جلسه‌ها و context ---
+    session_backend: str = "memory"
+    session_db_path: Optional[str] = None
+    session_sweep_interval: float = 60.0
+    session_ttl_seconds: float = 24 * 3600.0
+    session_max_turns: int = 200
+    session_max_bytes: int = 256 * 1024
+    session_max_sessions: int = 10_000
+    session_max_total_bytes: int = 256 * 1024 * 1024
+    context_token_budget: int = 8000
+    context_summary_enabled: bool = True
+    context_keep_ratio: float = 0.5
+    context_cache_enabled: bool = True
+    context_cache_ttl_seconds: float = 3600.0
+    context_cache_renew_seconds: float = 300.0
+    context_cache_min_bytes: int = 4096
+    context_cache_history_turns: int = 0
+    context_cache_max_entries: int = 256
+
+    # --- cacheها ---
+    translation_cache_size: int = 10_000
+    translation_cache_path: str = "cache/translations.db"
+    translation_cache_ttl_seconds: float = 30 * 24 * 3600.0
+    code_cache_backend: str = "memory"
+    code_cache_default: bool = False
+    code_cache_max_entries: int = 1000
+    code_cache_path: str = "cache/code_responses.db"
+    code_cache_ttl_seconds: float = 3600.0
+    code_cache_stale_seconds: float = 600.0
+
+    # --- تصویر و کارهای پس‌زمینه ---
+    image_max_concurrency: int = 4
+    image_max_queue: int = 32
+    image_timeout: float = 120.0
+    openai_rate_per_second: float = 1.0
+    image_store_dir: str = "cache/images"
+    image_thumbnail_size: int = 256
+    image_store_max_bytes: int = 20 * 1024 * 1024
+    public_base_url: str = ""
+    jobs_db_path: str = "cache/jobs.db"
+    job_workers: int = 4
+    job_max_pending: int = 1000
+    job_retention_seconds: float = 3600.0
+    job_lease_seconds: float = 60.0
+
+    # --- batch و workspace ---
+    batch_max_items: int = 500
+    batch_concurrency: int = 16
+    workspace_dir: str = "workspace"
+    workspace_max_upload_bytes: int = 50 * 1024 * 1024
+    workspace_index_path: str = "cache/workspace_index.db"
+    workspace_index_max_content_bytes: int = 1024 * 1024
+
+    @classmethod
+    def from_env(cls, environ: Optional[Mapping[str, str]] = None) -> "Settings":
+        environ = os.environ if environ is None else environ
+        hints = get_type_hints(cls)
+        values = {}
+        for item in fields(cls):
+            name = item.metadata.get("env", item.name.upper())
+            raw = environ.get(name)
+            if raw is None:
+                continue
+            kind = hints[item.name]
+            try:
+                if kind is bool:
+                    values[item.name] = raw.strip().lower() in TRUE_VALUES
+                elif kind in (int, float):
+                    values[item.name] = kind(raw)
+                else:
+                    values[item.name] = raw
+            except ValueError:
+                raise ValueError(f"مقدار نامعتبر برای {name}: '{raw}'") from None
+        return cls(**values)
+
+
+@lru_cache(maxsize=1)
+def get_settings() -> Settings:
+    """
+    تنظیمات را یک بار (پس از بارگذاری فایل .env) می‌خواند و همان شیء را برمی‌گرداند.
+    """
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    return Settings.from_env()
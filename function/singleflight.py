@@ -0,0 +1,36 @@
+# singleflight.py
+# ادغام فراخوانی‌های همزمان یکسان (request coalescing / single-flight).
+# اگر چند درخواست با کلید یکسان همزمان برسند، فقط یک فراخوانی upstream انجام می‌شود
+# و همه منتظرها نتیجه (یا خطای) همان فراخوانی را دریافت می‌کنند.
+import asyncio
+from typing import Any, Awaitable, Callable, Dict
+
+
+class SingleFlight:
+    def __init__(self):
+        self._calls: Dict[str, asyncio.Task] = {}
+        self.metrics: Dict[str, int] = {"leaders": 0, "followers": 0}
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        fn را برای کلید key اجرا می‌کند، یا اگر فراخوانی مشابهی در جریان است منتظر نتیجه آن می‌ماند.
+        """
+        task = self._calls.get(key)
+        if task is None:
+            self.metrics["leaders"] += 1
+            # فراخوانی به صورت task مستقل اجرا می‌شود تا لغو شدن درخواست اول، بقیه منتظرها را لغو نکند
+            task = self._calls[key] = asyncio.ensure_future(fn())
+            task.add_done_callback(lambda finished: self._finish(key, finished))
+        else:
+            self.metrics["followers"] += 1
+        return await asyncio.shield(task)
+
+    def in_flight(self) -> int:
+        return len(self._calls)
+
+    def _finish(self, key: str, task: asyncio.Task) -> None:
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        # اگر همه منتظرها لغو شده باشند، خطا بازیابی می‌شود تا هشدار "exception was never retrieved" ندهد
+        if not task.cancelled():
+            task.exception()
@@ -0,0 +1,177 @@
+# translation.py
+# زیرسیستم ترجمه پرامپت‌ها: تشخیص ارزان زبان بر اساس خط (script) و cache ترجمه‌ها.
+# فقط متن‌هایی که واقعاً به خط فارسی/عربی (یا خط غیرلاتین دیگری) نوشته شده‌اند ترجمه می‌شوند؛
+# یک ایموجی یا حرف لاتین accent‌دار باعث فراخوانی Gemini نمی‌شود.
+# ترجمه‌ها با کلید محتوایی (hash متن نرمال‌شده) در یک LRU درون حافظه و یک فایل SQLite
+# مشترک بین workerها ذخیره می‌شوند تا پرامپت تکراری هرگز دو بار به upstream ارسال نشود.
+# ورودی‌ها پس از ttl_seconds منقضی می‌شوند و نسخه cache (CACHE_VERSION) بخشی از کلید است؛ با تغییر آن
+# ورودی‌های قدیمی فایل SQLite نادیده گرفته می‌شوند. ترجمه خالی هرگز ذخیره نمی‌شود.
+import asyncio
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+# بازه‌های یونیکد خط عربی (شامل حروف فارسی و شکل‌های نمایشی)
+ARABIC_SCRIPT_RANGES = (
+    (0x0600, 0x06FF),
+    (0x0750, 0x077F),
+    (0x08A0, 0x08FF),
+    (0xFB50, 0xFDFF),
+    (0xFE70, 0xFEFF),
+)
+# حروف لاتین (پایه، Latin-1، Extended-A/B و IPA)
+LATIN_MAX_CODEPOINT = 0x024F
+# نسخه 2: ورودی‌های نسخه قبل ممکن است متن جایگزین «پاسخ متنی از مدل دریافت نشد» را به جای ترجمه داشته باشند
+CACHE_VERSION = 2
+DEFAULT_TTL_SECONDS = 30 * 24 * 3600.0
+
+
+def _is_arabic_script(codepoint: int) -> bool:
+    return any(start <= codepoint <= end for start, end in ARABIC_SCRIPT_RANGES)
+
+
+def detect_language(text: str, min_ratio: float = 0.3) -> str:
+    """
+    تشخیص ارزان زبان بر اساس خط حروف:
+    'fa' برای خط فارسی/عربی، 'other' برای سایر خط‌های غیرلاتین و 'en' برای متن لاتین.
+    فقط حروف شمرده می‌شوند؛ اعداد، علائم و ایموجی‌ها تاثیری ندارند.
+    """
+    if text.isascii():
+        return "en"
+    latin = arabic = other = 0
+    for char in text:
+        if not char.isalpha():
+            continue
+        codepoint = ord(char)
+        if codepoint <= LATIN_MAX_CODEPOINT:
+            latin += 1
+        elif _is_arabic_script(codepoint):
+            arabic += 1
+        else:
+            other += 1
+    letters = latin + arabic + other
+    if not letters or (arabic + other) / letters < min_ratio:
+        return "en"
+    return "fa" if arabic >= other else "other"
+
+
+def normalize_prompt(text: str) -> str:
+    # نرمال‌سازی یونیکد و فاصله‌ها تا پرامپت‌های معادل یک کلید cache داشته باشند
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+def cache_key(text: str, target: str = "en") -> str:
+    return hashlib.sha256(f"v{CACHE_VERSION}\x00{target}\x00{text}".encode("utf-8")).hexdigest()
+
+
+class EmptyTranslationError(ValueError):
+    """
+    مدل ترجمه متنی برنگرداند؛ نتیجه cache نمی‌شود.
+    """
+
+
+class TranslationCache:
+    """
+    cache ترجمه با کلید محتوایی: LRU درون حافظه به همراه SQLite اختیاری روی دیسک.
+    """
+
+    def __init__(self, max_entries: int = 10_000, path: Optional[str] = None, ttl_seconds: float = DEFAULT_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        # کلید ← (ترجمه، زمان ساخت)
+        self._memory: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        self.metrics: Dict[str, int] = {"memory_hits": 0, "disk_hits": 0, "misses": 0}
+        if path:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._conn = sqlite3.connect(path, check_same_thread=False, timeout=10)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS translations ("
+                "key TEXT PRIMARY KEY, translation TEXT NOT NULL, created_at REAL NOT NULL)"
+            )
+            self._conn.commit()
+
+    async def get(self, key: str) -> Optional[str]:
+        entry = self._memory.get(key)
+        if entry is not None:
+            value, created_at = entry
+            if created_at > time.time() - self.ttl_seconds:
+                self._memory.move_to_end(key)
+                self.metrics["memory_hits"] += 1
+                return value
+            del self._memory[key]
+        if self._conn is not None:
+            row = await asyncio.to_thread(self._disk_get, key)
+            if row is not None:
+                self.metrics["disk_hits"] += 1
+                self._remember(key, *row)
+                return row[0]
+        self.metrics["misses"] += 1
+        return None
+
+    async def put(self, key: str, value: str) -> None:
+        created_at = time.time()
+        self._remember(key, value, created_at)
+        if self._conn is not None:
+            await asyncio.to_thread(self._disk_put, key, value, created_at)
+
+    def stats(self) -> Dict[str, int]:
+        return {"entries_in_memory": len(self._memory), **self.metrics}
+
+    def _remember(self, key: str, value: str, created_at: float) -> None:
+        self._memory[key] = (value, created_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def _disk_get(self, key: str) -> Optional[Tuple[str, float]]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT translation, created_at FROM translations WHERE key = ? AND created_at > ?",
+                (key, time.time() - self.ttl_seconds),
+            ).fetchone()
+        return (row[0], row[1]) if row else None
+
+    def _disk_put(self, key: str, value: str, created_at: float) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO translations (key, translation, created_at) VALUES (?, ?, ?)",
+                (key, value, created_at),
+            )
+            self._conn.commit()
+
+
+class Translator:
+    """
+    ترجمه پرامپت‌های غیرانگلیسی به انگلیسی با تشخیص زبان و cache.
+    translate_fn تابع async است که متن را ترجمه می‌کند (مثلاً translate_with_gemini) و اگر مدل متنی
+    برنگرداند (مثلاً مسدود شدن توسط SAFETY) باید خطا پرتاب کند؛ خطاها و ترجمه خالی cache نمی‌شوند.
+    """
+
+    def __init__(self, translate_fn: Callable[[str], Awaitable[str]], cache: TranslationCache):
+        self.translate_fn = translate_fn
+        self.cache = cache
+
+    async def translate_if_needed(self, prompt: str) -> str:
+        if detect_language(prompt) == "en":
+            return prompt
+        normalized = normalize_prompt(prompt)
+        key = cache_key(normalized)
+        cached = await self.cache.get(key)
+        if cached is not None:
+            return cached
+        translation = (await self.translate_fn(normalized)).strip()
+        if not translation:
+            raise EmptyTranslationError("ترجمه‌ای از مدل دریافت نشد.")
+        await self.cache.put(key, translation)
+        return translation
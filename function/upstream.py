@@ -0,0 +1,189 @@
+# upstream.py
+# لایه کلاینت async برای ارتباط با Gemini API.
+# یک httpx.AsyncClient مشترک بین همه endpointها استفاده می‌شود تا اتصال‌های TCP/TLS
+# در pool زنده بمانند و فراخوانی‌ها event loop را مسدود نکنند.
+import asyncio
+import time
+from typing import Any, AsyncIterator, Callable, Dict, Optional
+
+import httpx
+
+from function.payloads import encode_payload, loads
+from function.resilience import CircuitOpenError, parse_retry_after
+
+# HTTP/2 فقط در صورتی فعال می‌شود که پکیج h2 نصب باشد (pip install httpx[http2])
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+DEFAULT_BASE_URL = "https://generativelanguage.googleapis.com/v1beta/models"
+# کدهای وضعیتی که موقتی هستند و ارزش تلاش مجدد دارند
+RETRYABLE_STATUSES = (408, 429, 500, 502, 503, 504)
+
+
+def classify_httpx_error(exc: BaseException):
+    """
+    طبقه‌بندی خطاهای httpx برای لایه resilience: (قابل تلاش مجدد؟، Retry-After، کد وضعیت).
+    """
+    if isinstance(exc, httpx.HTTPStatusError):
+        status = exc.response.status_code
+        return status in RETRYABLE_STATUSES, parse_retry_after(exc.response.headers.get("Retry-After")), status
+    if isinstance(exc, httpx.TransportError):
+        # timeout و خطاهای اتصال
+        return True, None, None
+    return False, None, None
+
+
+def fallback_on_httpx_error(exc: BaseException):
+    """
+    برای مسیریاب مدل: (انتقال به مدل بعدی؟، آیا مدل پر/throttle شده است؟).
+    خطاهای موقتی و circuit باز باعث fallback می‌شوند؛ خطاهای درخواست (مثلاً 400) نه.
+    """
+    if isinstance(exc, CircuitOpenError):
+        return True, True
+    retryable, _, status = classify_httpx_error(exc)
+    return retryable, status == 429
+
+
+class GeminiClient:
+    """
+    کلاینت async و pool‌شده برای Gemini با محدودیت اتصال و timeout جداگانه برای هر مدل.
+    """
+
+    def __init__(
+        self,
+        api_key: str,
+        base_url: str = DEFAULT_BASE_URL,
+        timeout: float = 60.0,
+        connect_timeout: float = 10.0,
+        max_connections: int = 100,
+        max_keepalive_connections: int = 20,
+        default_model_limit: int = 16,
+        model_limits: Optional[Dict[str, int]] = None,
+        model_timeouts: Optional[Dict[str, float]] = None,
+        stage_observer: Optional[Callable[[str, float], None]] = None,
+    ):
+        self.api_key = api_key
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.max_connections = max_connections
+        self.max_keepalive_connections = max_keepalive_connections
+        self.default_model_limit = default_model_limit
+        self.model_limits = dict(model_limits or {})
+        self.model_timeouts = dict(model_timeouts or {})
+        # stage_observer(مرحله، ثانیه) برای ثبت مدت تجزیه JSON پاسخ در متریک‌ها
+        self.stage_observer = stage_observer
+        self._client: Optional[httpx.AsyncClient] = None
+        self._semaphores: Dict[str, asyncio.Semaphore] = {}
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        # کلاینت به صورت تنبل ساخته می‌شود تا داخل event loop فعال ایجاد شود
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                http2=HTTP2_AVAILABLE,
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_keepalive_connections,
+                ),
+                timeout=httpx.Timeout(self.timeout, connect=self.connect_timeout),
+                headers={"Content-Type": "application/json"},
+            )
+        return self._client
+
+    def _semaphore(self, model_name: str) -> asyncio.Semaphore:
+        semaphore = self._semaphores.get(model_name)
+        if semaphore is None:
+            limit = self.model_limits.get(model_name, self.default_model_limit)
+            semaphore = self._semaphores[model_name] = asyncio.Semaphore(limit)
+        return semaphore
+
+    def _timeout(self, model_name: str) -> httpx.Timeout:
+        return httpx.Timeout(
+            self.model_timeouts.get(model_name, self.timeout), connect=self.connect_timeout
+        )
+
+    def url(self, model_name: str, method: str = "generateContent") -> str:
+        return f"{self.base_url}/{model_name}:{method}"
+
+    @property
+    def cache_url(self) -> str:
+        # cachedContents کنار models در همان نسخه API قرار دارد (.../v1beta/cachedContents)
+        root = self.base_url[: -len("/models")] if self.base_url.endswith("/models") else self.base_url
+        return f"{root}/cachedContents"
+
+    async def create_cached_content(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        ثبت یک cachedContent (systemInstruction و contents ثابت) و بازگرداندن JSON آن (شامل name).
+        """
+        response = await self.client.post(self.cache_url, params={"key": self.api_key}, content=encode_payload(body))
+        response.raise_for_status()
+        return loads(response.content)
+
+    async def update_cached_content_ttl(self, name: str, ttl_seconds: float) -> Dict[str, Any]:
+        response = await self.client.patch(
+            f"{self.cache_url}/{name.rsplit('/', 1)[-1]}",
+            params={"key": self.api_key, "updateMask": "ttl"},
+            content=encode_payload({"ttl": f"{ttl_seconds:.0f}s"}),
+        )
+        response.raise_for_status()
+        return loads(response.content)
+
+    async def delete_cached_content(self, name: str) -> None:
+        response = await self.client.delete(f"{self.cache_url}/{name.rsplit('/', 1)[-1]}", params={"key": self.api_key})
+        response.raise_for_status()
+
+    async def generate_content(self, model_name: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        فراخوانی generateContent و بازگرداندن JSON خام پاسخ.
+        payloadهای ساخته‌شده از قالب (function/payloads.py) بدون encode دوباره بخش‌های ثابت ارسال می‌شوند.
+        در صورت خطای HTTP یک httpx.HTTPError پرتاب می‌شود.
+        """
+        body = encode_payload(payload)
+        async with self._semaphore(model_name):
+            response = await self.client.post(
+                self.url(model_name),
+                params={"key": self.api_key},
+                content=body,
+                timeout=self._timeout(model_name),
+            )
+        response.raise_for_status()
+        if self.stage_observer is None:
+            return loads(response.content)
+        started = time.perf_counter()
+        data = loads(response.content)
+        self.stage_observer("parse", time.perf_counter() - started)
+        return data
+
+    async def stream_generate_content(
+        self, model_name: str, payload: Dict[str, Any]
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """
+        فراخوانی streamGenerateContent با alt=sse و بازگرداندن تک‌تک chunkهای JSON به محض دریافت.
+        """
+        async with self._semaphore(model_name):
+            async with self.client.stream(
+                "POST",
+                self.url(model_name, "streamGenerateContent"),
+                params={"key": self.api_key, "alt": "sse"},
+                content=encode_payload(payload),
+                timeout=self._timeout(model_name),
+            ) as response:
+                if response.is_error:
+                    await response.aread()
+                    response.raise_for_status()
+                async for line in response.aiter_lines():
+                    # هر رویداد SSE به شکل "data: {...}" است؛ خطوط خالی جداکننده رویدادها هستند
+                    if not line.startswith("data:"):
+                        continue
+                    data = line[len("data:"):].strip()
+                    if data:
+                        yield loads(data)
+
+    async def aclose(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
@@ -0,0 +1,231 @@
+# workspace.py
+# لایه I/O فایل‌های workspace (کدها و خروجی‌های تولیدشده، لاگ‌ها).
+# ویرایش‌ها بدون بازنویسی کل فایل انجام می‌شوند: append به انتها، patch در یک offset مشخص، و جایگزینی کامل
+# به صورت اتمیک (نوشتن در فایل موقت در همان پوشه و سپس os.replace) تا خواننده‌ها هرگز فایل نیمه‌کاره نبینند.
+# خواندن بازه بایتی یا بازه خطوط با mmap انجام می‌شود (فقط همان بخش کپی می‌شود) و iter_chunks فایل را
+# تکه‌تکه برمی‌گرداند تا endpointها فایل‌های بزرگ را بدون بارگذاری کامل در حافظه ارسال کنند.
+import mmap
+import os
+import tempfile
+from contextlib import contextmanager
+from typing import BinaryIO, Callable, Iterable, Iterator, List, Optional, Tuple
+
+from function.logs import get_logger
+
+logger = get_logger("workspace")
+
+DEFAULT_CHUNK_SIZE = 64 * 1024
+
+
+class Workspace:
+    """
+    همه مسیرها نسبت به root هستند و اجازه خروج از root (مثلاً با '..' یا مسیر مطلق) داده نمی‌شود.
+    خطاها: FileNotFoundError، FileExistsError، و ValueError برای مسیر یا بازه نامعتبر.
+    """
+
+    def __init__(self, root: str = "workspace", chunk_size: int = DEFAULT_CHUNK_SIZE):
+        self.root = os.path.realpath(root)
+        self.chunk_size = chunk_size
+        # listener(مسیر نسبی) پس از هر تغییر فایل فراخوانی می‌شود (مثلاً برای به‌روزرسانی WorkspaceIndex)
+        self.listeners: List[Callable[[str], None]] = []
+        os.makedirs(self.root, exist_ok=True)
+
+    def _changed(self, full: str) -> None:
+        path = os.path.relpath(full, self.root).replace(os.sep, "/")
+        for listener in self.listeners:
+            try:
+                listener(path)
+            except Exception:
+                # خطای listener (مثلاً ایندکس) نباید نوشتن فایل را که انجام شده ناموفق نشان دهد
+                logger.exception("خطا در listener تغییر فایل", extra={"path": path})
+
+    def resolve(self, path: str) -> str:
+        full = os.path.realpath(os.path.join(self.root, path.lstrip("/\\")))
+        if full == self.root or not full.startswith(self.root + os.sep):
+            raise ValueError(f"مسیر نامعتبر: '{path}'")
+        return full
+
+    def exists(self, path: str) -> bool:
+        return os.path.isfile(self.resolve(path))
+
+    def size(self, path: str) -> int:
+        return os.path.getsize(self.resolve(path))
+
+    # --- نوشتن ---
+    def create(self, path: str, data: bytes = b"") -> int:
+        """
+        فایل جدید می‌سازد (پوشه‌های میانی هم ساخته می‌شوند). اگر فایل وجود داشته باشد FileExistsError.
+        """
+        full = self.resolve(path)
+        os.makedirs(os.path.dirname(full), exist_ok=True)
+        with open(full, "xb") as f:
+            f.write(data)
+        self._changed(full)
+        return len(data)
+
+    def open_atomic(self, path: str) -> "AtomicFile":
+        """
+        فایل موقتی در همان پوشه برای نوشتن برمی‌گرداند که با commit() جایگزین فایل اصلی می‌شود.
+        """
+        full = self.resolve(path)
+        directory = os.path.dirname(full)
+        os.makedirs(directory, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix=".", suffix=".tmp")
+        return AtomicFile(self, full, fd, temp_path)
+
+    @contextmanager
+    def atomic_writer(self, path: str) -> Iterator["AtomicFile"]:
+        """
+        در پایان بلوک بدون خطا فایل اصلی جایگزین می‌شود و در صورت خطا فایل موقت حذف می‌شود.
+        """
+        target = self.open_atomic(path)
+        try:
+            yield target
+            target.commit()
+        finally:
+            target.abort()
+
+    def write_atomic(self, path: str, data: Iterable[bytes]) -> int:
+        """
+        کل محتوای فایل را به صورت اتمیک جایگزین می‌کند. data یک bytes یا iterable از تکه‌های bytes است.
+        """
+        written = 0
+        with self.atomic_writer(path) as f:
+            for chunk in ([data] if isinstance(data, (bytes, bytearray)) else data):
+                written += f.write(chunk)
+        return written
+
+    def append(self, path: str, data: bytes, create: bool = True) -> int:
+        """
+        data را به انتهای فایل اضافه می‌کند و اندازه جدید فایل را برمی‌گرداند.
+        """
+        full = self.resolve(path)
+        if not create and not os.path.isfile(full):
+            raise FileNotFoundError(path)
+        os.makedirs(os.path.dirname(full), exist_ok=True)
+        with open(full, "ab") as f:
+            f.write(data)
+            size = f.tell()
+        self._changed(full)
+        return size
+
+    def patch(self, path: str, offset: int, data: bytes) -> int:
+        """
+        data را از offset به بعد روی فایل می‌نویسد (بقیه فایل دست نمی‌خورد). offset حداکثر برابر اندازه
+        فایل است (در این حالت معادل append). اندازه جدید فایل برگردانده می‌شود.
+        """
+        full = self.resolve(path)
+        with open(full, "r+b") as f:
+            size = os.fstat(f.fileno()).st_size
+            if offset < 0 or offset > size:
+                raise ValueError(f"offset خارج از محدوده فایل است (0..{size}).")
+            f.seek(offset)
+            f.write(data)
+        self._changed(full)
+        return max(size, offset + len(data))
+
+    def delete(self, path: str) -> None:
+        full = self.resolve(path)
+        os.unlink(full)
+        self._changed(full)
+
+    # --- خواندن ---
+    def _range(self, size: int, start: int, end: Optional[int]) -> Tuple[int, int]:
+        # بازه نیمه‌باز [start, end)؛ end=None یعنی تا انتهای فایل
+        end = size if end is None else min(end, size)
+        if start < 0 or start > end:
+            raise ValueError(f"بازه نامعتبر برای فایلی با اندازه {size} بایت.")
+        return start, end
+
+    def read_range(self, path: str, start: int = 0, end: Optional[int] = None) -> bytes:
+        with open(self.resolve(path), "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            start, end = self._range(size, start, end)
+            if start == end:
+                return b""
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                return mm[start:end]
+
+    def read_lines(self, path: str, start: int = 0, count: Optional[int] = None) -> bytes:
+        """
+        خطوط start تا start+count (شمارش از صفر) را بدون خواندن کل فایل در حافظه برمی‌گرداند.
+        """
+        if start < 0 or (count is not None and count < 0):
+            raise ValueError("بازه خطوط نامعتبر است.")
+        with open(self.resolve(path), "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            if size == 0 or count == 0:
+                return b""
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                begin = self._skip_lines(mm, 0, start, size)
+                end = size if count is None else self._skip_lines(mm, begin, count, size)
+                return mm[begin:end]
+
+    @staticmethod
+    def _skip_lines(mm: mmap.mmap, position: int, lines: int, size: int) -> int:
+        for _ in range(lines):
+            newline = mm.find(b"\n", position)
+            if newline == -1:
+                return size
+            position = newline + 1
+        return position
+
+    def iter_chunks(self, path: str, start: int = 0, end: Optional[int] = None) -> Iterator[bytes]:
+        """
+        بازه [start, end) فایل را در تکه‌های chunk_size بایتی برمی‌گرداند. باز کردن فایل و بررسی بازه
+        قبل از اولین next انجام می‌شود تا خطاها پیش از شروع پاسخ HTTP مشخص شوند.
+        """
+        f = open(self.resolve(path), "rb")
+        try:
+            start, end = self._range(os.fstat(f.fileno()).st_size, start, end)
+        except BaseException:
+            f.close()
+            raise
+        return self._chunks(f, start, end)
+
+    def _chunks(self, f: BinaryIO, start: int, end: int) -> Iterator[bytes]:
+        with f:
+            f.seek(start)
+            remaining = end - start
+            while remaining > 0:
+                chunk = f.read(min(self.chunk_size, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk
+
+
+class AtomicFile:
+    """
+    فایل موقت Workspace.open_atomic. commit() آن را fsync و با os.replace جایگزین فایل اصلی می‌کند؛
+    abort() (پس از commit بی‌اثر است) فایل موقت را حذف می‌کند. متدها مسدودکننده‌اند و در مسیرهای async
+    باید در thread اجرا شوند.
+    """
+
+    def __init__(self, workspace: Workspace, full_path: str, fd: int, temp_path: str):
+        self.workspace = workspace
+        self.full_path = full_path
+        self.temp_path = temp_path
+        self._file = os.fdopen(fd, "wb")
+        self.done = False
+
+    def write(self, data: bytes) -> int:
+        return self._file.write(data)
+
+    def commit(self) -> None:
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        os.replace(self.temp_path, self.full_path)
+        self.done = True
+        self.workspace._changed(self.full_path)
+
+    def abort(self) -> None:
+        if self.done:
+            return
+        self.done = True
+        self._file.close()
+        try:
+            os.unlink(self.temp_path)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,246 @@
+# workspace_index.py
+# فهرست فایل‌های workspace برای لیست و جستجوی سریع بدون پیمایش دوباره پوشه‌ها.
+# مسیر، اندازه و mtime هر فایل در SQLite نگهداری می‌شود و با هر create/edit از طریق Workspace به‌روز می‌شود
+# (پیمایش کامل فقط در rebuild، مثلاً هنگام راه‌اندازی، برای همگام‌سازی تغییراتی که خارج از gateway رخ داده‌اند).
+# محتوای فایل‌های متنی و مسیرها در یک جدول FTS5 با tokenizer سه‌حرفی (trigram) ایندکس می‌شوند، پس جستجوی
+# زیررشته در صدها هزار فایل بدون خواندن فایل‌ها انجام می‌شود. اگر SQLite از trigram پشتیبانی نکند (قبل از 3.34)،
+# جستجو با اسکن جدول محتوا انجام می‌شود. صفحه‌بندی با cursor (keyset) است و هزینه صفحه‌های بعدی ثابت می‌ماند.
+# get_workspace() نمونه مشترک Workspace برنامه (WORKSPACE_DIR) را برمی‌گرداند که به ایندکس متصل است؛ gateway و
+# ابزارهای دیگر (مثل test/file_test.py) از همان استفاده می‌کنند تا تغییراتشان در ایندکس ثبت شود.
+import os
+import sqlite3
+import threading
+from functools import lru_cache
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from function.logs import get_logger
+from function.settings import get_settings
+from function.workspace import Workspace
+
+logger = get_logger("workspace_index")
+
+# فایل‌های بزرگ‌تر یا باینری فقط با مسیر و اندازه ایندکس می‌شوند (بدون محتوا)
+DEFAULT_MAX_CONTENT_BYTES = 1024 * 1024
+# حداقل طول عبارت جستجو برای استفاده از ایندکس trigram
+MIN_QUERY_LENGTH = 3
+SEARCH_FIELDS = ("content", "path")
+BATCH_SIZE = 500
+
+
+def is_temp_file(name: str) -> bool:
+    # فایل‌های موقت Workspace.open_atomic
+    return name.startswith(".") and name.endswith(".tmp")
+
+
+class WorkspaceIndex:
+    def __init__(self, root: str, path: Optional[str] = None, max_content_bytes: int = DEFAULT_MAX_CONTENT_BYTES):
+        self.root = os.path.realpath(root)
+        self.max_content_bytes = max_content_bytes
+        if path:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path or ":memory:", check_same_thread=False, timeout=10, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS files ("
+            "id INTEGER PRIMARY KEY, path TEXT NOT NULL UNIQUE, size INTEGER NOT NULL, mtime REAL NOT NULL)"
+        )
+        try:
+            self._conn.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS contents USING fts5(path, body, tokenize='trigram')"
+            )
+            self.fts = True
+        except sqlite3.OperationalError:
+            logger.warning("FTS5 trigram در دسترس نیست؛ جستجوی محتوا با اسکن کامل انجام می‌شود")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS contents (rowid INTEGER PRIMARY KEY, path TEXT, body TEXT)")
+            self.fts = False
+
+    # --- به‌روزرسانی ---
+    def relative(self, full_path: str) -> str:
+        return os.path.relpath(full_path, self.root).replace(os.sep, "/")
+
+    def update(self, path: str) -> None:
+        """
+        وضعیت یک فایل (مسیر نسبی) را از دیسک می‌خواند و ایندکس را به‌روز می‌کند؛ فایل حذف‌شده از ایندکس خارج می‌شود.
+        """
+        full = os.path.join(self.root, path)
+        try:
+            stat = os.stat(full)
+        except FileNotFoundError:
+            self.remove(path)
+            return
+        body = self._read_text(full, stat.st_size)
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._upsert(path, stat.st_size, stat.st_mtime, body)
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def remove(self, path: str) -> None:
+        with self._lock:
+            row = self._conn.execute("SELECT id FROM files WHERE path = ?", (path,)).fetchone()
+            if row:
+                self._conn.execute("DELETE FROM contents WHERE rowid = ?", (row[0],))
+                self._conn.execute("DELETE FROM files WHERE id = ?", (row[0],))
+
+    def rebuild(self) -> Dict[str, int]:
+        """
+        پوشه workspace را پیمایش و ایندکس را همگام می‌کند؛ فقط فایل‌هایی که اندازه یا mtime آن‌ها تغییر کرده
+        دوباره خوانده می‌شوند.
+        """
+        with self._lock:
+            known = {path: (size, mtime) for path, size, mtime in self._conn.execute("SELECT path, size, mtime FROM files")}
+        seen = set()
+        changed: List[Tuple[str, int, float, Optional[str]]] = []
+        counts = {"scanned": 0, "updated": 0, "removed": 0}
+        for full, stat in self._walk(self.root):
+            path = self.relative(full)
+            seen.add(path)
+            counts["scanned"] += 1
+            if known.get(path) != (stat.st_size, stat.st_mtime):
+                changed.append((path, stat.st_size, stat.st_mtime, self._read_text(full, stat.st_size)))
+            if len(changed) >= BATCH_SIZE:
+                counts["updated"] += self._write_batch(changed)
+                changed = []
+        counts["updated"] += self._write_batch(changed)
+        for path in known.keys() - seen:
+            self.remove(path)
+            counts["removed"] += 1
+        return counts
+
+    def _walk(self, directory: str) -> Iterator[Tuple[str, os.stat_result]]:
+        stack = [directory]
+        while stack:
+            try:
+                entries = os.scandir(stack.pop())
+            except OSError:
+                continue
+            with entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif entry.is_file(follow_symlinks=False) and not is_temp_file(entry.name):
+                        yield entry.path, entry.stat()
+
+    def _write_batch(self, changed: List[Tuple[str, int, float, Optional[str]]]) -> int:
+        if not changed:
+            return 0
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                for path, size, mtime, body in changed:
+                    self._upsert(path, size, mtime, body)
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return len(changed)
+
+    def _upsert(self, path: str, size: int, mtime: float, body: Optional[str]) -> None:
+        self._conn.execute(
+            "INSERT INTO files (path, size, mtime) VALUES (?, ?, ?) "
+            "ON CONFLICT(path) DO UPDATE SET size = excluded.size, mtime = excluded.mtime",
+            (path, size, mtime),
+        )
+        file_id = self._conn.execute("SELECT id FROM files WHERE path = ?", (path,)).fetchone()[0]
+        self._conn.execute("DELETE FROM contents WHERE rowid = ?", (file_id,))
+        self._conn.execute("INSERT INTO contents (rowid, path, body) VALUES (?, ?, ?)", (file_id, path, body or ""))
+
+    def _read_text(self, full_path: str, size: int) -> Optional[str]:
+        if size > self.max_content_bytes:
+            return None
+        try:
+            with open(full_path, "rb") as f:
+                data = f.read(self.max_content_bytes)
+        except OSError:
+            return None
+        if b"\0" in data[:8192]:
+            return None  # فایل باینری
+        return data.decode("utf-8", errors="ignore")
+
+    # --- پرس‌وجو ---
+    def list(self, prefix: str = "", cursor: Optional[str] = None, limit: int = 100) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """
+        فایل‌ها به ترتیب مسیر؛ cursor آخرین مسیر صفحه قبل است. (آیتم‌ها، cursor صفحه بعد یا None)
+        """
+        conditions: List[str] = []
+        params: List[Any] = []
+        if prefix:
+            # بازه مسیرهای با این پیشوند، تا از ایندکس UNIQUE روی path استفاده شود
+            conditions.append("path >= ? AND path < ?")
+            params += [prefix, prefix + "\U0010ffff"]
+        if cursor:
+            conditions.append("path > ?")
+            params.append(cursor)
+        sql = "SELECT path, size, mtime FROM files"
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += " ORDER BY path LIMIT ?"
+        params.append(limit + 1)
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+        items = [{"path": path, "size": size, "mtime": mtime} for path, size, mtime in rows[:limit]]
+        return items, items[-1]["path"] if len(rows) > limit else None
+
+    def search(
+        self, query: str, field: str = "content", cursor: Optional[int] = None, limit: int = 50
+    ) -> Tuple[List[Dict[str, Any]], Optional[int]]:
+        """
+        جستجوی زیررشته (بدون حساسیت به حروف بزرگ/کوچک) در محتوا یا مسیر فایل‌ها.
+        cursor شناسه آخرین نتیجه صفحه قبل است. (نتایج همراه با بخشی از متن اطراف، cursor صفحه بعد یا None)
+        """
+        if field not in SEARCH_FIELDS:
+            raise ValueError(f"field باید یکی از {', '.join(SEARCH_FIELDS)} باشد.")
+        if len(query) < MIN_QUERY_LENGTH:
+            raise ValueError(f"عبارت جستجو باید حداقل {MIN_QUERY_LENGTH} کاراکتر باشد.")
+        column = "body" if field == "content" else "path"
+        if self.fts:
+            # عبارت به صورت یک phrase نقل‌قول‌شده داده می‌شود تا عملگرهای FTS5 تفسیر نشوند
+            condition = "contents MATCH ?"
+            term = f'{column} : "{query.replace(chr(34), chr(34) * 2)}"'
+        else:
+            condition = f"instr(lower(contents.{column}), lower(?)) > 0"
+            term = query
+        sql = (
+            "SELECT f.id, f.path, f.size, f.mtime, "
+            "substr(contents.body, max(instr(lower(contents.body), lower(?)) - 60, 1), 160) "
+            f"FROM contents JOIN files f ON f.id = contents.rowid WHERE {condition} AND contents.rowid > ? "
+            "ORDER BY contents.rowid LIMIT ?"
+        )
+        with self._lock:
+            rows = self._conn.execute(sql, (query, term, cursor or 0, limit + 1)).fetchall()
+        items = [
+            {"path": path, "size": size, "mtime": mtime, "snippet": snippet if field == "content" else None}
+            for _, path, size, mtime, snippet in rows[:limit]
+        ]
+        return items, rows[limit - 1][0] if len(rows) > limit else None
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            files, total_bytes = self._conn.execute("SELECT count(*), coalesce(sum(size), 0) FROM files").fetchone()
+        return {"files": files, "total_bytes": total_bytes, "trigram": self.fts}
+
+
+@lru_cache(maxsize=1)
+def get_workspace_index() -> WorkspaceIndex:
+    settings = get_settings()
+    return WorkspaceIndex(
+        settings.workspace_dir,
+        settings.workspace_index_path or None,
+        max_content_bytes=settings.workspace_index_max_content_bytes,
+    )
+
+
+@lru_cache(maxsize=1)
+def get_workspace() -> Workspace:
+    """
+    Workspace مشترک برنامه؛ هر create/edit از طریق آن ایندکس را به‌روز می‌کند.
+    """
+    workspace = Workspace(get_settings().workspace_dir)
+    workspace.listeners.append(get_workspace_index().update)
+    return workspace
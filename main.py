@@ -1,118 +1,424 @@
 # main.py
-import os
-from dotenv import load_dotenv
-from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel
-import requests
-from typing import Dict, List, Any, Literal # اضافه کردن Literal برای تعریف نوع verbosity
+import math
+import mimetypes
+import time
+import asyncio
+import functools
+from contextvars import ContextVar
+from fastapi import Depends, FastAPI, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse, PlainTextResponse, Response, FileResponse, RedirectResponse
+from pydantic import BaseModel, Field
+import httpx
+import json
+from typing import Dict, List, Any, Literal, Optional, AsyncIterator, Union, Annotated, Tuple # اضافه کردن Literal برای تعریف نوع verbosity
 
 # وارد کردن تابع create_img از فایل image.py
 # مطمئن شوید که فایل image.py در کنار main.py قرار دارد و مسیر 'function.image' صحیح باشد.
-from function.image import create_img 
+# SDK openai در این import بارگذاری نمی‌شود؛ فقط با اولین درخواست img: (function/image.py)
+from function.image import create_img, image_generator_stats, close_image_generators
+from function.image_store import EXTENSIONS, ImageStore
+from function.upstream import GeminiClient, classify_httpx_error, fallback_on_httpx_error
+from function.router import ModelRouter, load_model_config
+from function.resilience import Resilience, FairScheduler, CircuitOpenError
+from function.session_store import SessionStore, SharedSessionStore, SqliteSessionBackend
+from function.context import ContextManager
+from function.context_cache import ContextCache
+from function.translation import Translator, TranslationCache, detect_language
+from function.jobs import JobQueue, SqliteJobBackend
+from function.response_cache import ResponseCache, MemoryCacheBackend, SqliteCacheBackend, UncacheableResponse, payload_key
+from function.singleflight import SingleFlight
+from function.metrics import Registry, MetricsMiddleware
+from function.logs import setup_logging, get_logger
+from function.commands import Command, CommandRegistry, Dispatcher
+from function.payloads import PayloadTemplate, extract_text, user_contents
+from function.workspace_index import get_workspace, get_workspace_index
+from function.settings import get_settings
+from function.lifespan import Lifespan
 
 # --- 1. Load Environment Variables ---
-# بارگذاری متغیرهای محیطی از فایل .env
-load_dotenv()
+# همه تنظیمات یک بار (همراه با فایل .env) در یک شیء تایپ‌دار خوانده می‌شوند (function/settings.py)
+settings = get_settings()
+
+# لاگ ساخت‌یافته: نوشتن لاگ در thread جداگانه انجام می‌شود (LOG_FORMAT: text | json)
+log_listener = setup_logging(settings.log_level, settings.log_format)
+logger = get_logger()
 
 # --- 2. Configuration ---
 # دریافت کلید API Gemini از متغیرهای محیطی
-GEMINI_API_KEY = os.getenv("GOOGLE_API_KEY")
+GEMINI_API_KEY = settings.gemini_api_key
 # دریافت کلید API OpenAI از متغیرهای محیطی
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+OPENAI_API_KEY = settings.openai_api_key
 
-if not GEMINI_API_KEY:
-    raise ValueError("GOOGLE_API_KEY در متغیرهای محیطی یافت نشد. لطفاً آن را در فایل .env تنظیم کنید.")
-# هشدار در مورد کلید OpenAI اگر تنظیم نشده باشد
-if not OPENAI_API_KEY:
-    print("هشدار: OPENAI_API_KEY در متغیرهای محیطی یافت نشد. قابلیت تولید تصویر ممکن است کار نکند.")
+# آدرس پایه API برای Gemini (برای بنچمارک می‌توان آن را به سرور mock محلی تغییر داد)
+GEMINI_API_BASE_URL = settings.gemini_api_base_url
+# timeout و سقف اتصال‌های همزمان به Gemini
+GEMINI_TIMEOUT = settings.gemini_timeout
+GEMINI_MAX_CONNECTIONS = settings.gemini_max_connections
 
+# --- 3. Initialize FastAPI App ---
+# راه‌اندازی و خاموش شدن در hookهای lifespan انجام می‌شود (به ترتیب ثبت اجرا و به ترتیب عکس بسته می‌شوند)
+lifespan = Lifespan()
 
-# آدرس پایه API برای Gemini
-GEMINI_API_BASE_URL = "https://generativelanguage.googleapis.com/v1beta/models"
+@lifespan.on_shutdown
+def stop_log_listener():
+    # اولین hook ثبت‌شده و در نتیجه آخرین hook خاموش شدن، تا لاگ hookهای دیگر هنوز نوشته شود
+    log_listener.stop()
+
+@lifespan.on_startup
+def check_api_keys():
+    # اعتبارسنجی کلیدها هنگام راه‌اندازی سرور (نه هنگام import ماژول)
+    if not GEMINI_API_KEY:
+        raise ValueError("GOOGLE_API_KEY در متغیرهای محیطی یافت نشد. لطفاً آن را در فایل .env تنظیم کنید.")
+    # هشدار در مورد کلید OpenAI اگر تنظیم نشده باشد
+    if not OPENAI_API_KEY:
+        logger.warning("OPENAI_API_KEY در متغیرهای محیطی یافت نشد. قابلیت تولید تصویر ممکن است کار نکند.")
 
-# --- 3. Initialize FastAPI App ---
 app = FastAPI(
     title="O₂Dream AI Gateway (Requests Version)",
     description="یک دروازه API برای ارتباط با مدل‌های مختلف Gemini برای چت و تولید کد، و DALL·E 3 برای تولید تصویر.",
-    version="0.1.0"
+    version="0.1.0",
+    lifespan=lifespan,
+)
+
+# --- Metrics (/metrics) ---
+# histogram مدت درخواست برای هر endpoint، هر مدل upstream و هر مرحله پردازش (ترجمه، تولید، تصویر، تاریخچه)
+metrics = Registry("o2dream")
+HTTP_DURATION = metrics.histogram("http_request_duration_seconds", "مدت درخواست HTTP", ("endpoint", "status"))
+HTTP_IN_FLIGHT = metrics.gauge("http_requests_in_flight", "درخواست‌های HTTP در حال پردازش")
+UPSTREAM_DURATION = metrics.histogram("upstream_request_duration_seconds", "مدت هر تلاش به Gemini", ("model", "outcome"))
+UPSTREAM_IN_FLIGHT = metrics.gauge("upstream_requests_in_flight", "درخواست‌های در جریان به Gemini", ("model",))
+STAGE_DURATION = metrics.histogram("stage_duration_seconds", "مدت هر مرحله پردازش درخواست", ("stage",))
+app.add_middleware(MetricsMiddleware, duration=HTTP_DURATION, in_flight=HTTP_IN_FLIGHT)
+
+# --- 4. Model Routing ---
+# مدل‌ها دیگر در کد ثابت نیستند: هر مسیر (chat، code، code:low، translate، summary) لیستی از مدل‌های
+# کاندید در models.json دارد و هر درخواست به سالم‌ترین کاندید فرستاده می‌شود (با fallback به بعدی).
+MODEL_CONFIG_PATH = settings.model_config_path
+model_router = ModelRouter(
+    load_model_config(MODEL_CONFIG_PATH),
+    fallback_on_httpx_error,
+    max_error_rate=settings.model_max_error_rate,
+    cooldown_seconds=settings.model_cooldown_seconds,
+)
+
+# سقف درخواست‌های همزمان و timeout برای هر مدل (مدل pro کندتر و گران‌تر است)
+MODEL_CONCURRENCY_LIMITS = model_router.model_settings("concurrency")
+MODEL_TIMEOUTS = model_router.model_settings("timeout")
+
+# کلاینت upstream مشترک بین همه endpointها (pool اتصال‌ها زنده می‌ماند)
+gemini_client = GeminiClient(
+    api_key=GEMINI_API_KEY,
+    base_url=GEMINI_API_BASE_URL,
+    timeout=GEMINI_TIMEOUT,
+    max_connections=GEMINI_MAX_CONNECTIONS,
+    model_limits=MODEL_CONCURRENCY_LIMITS,
+    model_timeouts=MODEL_TIMEOUTS,
+    stage_observer=lambda stage, seconds: STAGE_DURATION.observe(seconds, stage=stage),
 )
 
-# --- 4. Model Names ---
-CHAT_MODEL_NAME = 'gemini-1.5-flash-latest'
-# نام مدل برای کدنویسی. 'gemini-1.5-pro-latest' نام عمومی و معتبر است.
-# 'gemini-2.5-pro' در حال حاضر یک نام مدل عمومی در API Gemini نیست.
-CODE_MODEL_NAME = 'gemini-1.5-pro-latest' 
+# --- Context Caching ---
+# systemInstruction ثابت (و با CONTEXT_CACHE_HISTORY_TURNS، ابتدای تاریخچه‌های طولانی) یک بار برای هر مدل در
+# cachedContents ثبت می‌شود و درخواست‌ها فقط نام cache را می‌فرستند؛ TTL با استفاده تمدید می‌شود و اگر cache در
+# Gemini منقضی شده باشد درخواست بدون cache تکرار می‌شود (function/context_cache.py).
+# پیشوندهای کوچک‌تر از CONTEXT_CACHE_MIN_BYTES (زیر حداقل توکن cache در Gemini) بدون cache ارسال می‌شوند.
+context_cache = ContextCache(
+    gemini_client,
+    ttl_seconds=settings.context_cache_ttl_seconds,
+    renew_seconds=settings.context_cache_renew_seconds,
+    min_bytes=settings.context_cache_min_bytes,
+    history_turns=settings.context_cache_history_turns,
+    max_entries=settings.context_cache_max_entries,
+) if settings.context_cache_enabled else None
+metrics.register_collector("context_cache", lambda: context_cache.stats() if context_cache else None)
+
+@lifespan.on_shutdown
+async def close_context_cache():
+    if context_cache is not None:
+        await context_cache.aclose()
+
+def generate_content(model_name: str, payload: Dict[str, Any]):
+    if context_cache is None:
+        return gemini_client.generate_content(model_name, payload)
+    return context_cache.call(model_name, payload, lambda sent: gemini_client.generate_content(model_name, sent))
+
+def stream_generate_content(model_name: str, payload: Dict[str, Any]) -> AsyncIterator[Dict[str, Any]]:
+    if context_cache is None:
+        return gemini_client.stream_generate_content(model_name, payload)
+    return context_cache.stream(model_name, payload, lambda sent: gemini_client.stream_generate_content(model_name, sent))
+
+# --- Upstream Resilience ---
+# نرخ مجاز درخواست در ثانیه برای هر مدل؛ با دریافت 429 به طور خودکار کاهش و سپس به تدریج افزایش می‌یابد
+MODEL_RATE_LIMITS = model_router.model_settings("rate")
+
+gemini_resilience = Resilience(
+    "gemini",
+    classify_httpx_error,
+    key_rate=settings.gemini_rate_per_second,
+    model_rates=MODEL_RATE_LIMITS,
+    retries=settings.upstream_retries,
+    failure_threshold=settings.circuit_failure_threshold,
+    recovery_timeout=settings.circuit_recovery_seconds,
+)
+# سقف کل درخواست‌های همزمان به Gemini با صف منصفانه بین جلسه‌ها
+upstream_scheduler = FairScheduler(settings.upstream_max_concurrency)
+
+# ادغام فراخوانی‌های همزمان یکسان به Gemini (single-flight)
+upstream_flight = SingleFlight() if settings.upstream_singleflight else None
+
+metrics.register_collector("upstream_scheduler", lambda: {"queued": upstream_scheduler.queued()})
+metrics.register_collector("upstream_singleflight", lambda: upstream_flight.metrics if upstream_flight else None)
+metrics.register_collector("upstream_gemini", gemini_resilience.stats)
+metrics.register_collector("model_router", lambda: model_router.metrics)
+
+@lifespan.on_shutdown
+async def close_upstream_clients():
+    await gemini_client.aclose()
+    await close_image_generators()
 
-# --- 5. In-memory Chat History Storage ---
-# این دیکشنری برای نگهداری تاریخچه چت برای هر session_id استفاده می‌شود.
+# --- 5. Chat History Storage ---
+# این ذخیره‌ساز برای نگهداری تاریخچه چت برای هر session_id استفاده می‌شود.
 # تاریخچه به فرمت مورد نیاز Gemini API (لیستی از دیکشنری‌های role و parts) ذخیره می‌شود.
-chat_sessions: Dict[str, List[Dict[str, Any]]] = {}
+# جلسه‌ها با LRU/TTL و سقف حافظه محدود می‌شوند؛ اگر SESSION_DB_PATH تنظیم شود،
+# جلسه‌های بیکار به جای حذف شدن در SQLite ذخیره می‌شوند.
+# برای اجرای چند worker (uvicorn --workers N) باید SESSION_BACKEND=sqlite باشد تا همه workerها
+# تاریخچه مشترک را از SQLite بخوانند و بنویسند.
+SESSION_BACKEND = settings.session_backend.lower()
+SESSION_DB_PATH = settings.session_db_path or ("cache/sessions.db" if SESSION_BACKEND == "sqlite" else None)
+SESSION_SWEEP_INTERVAL = settings.session_sweep_interval
+SESSION_TTL_SECONDS = settings.session_ttl_seconds
+SESSION_MAX_TURNS = settings.session_max_turns
+SESSION_MAX_BYTES = settings.session_max_bytes
+
+if SESSION_BACKEND == "sqlite":
+    chat_sessions = SharedSessionStore(
+        SqliteSessionBackend(SESSION_DB_PATH),
+        ttl_seconds=SESSION_TTL_SECONDS,
+        max_turns_per_session=SESSION_MAX_TURNS,
+        max_bytes_per_session=SESSION_MAX_BYTES,
+    )
+else:
+    chat_sessions = SessionStore(
+        max_sessions=settings.session_max_sessions,
+        ttl_seconds=SESSION_TTL_SECONDS,
+        max_turns_per_session=SESSION_MAX_TURNS,
+        max_bytes_per_session=SESSION_MAX_BYTES,
+        max_total_bytes=settings.session_max_total_bytes,
+        backend=SqliteSessionBackend(SESSION_DB_PATH) if SESSION_DB_PATH else None,
+    )
+
+async def sweep_expired_sessions():
+    # حذف دوره‌ای جلسه‌های منقضی‌شده تا جلسه‌های رهاشده در حافظه باقی نمانند
+    while True:
+        await asyncio.sleep(SESSION_SWEEP_INTERVAL)
+        evicted = await asyncio.to_thread(chat_sessions.evict_expired)
+        if evicted:
+            logger.info("جلسه‌های منقضی‌شده از حافظه خارج شدند", extra={"evicted": evicted})
+
+metrics.register_collector("session_store", chat_sessions.stats, blocking=chat_sessions.blocking)
+
+@lifespan.on_startup
+async def start_session_sweeper():
+    app.state.session_sweeper = asyncio.create_task(sweep_expired_sessions())
+
+@lifespan.on_shutdown
+async def stop_session_sweeper():
+    app.state.session_sweeper.cancel()
+    await asyncio.to_thread(chat_sessions.flush)
 
 # --- Pydantic Models for Request Bodies ---
 class ChatRequest(BaseModel):
     session_id: str # یک شناسه برای هر جلسه چت برای حفظ تاریخچه
     message: str    # پیام کاربر
+    # 'delta': فقط نوبت‌های جدید و نسخه تاریخچه برگردانده می‌شود؛ 'full': کل تاریخچه نیز ارسال می‌شود
+    history_mode: Literal["delta", "full"] = "delta"
+    # اگر True باشد، درخواست img: به صف کارها ارسال می‌شود و بلافاصله job_id برگردانده می‌شود
+    async_image: bool = False
 
 class CodeRequest(BaseModel):
     prompt: str     # درخواست کدنویسی از کاربر
     # اضافه کردن فیلد verbosity با مقادیر مجاز 'low', 'medium', 'high'
     verbosity: Literal["low", "medium", "high"] = "medium" 
+    # استفاده از cache پاسخ؛ None یعنی تنظیم پیش‌فرض سرور (CODE_CACHE_DEFAULT)
+    cache: Optional[bool] = None
 
 class ChatResponse(BaseModel):
     session_id: str
     response: str
-    history: List[Dict[str, Any]] # تاریخچه چت برای دیباگینگ یا نمایش در فرانت‌اند
+    # نوبت‌هایی که در این درخواست به تاریخچه اضافه شدند (برای دستورات img: و code: خالی است)
+    turns: List[Dict[str, Any]] = []
+    # cursor تاریخچه: تعداد کل نوبت‌های جلسه؛ برای دریافت ادامه تاریخچه از /sessions/{id}/history استفاده شود
+    history_version: int = 0
+    history: Optional[List[Dict[str, Any]]] = None # فقط در history_mode='full' (برای دیباگینگ یا نمایش در فرانت‌اند)
+    job_id: Optional[str] = None # شناسه کار پس‌زمینه برای درخواست‌های img: با async_image
+
+class ImageJobRequest(BaseModel):
+    prompt: str
+    size: Literal["1024x1024", "1792x1024", "1024x1792"] = "1024x1024"
+    priority: Literal["high", "normal", "low"] = "normal"
+
+class HistoryPage(BaseModel):
+    session_id: str
+    turns: List[Dict[str, Any]]
+    cursor: int            # اندیس مطلق اولین نوبت این صفحه
+    next_cursor: Optional[int] # cursor صفحه بعد یا None اگر به انتهای تاریخچه رسیده باشیم
+    history_version: int
 
 class CodeResponse(BaseModel):
     prompt: str
     code_output: str
     verbosity: str # اضافه کردن verbosity به پاسخ کدنویسی
+    cached: bool = False # آیا پاسخ از cache برگردانده شده است
+
+# آیتم‌های /batch: فیلد kind نوع هر آیتم را مشخص می‌کند
+class BatchChatItem(ChatRequest):
+    kind: Literal["chat"]
+
+class BatchCodeItem(CodeRequest):
+    kind: Literal["code"]
+
+class BatchTranslateItem(BaseModel):
+    kind: Literal["translate"]
+    text: str
+
+BatchItem = Annotated[Union[BatchChatItem, BatchCodeItem, BatchTranslateItem], Field(discriminator="kind")]
+
+class BatchRequest(BaseModel):
+    items: List[BatchItem]
 
 # --- Helper Function to Call Gemini API ---
-async def call_gemini_api(model_name: str, payload: Dict[str, Any]) -> str:
+def upstream_http_exception(e: Exception) -> HTTPException:
+    """
+    خطاهای موقتی upstream (throttle، قطعی، circuit باز) را به 429/503 همراه با Retry-After تبدیل می‌کند
+    تا کلاینت‌ها به جای تلاش فوری، صبر کنند. سایر خطاها مانند قبل 500 هستند.
+    """
+    if isinstance(e, CircuitOpenError):
+        return HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(math.ceil(e.retry_after))})
+    if isinstance(e, httpx.HTTPStatusError) and e.response.status_code in (429, 503):
+        retry_after = e.response.headers.get("Retry-After", "5")
+        return HTTPException(
+            status_code=e.response.status_code,
+            detail=f"سرویس Gemini موقتاً در دسترس نیست: {e}",
+            headers={"Retry-After": retry_after},
+        )
+    return HTTPException(status_code=500, detail=f"خطا در ارتباط با Gemini API: {e}")
+
+# متنی که وقتی Gemini پاسخ متنی ندارد (مثلاً مسدود شدن توسط SAFETY یا candidate خالی) به کاربر نمایش داده می‌شود
+NO_TEXT_RESPONSE = "پاسخ متنی از مدل دریافت نشد."
+
+async def call_gemini_api(
+    route: str, payload: Dict[str, Any], session_id: Optional[str] = None, require_text: bool = False
+) -> str:
     """
     یک درخواست POST به Gemini API ارسال می‌کند و پاسخ متنی را برمی‌گرداند.
+    route نام مسیر مدل (مثلاً 'chat' یا 'code:low') است؛ مدل نهایی توسط model_router انتخاب می‌شود.
+    session_id برای زمان‌بندی منصفانه بین کاربران در زمان شلوغی استفاده می‌شود.
+    با require_text=True (برای نتایجی که cache می‌شوند، مثل ترجمه) نبودن متن به جای NO_TEXT_RESPONSE
+    خطای 502 می‌دهد.
     """
-    url = f"{GEMINI_API_BASE_URL}/{model_name}:generateContent?key={GEMINI_API_KEY}" # استفاده از GEMINI_API_KEY
-    headers = {"Content-Type": "application/json"}
+    text, _ = await call_gemini_model(route, payload, session_id, require_text)
+    return text
 
-    try:
-        response = requests.post(url, headers=headers, json=payload)
-        response.raise_for_status() # اگر کد وضعیت HTTP خطا باشد، یک استثنا ایجاد می‌کند
+async def call_gemini_model(
+    route: str, payload: Dict[str, Any], session_id: Optional[str] = None, require_text: bool = False
+) -> Tuple[str, str]:
+    """
+    مانند call_gemini_api، اما (پاسخ متنی، نام مدلی که پاسخ را داده) را برمی‌گرداند.
+    """
+    async def request(model_name: str):
+        started = time.perf_counter()
+        outcome = "error"
+        with UPSTREAM_IN_FLIGHT.track(model=model_name):
+            try:
+                result = await generate_content(model_name, payload)
+                outcome = "ok"
+                return result
+            finally:
+                UPSTREAM_DURATION.observe(time.perf_counter() - started, model=model_name, outcome=outcome)
+
+    async def attempt(model_name: str, has_fallback: bool):
+        # اگر مدل دیگری برای fallback وجود دارد، به جای تلاش مجدد روی مدل پر یا خراب، سریع به بعدی می‌رویم
+        return await gemini_resilience.call(
+            model_name, lambda: request(model_name), retries=0 if has_fallback else None
+        )
+
+    async def fetch():
+        # محدودیت نرخ، تلاش مجدد و circuit breaker در gemini_resilience اعمال می‌شوند
+        queued = time.perf_counter()
+        async with upstream_scheduler.slot(session_id):
+            STAGE_DURATION.observe(time.perf_counter() - queued, stage="upstream_queue")
+            with STAGE_DURATION.time(stage="generate"):
+                return await model_router.serve(route, attempt)
 
-        json_response = response.json()
+    try:
+        # درخواست از طریق کلاینت async مشترک ارسال می‌شود و event loop مسدود نمی‌شود؛
+        # درخواست‌های همزمان با payload یکسان برای یک مدل فقط یک بار به Gemini ارسال می‌شوند. کلید، مدلی است
+        # که درخواست به آن فرستاده می‌شود (نه نام مسیر) و مدل پاسخ‌دهنده همراه نتیجه به همه منتظرها می‌رسد.
+        if upstream_flight is not None:
+            model_name, json_response = await upstream_flight.do(payload_key(model_router.preferred(route), payload), fetch)
+        else:
+            model_name, json_response = await fetch()
         
-        # بررسی ساختار پاسخ برای استخراج متن
-        if 'candidates' in json_response and len(json_response['candidates']) > 0 and \
-           'content' in json_response['candidates'][0] and \
-           'parts' in json_response['candidates'][0]['content'] and \
-           len(json_response['candidates'][0]['content']['parts']) > 0 and \
-           'text' in json_response['candidates'][0]['content']['parts'][0]:
-            return json_response['candidates'][0]['content']['parts'][0]['text']
+        text = extract_text(json_response)
+        if text is not None:
+            return text, model_name
         else:
             # اگر پاسخ متنی نباشد یا ساختار غیرمنتظره باشد
-            print(f"پاسخ غیرمنتظره از Gemini API: {json_response}")
-            return "پاسخ متنی از مدل دریافت نشد."
+            logger.warning("پاسخ غیرمنتظره از Gemini API", extra={"route": route, "response": json_response})
+            if require_text:
+                raise HTTPException(status_code=502, detail=NO_TEXT_RESPONSE)
+            return NO_TEXT_RESPONSE, model_name
 
-    except requests.exceptions.RequestException as e:
-        print(f"خطا در درخواست به Gemini API: {e}")
-        raise HTTPException(status_code=500, detail=f"خطا در ارتباط با Gemini API: {e}")
+    except HTTPException:
+        raise
+    except (httpx.HTTPError, CircuitOpenError) as e:
+        logger.warning("خطا در درخواست به Gemini API", extra={"route": route, "error": str(e)})
+        raise upstream_http_exception(e)
     except Exception as e:
-        print(f"خطای غیرمنتظره: {e}")
+        logger.exception("خطای غیرمنتظره در فراخوانی Gemini API", extra={"route": route})
         raise HTTPException(status_code=500, detail=f"خطای داخلی سرور: {e}")
 
+async def stream_gemini_api(route: str, payload: Dict[str, Any], session_id: Optional[str] = None) -> AsyncIterator[str]:
+    """
+    نسخه streaming از call_gemini_api؛ تکه‌های متن را به محض دریافت از Gemini برمی‌گرداند.
+    stream پس از شروع قابل تلاش مجدد نیست، پس فقط محدودیت نرخ و circuit breaker اعمال می‌شوند و
+    fallback به مدل بعدی فقط تا قبل از رسیدن اولین تکه ممکن است.
+    """
+    async with upstream_scheduler.slot(session_id):
+        candidates = model_router.select(route)
+        for index, model_name in enumerate(candidates):
+            started = time.monotonic()
+            first_chunk = True
+            try:
+                async with gemini_resilience.admit(model_name):
+                    async for chunk in stream_generate_content(model_name, payload):
+                        if first_chunk:
+                            # برای stream، تاخیر تا اولین تکه در آمار مسیریاب و histogram ثبت می‌شود
+                            first_chunk_latency = time.monotonic() - started
+                            model_router.succeeded(model_name, first_chunk_latency)
+                            STAGE_DURATION.observe(first_chunk_latency, stage="stream_first_chunk")
+                            first_chunk = False
+                        text = extract_text(chunk)
+                        if text:
+                            yield text
+                return
+            except (httpx.HTTPError, CircuitOpenError) as e:
+                logger.warning("خطا در stream از Gemini API", extra={"model": model_name, "error": str(e)})
+                if not first_chunk or not model_router.failed(model_name, e) or index == len(candidates) - 1:
+                    raise upstream_http_exception(e)
+                model_router.metrics["fallbacks"] += 1
+
 # --- Translation Functions ---
 async def translate_prompt_if_needed(prompt: str) -> str:
     """
     پرامپت را بررسی می‌کند و در صورت غیرانگلیسی بودن، آن را به انگلیسی ترجمه می‌کند.
+    تشخیص زبان بر اساس خط حروف انجام می‌شود و ترجمه‌ها cache می‌شوند (function/translation.py).
     """
-    # یک تست ساده برای اینکه ببینیم انگلیسیه یا نه (بررسی کاراکترهای ASCII)
-    if not prompt.isascii():  
-        print(f"[🌐] در حال ترجمه پرامپت: '{prompt}'")
-        translation = await translate_with_gemini(prompt) 
-        print(f"[🌐] پرامپت ترجمه شده: '{translation}'")
-        return translation
-    return prompt
+    if detect_language(prompt) == "en":
+        return prompt
+    with STAGE_DURATION.time(stage="translate"):
+        translation = await translator.translate_if_needed(prompt)
+    logger.debug("پرامپت ترجمه شد", extra={"prompt": prompt, "translation": translation})
+    return translation
 
 async def translate_with_gemini(prompt: str) -> str:
     """
@@ -121,44 +427,44 @@ async def translate_with_gemini(prompt: str) -> str:
     translation_prompt = (
         f"Translate the following text to English. Respond only with the translation, no extra explanations or greetings:\n{prompt}"
     )
-    payload = {
-        "contents": [{"role": "user", "parts": [{"text": translation_prompt}]}],
-        "generationConfig": {"responseMimeType": "text/plain"},
-    }
-    # از مدل فلش برای ترجمه استفاده می‌شود
-    return await call_gemini_api(CHAT_MODEL_NAME, payload) 
+    # پاسخ بدون متن خطا می‌دهد تا متن جایگزین به عنوان ترجمه cache نشود
+    return await call_gemini_api("translate", build_text_payload(translation_prompt), require_text=True)
+
+# cache ترجمه‌ها: LRU درون حافظه + فایل SQLite مشترک بین workerها (با TRANSLATION_CACHE_PATH="" غیرفعال می‌شود)
+translation_cache = TranslationCache(
+    max_entries=settings.translation_cache_size,
+    path=settings.translation_cache_path or None,
+    ttl_seconds=settings.translation_cache_ttl_seconds,
+)
+translator = Translator(translate_with_gemini, translation_cache)
+metrics.register_collector("translation_cache", translation_cache.stats)
 
 # --- Dynamic System Instruction for Code Model based on Verbosity ---
+CODE_BASE_INSTRUCTION = (
+    "شما یک مدل زبان هوشمند هستید که به طور خاص برای تولید کد تمیز و قابل اجرا طراحی شده‌اید. "
+    "تنها مسئولیت شما تولید کد بر اساس ورودی کاربر است. "
+    "پاسخ شما باید فقط شامل کد باشد و از توضیحات کلی یا مکالمه‌ای پرهیز شود. "
+    "اگر کاربر درخواست غیر کدنویسی داشت، پاسخ دهید که فقط درخواست‌های مرتبط با تولید کد را می‌پذیرید. "
+    "کد تولیدی شما باید با بهترین شیوه‌های برنامه‌نویسی مدرن (مانند تابع‌نویسی، متغیرهای معنادار) نوشته شده باشد. "
+    "همیشه فرض کنید کاربر از شما انتظار دارد کدی واقعی، قابل اجرا و قابل استفاده در پروژه‌های عملیاتی دریافت کند."
+)
+
+# متن کامل system instruction برای هر سطح verbosity فقط یک بار ساخته می‌شود
+CODE_SYSTEM_INSTRUCTIONS = {
+    "high": CODE_BASE_INSTRUCTION + " کد را با جزئیات کامل توضیح دهید، هم در قالب متن قبل یا بعد از کد و هم با کامنت‌های فراوان در داخل کد. "
+            "هدف شما این است که کاربر بتواند هر خط کد را به طور کامل درک کند.",
+    "medium": CODE_BASE_INSTRUCTION + " توضیحات مختصری قبل یا بعد از کد ارائه دهید و از کامنت‌های کلیدی در داخل کد استفاده کنید. "
+              "هدف شما ارائه کدی خوانا با توضیحات کافی برای درک منطق اصلی است.",
+    "low": CODE_BASE_INSTRUCTION + " هیچ توضیحات اضافی قبل یا بعد از کد ارائه ندهید و هیچ کامنتی در داخل کد قرار ندهید. "
+           "پاسخ شما باید صرفاً شامل کد خام باشد.",
+}
+
 def get_code_system_instruction(verbosity: str) -> str:
     """
     بر اساس سطح verbosity، system instruction مناسب برای مدل کدنویسی را برمی‌گرداند.
     """
-    base_instruction = (
-        "شما یک مدل زبان هوشمند هستید که به طور خاص برای تولید کد تمیز و قابل اجرا طراحی شده‌اید. "
-        "تنها مسئولیت شما تولید کد بر اساس ورودی کاربر است. "
-        "پاسخ شما باید فقط شامل کد باشد و از توضیحات کلی یا مکالمه‌ای پرهیز شود. "
-        "اگر کاربر درخواست غیر کدنویسی داشت، پاسخ دهید که فقط درخواست‌های مرتبط با تولید کد را می‌پذیرید. "
-        "کد تولیدی شما باید با بهترین شیوه‌های برنامه‌نویسی مدرن (مانند تابع‌نویسی، متغیرهای معنادار) نوشته شده باشد. "
-        "همیشه فرض کنید کاربر از شما انتظار دارد کدی واقعی، قابل اجرا و قابل استفاده در پروژه‌های عملیاتی دریافت کند."
-    )
-
-    if verbosity == "high":
-        return (
-            base_instruction + " کد را با جزئیات کامل توضیح دهید، هم در قالب متن قبل یا بعد از کد و هم با کامنت‌های فراوان در داخل کد. "
-            "هدف شما این است که کاربر بتواند هر خط کد را به طور کامل درک کند."
-        )
-    elif verbosity == "medium":
-        return (
-            base_instruction + " توضیحات مختصری قبل یا بعد از کد ارائه دهید و از کامنت‌های کلیدی در داخل کد استفاده کنید. "
-            "هدف شما ارائه کدی خوانا با توضیحات کافی برای درک منطق اصلی است."
-        )
-    elif verbosity == "low":
-        return (
-            base_instruction + " هیچ توضیحات اضافی قبل یا بعد از کد ارائه ندهید و هیچ کامنتی در داخل کد قرار ندهید. "
-            "پاسخ شما باید صرفاً شامل کد خام باشد."
-        )
-    else: # Default to medium if an invalid verbosity is provided
-        return get_code_system_instruction("medium")
+    # Default to medium if an invalid verbosity is provided
+    return CODE_SYSTEM_INSTRUCTIONS.get(verbosity, CODE_SYSTEM_INSTRUCTIONS["medium"])
 
 # --- System Instruction for Chat Model ---
 chat_system_instruction_text = (
@@ -170,125 +476,281 @@ chat_system_instruction_text = (
     "و او را به بخش مربوط به تولید تصویر (مثلاً با گفتن 'img: [توضیحات تصویر شما]') راهنمایی کنید."
 )
 
-# --- 6. Chat Endpoint (/chat/gen) ---
-@app.post("/chat/gen", response_model=ChatResponse)
-async def generate_chat_response(request: ChatRequest):
+# --- Payload Builders ---
+# بخش‌های ثابت payload (systemInstruction و generationConfig) برای هر task و verbosity یک بار ساخته
+# و encode می‌شوند؛ برای هر درخواست فقط contents ساخته می‌شود (function/payloads.py).
+# قالب‌ها در اولین استفاده ساخته می‌شوند تا encode دستورالعمل‌های طولانی به زمان import اضافه نشود.
+TEXT_GENERATION_CONFIG = {"responseMimeType": "text/plain"}
+
+@functools.lru_cache(maxsize=None)
+def chat_payload_template() -> PayloadTemplate:
+    return PayloadTemplate({
+        "systemInstruction": {"parts": [{"text": chat_system_instruction_text}]},
+    })
+
+@functools.lru_cache(maxsize=None)
+def code_payload_template(verbosity: str) -> PayloadTemplate:
+    return PayloadTemplate({
+        "generationConfig": TEXT_GENERATION_CONFIG,
+        "systemInstruction": {"parts": [{"text": get_code_system_instruction(verbosity)}]}, # استفاده از system instruction پویا
+    })
+
+# ترجمه و خلاصه‌سازی: فقط پرامپت کاربر با خروجی متنی
+@functools.lru_cache(maxsize=None)
+def text_payload_template() -> PayloadTemplate:
+    return PayloadTemplate({"generationConfig": TEXT_GENERATION_CONFIG})
+
+def build_chat_payload(history: List[Dict[str, Any]]) -> Dict[str, Any]:
+    return chat_payload_template().build(history)
+
+def build_code_payload(user_prompt: str, verbosity_level: str) -> Dict[str, Any]:
+    # قالب بر اساس سطح verbosity انتخاب می‌شود (مقدار نامعتبر: medium)
+    if verbosity_level not in CODE_SYSTEM_INSTRUCTIONS:
+        verbosity_level = "medium"
+    return code_payload_template(verbosity_level).build(user_contents(user_prompt))
+
+def build_text_payload(prompt: str) -> Dict[str, Any]:
+    return text_payload_template().build(user_contents(prompt))
+
+# --- Chat Commands ---
+# پیشوندهای پیام چت و گزینه‌های مجاز آن‌ها؛ هر پیام فقط یک بار تجزیه می‌شود (function/commands.py).
+# برای دستور جدید: ثبت در chat_commands و افزودن handler به chat_dispatcher و stream_dispatcher
+chat_commands = CommandRegistry()
+chat_commands.command("img", choices={"size": ("1024x1024", "1792x1024", "1024x1792")}, defaults={"size": "1024x1024"})
+chat_commands.command("code", choices={"verbosity": ("low", "medium", "high")}, defaults={"verbosity": "medium"})
+
+def with_warnings(command: Command, text: str) -> str:
+    # هشدار گزینه‌های نامعتبر (مثل 'verbosity: extreme') قبل از پاسخ نمایش داده می‌شود
+    return "\n".join(command.warnings + [text]) if command.warnings else text
+
+def format_code_output(verbosity_level: str, code_output: str) -> str:
+    # فرمت کردن پاسخ بر اساس verbosity_level
+    return f"**پاسخ کدنویسی (verbosity: {verbosity_level}):**\n```\n{code_output}\n```"
+
+# --- Context Window Management ---
+# تاریخچه ارسالی به Gemini به بودجه توکن محدود می‌شود؛ نوبت‌های قدیمی با مدل flash خلاصه می‌شوند.
+CONTEXT_TOKEN_BUDGET = settings.context_token_budget
+CONTEXT_SUMMARY_ENABLED = settings.context_summary_enabled
+
+async def summarize_history(previous_summary: Optional[str], turns: List[Dict[str, Any]]) -> str:
     """
-    دریافت پیام از کاربر و ارسال آن به مدل Gemini 1.5 Flash برای چت عادی.
-    اگر پیام با 'code:' یا 'img:' شروع شود، درخواست را به مدل مربوطه ارسال می‌کند.
+    نوبت‌های قدیمی گفتگو را (همراه با خلاصه قبلی) با مدل flash در یک خلاصه کوتاه ادغام می‌کند.
+    """
+    transcript = "\n".join(
+        f"{turn['role']}: {''.join(part.get('text', '') for part in turn.get('parts', []))}" for turn in turns
+    )
+    summary_prompt = (
+        "Summarize the following conversation concisely, keeping facts, names, decisions and open questions. "
+        "Write the summary in the same language as the conversation. Respond only with the summary.\n"
+    )
+    if previous_summary:
+        summary_prompt += f"Existing summary of earlier parts:\n{previous_summary}\n\n"
+    summary_prompt += f"Conversation:\n{transcript}"
+    return await call_gemini_api("summary", build_text_payload(summary_prompt))
+
+context_manager = ContextManager(
+    budget_tokens=CONTEXT_TOKEN_BUDGET,
+    keep_ratio=settings.context_keep_ratio,
+    summarizer=summarize_history if CONTEXT_SUMMARY_ENABLED else None,
+)
+
+async def chat_response(
+    request: ChatRequest,
+    response_text: str,
+    turns: Optional[List[Dict[str, Any]]] = None,
+    job_id: Optional[str] = None,
+    version: Optional[int] = None,
+) -> ChatResponse:
+    """
+    پاسخ چت را می‌سازد؛ کل تاریخچه فقط در history_mode='full' ارسال می‌شود.
+    version: نسخه جلسه اگر از قبل معلوم باشد (مثلاً مقدار برگشتی append)، تا دوباره خوانده نشود.
     """
     session_id = request.session_id
-    user_message = request.message
+    return ChatResponse(
+        session_id=session_id,
+        response=response_text,
+        turns=turns or [],
+        history_version=await chat_sessions.aversion(session_id) if version is None else version,
+        history=await chat_sessions.aget(session_id) if request.history_mode == "full" else None,
+        job_id=job_id,
+    )
 
-    # --- بررسی درخواست تولید تصویر ---
-    if user_message.lower().startswith("img:"):
-        original_image_prompt = user_message[len("img:"):].strip()
-        print(f"[🖼️] درخواست ساخت تصویر: '{original_image_prompt}' برای session_id: {session_id}")
+# --- Image Store ---
+# تصاویر تولیدشده در پس‌زمینه از لینک موقت DALL·E دانلود و در IMAGE_STORE_DIR ذخیره می‌شوند و از
+# /images/{key}.{ext} سرو می‌شوند؛ درخواست دوباره همان پرامپت (پس از ترجمه) و اندازه بدون فراخوانی DALL·E پاسخ داده می‌شود.
+# IMAGE_STORE_DIR خالی: ذخیره‌سازی غیرفعال و لینک اصلی OpenAI برگردانده می‌شود.
+# لینک‌ها مطلق هستند (UI و ربات فقط لینک http(s) با پسوند تصویر را نمایش می‌دهند): PUBLIC_BASE_URL، یا اگر
+# تنظیم نشده باشد آدرس پایه همان درخواستی که تصویر را خواسته است.
+PUBLIC_BASE_URL = settings.public_base_url.rstrip("/")
+request_base_url: ContextVar[str] = ContextVar("request_base_url", default="")
 
-        if not OPENAI_API_KEY:
-            return ChatResponse(
-                session_id=session_id,
-                response="❌ متاسفم، کلید API برای تولید تصویر (OpenAI) تنظیم نشده است. لطفاً آن را در فایل .env اضافه کنید.",
-                history=chat_sessions.get(session_id, [])
-            )
+async def remember_base_url(request: Request) -> None:
+    # dependency مسیرهایی که لینک تصویر برمی‌گردانند؛ در همان context اجرای endpoint تنظیم می‌شود
+    request_base_url.set(str(request.base_url).rstrip("/"))
 
-        try:
-            # ترجمه پرامپت در صورت نیاز قبل از ارسال به DALL-E
-            translated_image_prompt = await translate_prompt_if_needed(original_image_prompt)
-            
-            # ارسال کلید API به تابع create_img
-            image_url = await create_img(translated_image_prompt, openai_api_key=OPENAI_API_KEY) 
-            return ChatResponse(
-                session_id=session_id,
-                response=f"🔗 تصویر ساخته شده:\n{image_url}",
-                history=chat_sessions.get(session_id, [])
-            )
-        except Exception as e:
-            return ChatResponse(
-                session_id=session_id,
-                response=f"❌ خطا در تولید تصویر: {e}",
-                history=chat_sessions.get(session_id, [])
-            )
+def public_base_url() -> str:
+    return PUBLIC_BASE_URL or request_base_url.get()
+image_store = ImageStore(
+    settings.image_store_dir,
+    thumbnail_size=settings.image_thumbnail_size,
+    max_bytes=settings.image_store_max_bytes,
+) if settings.image_store_dir else None
+metrics.register_collector("image_store", lambda: image_store.stats() if image_store else None, blocking=True)
 
-    # --- بررسی درخواست کدنویسی ---
-    elif user_message.lower().startswith("code:"): # از elif استفاده شده تا فقط یکی از شرط‌ها اجرا شود
-        # استخراج پرامپت و verbosity از پیام کاربر
-        parts = user_message[len("code:"):].strip().split("verbosity:")
-        code_prompt = parts[0].strip()
-        verbosity_level = "medium" # مقدار پیش‌فرض
-        if len(parts) > 1:
-            # اطمینان از اینکه verbosity یک مقدار معتبر است
-            requested_verbosity = parts[1].strip().lower()
-            if requested_verbosity in ["low", "medium", "high"]:
-                verbosity_level = requested_verbosity
-            else:
-                # اگر مقدار نامعتبر بود، به کاربر اطلاع دهید و از پیش‌فرض استفاده کنید
-                return ChatResponse(
-                    session_id=session_id,
-                    response=f"⚠️ سطح verbosity نامعتبر است ('{requested_verbosity}'). از 'medium' استفاده می‌شود. مقادیر مجاز: low, medium, high.",
-                    history=chat_sessions.get(session_id, [])
-                )
+@lifespan.on_shutdown
+async def close_image_store():
+    if image_store is not None:
+        await image_store.aclose()
 
-        print(f"[💻] درخواست کد از چت دریافت شد: '{code_prompt}' با verbosity: {verbosity_level} برای session_id: {session_id}")
+def image_link(filename: str, base_url: Optional[str] = None) -> str:
+    return f"{public_base_url() if base_url is None else base_url}/images/{filename}"
 
+async def generate_image(prompt: str, size: str, base_url: Optional[str] = None) -> Dict[str, Any]:
+    """
+    تصویر پرامپت (ترجمه‌شده) را از ذخیره‌ساز یا با DALL·E برمی‌گرداند: {"image_url", "cached", "source_url"}.
+    base_url: آدرس پایه لینک برای اجرا خارج از درخواست HTTP (مثلاً کار پس‌زمینه)؛ پیش‌فرض public_base_url().
+    """
+    if image_store is not None:
+        filename = await image_store.alookup(prompt, size)
+        if filename is not None:
+            return {"image_url": image_link(filename, base_url), "cached": True, "source_url": None}
+    with STAGE_DURATION.time(stage="image"):
+        source_url = await create_img(prompt, size=size, openai_api_key=OPENAI_API_KEY)
+    if image_store is None:
+        return {"image_url": source_url, "cached": False, "source_url": source_url}
+    filename = image_store.save_from_url(prompt, size, source_url)
+    return {"image_url": image_link(filename, base_url), "cached": False, "source_url": source_url}
+
+# --- 6. Chat Endpoint (/chat/gen) ---
+chat_dispatcher = Dispatcher()
+
+@chat_dispatcher.on("img")
+async def chat_image_command(command: Command, request: ChatRequest) -> ChatResponse:
+    """
+    دستور 'img: ... size: 1792x1024': ساخت تصویر با DALL-E (یا ارسال به صف در حالت async_image).
+    """
+    session_id = request.session_id
+    original_image_prompt = command.text
+    size = command.options["size"]
+    logger.info("درخواست ساخت تصویر", extra={"session_id": session_id, "size": size})
+
+    if not OPENAI_API_KEY:
+        return await chat_response(request, "❌ متاسفم، کلید API برای تولید تصویر (OpenAI) تنظیم نشده است. لطفاً آن را در فایل .env اضافه کنید.")
+
+    if request.async_image:
+        # کار به صف پس‌زمینه ارسال می‌شود؛ نتیجه از /jobs/{job_id} قابل دریافت است
         try:
-            # فراخوانی generate_code_response با verbosity_level
-            code_response_obj = await generate_code_response(CodeRequest(prompt=code_prompt, verbosity=verbosity_level))
-            
-            # فرمت کردن پاسخ بر اساس verbosity_level
-            formatted_code_output = f"**پاسخ کدنویسی (verbosity: {code_response_obj.verbosity}):**\n```\n{code_response_obj.code_output}\n```"
-            
-            return ChatResponse(
-                session_id=session_id,
-                response=formatted_code_output,
-                history=chat_sessions.get(session_id, [])
-            )
-        except HTTPException as e:
-            return ChatResponse(
-                session_id=session_id,
-                response=f"متاسفم، در تولید کد مشکلی پیش آمد: {e.detail}",
-                history=chat_sessions.get(session_id, [])
-            )
-        except Exception as e:
-            return ChatResponse(
-                session_id=session_id,
-                response=f"متاسفم، خطای غیرمنتظره‌ای در پردازش درخواست کد شما رخ داد: {e}",
-                history=chat_sessions.get(session_id, [])
+            job = await job_queue.submit(
+                "image", {"prompt": original_image_prompt, "size": size, "base_url": public_base_url()}
             )
+        except OverflowError as e:
+            return await chat_response(request, f"❌ {e}")
+        return await chat_response(request, with_warnings(command, f"⏳ درخواست تصویر در صف قرار گرفت. شناسه کار: {job.id}"), job_id=job.id)
 
-    # --- منطق چت عادی (اگر هیچ یک از دستورات خاص بالا نباشد) ---
-    if session_id not in chat_sessions:
-        chat_sessions[session_id] = []
-        print(f"جلسه چت جدید برای session_id: {session_id} ایجاد شد.")
-
-    current_history = chat_sessions[session_id]
+    try:
+        # ترجمه پرامپت در صورت نیاز قبل از ارسال به DALL-E
+        translated_image_prompt = await translate_prompt_if_needed(original_image_prompt)
 
-    # اضافه کردن پیام کاربر به تاریخچه
-    current_history.append({"role": "user", "parts": [{"text": user_message}]})
+        # تصویر ذخیره‌شده همین پرامپت و اندازه، یا ساخت تصویر جدید با DALL-E
+        image = await generate_image(translated_image_prompt, size)
+        return await chat_response(request, with_warnings(command, f"🔗 تصویر ساخته شده:\n{image['image_url']}"))
+    except Exception as e:
+        return await chat_response(request, f"❌ خطا در تولید تصویر: {e}")
 
-    payload = {
-        "contents": current_history,
-        "systemInstruction": {
-            "parts": [{"text": chat_system_instruction_text}]
-        }
-    }
+@chat_dispatcher.on("code")
+async def chat_code_command(command: Command, request: ChatRequest) -> ChatResponse:
+    """
+    دستور 'code: ... verbosity: high': تولید کد از طریق /code/gen. verbosity نامعتبر با هشدار به 'medium' برمی‌گردد.
+    """
+    verbosity_level = command.options["verbosity"]
+    logger.info("درخواست کد از چت", extra={"session_id": request.session_id, "verbosity": verbosity_level})
 
     try:
-        gemini_response_text = await call_gemini_api(CHAT_MODEL_NAME, payload)
-        
-        current_history.append({"role": "model", "parts": [{"text": gemini_response_text}]})
+        # فراخوانی generate_code_response با verbosity_level
+        code_response_obj = await generate_code_response(CodeRequest(prompt=command.text, verbosity=verbosity_level))
 
-        return ChatResponse(
-            session_id=session_id,
-            response=gemini_response_text,
-            history=current_history
-        )
+        formatted_code_output = format_code_output(code_response_obj.verbosity, code_response_obj.code_output)
 
+        return await chat_response(request, with_warnings(command, formatted_code_output))
     except HTTPException as e:
-        raise e
+        return await chat_response(request, f"متاسفم، در تولید کد مشکلی پیش آمد: {e.detail}")
     except Exception as e:
-        print(f"خطا در /chat/gen برای session_id {session_id}: {e}")
-        raise HTTPException(status_code=500, detail=f"خطا در پردازش درخواست چت: {e}")
+        return await chat_response(request, f"متاسفم، خطای غیرمنتظره‌ای در پردازش درخواست کد شما رخ داد: {e}")
+
+async def chat_message(command: Command, request: ChatRequest) -> ChatResponse:
+    """
+    چت عادی (پیام بدون پیشوند دستور) با تاریخچه جلسه.
+    """
+    session_id = request.session_id
+    user_message = request.message
+
+    # قفل جلسه: نوبت‌های همزمان یک جلسه (حتی در workerهای مختلف) پشت سر هم اجرا می‌شوند
+    # تا تاریخچه خوانده‌شده و نوبت‌های اضافه‌شده در هم تداخل نکنند
+    lock_started = time.perf_counter()
+    async with chat_sessions.lock(session_id):
+        STAGE_DURATION.observe(time.perf_counter() - lock_started, stage="session_lock")
+        with STAGE_DURATION.time(stage="history"):
+            current_history = await chat_sessions.aget(session_id)
+        if not current_history:
+            logger.debug("جلسه چت جدید", extra={"session_id": session_id})
+
+        # پیام کاربر فقط پس از دریافت پاسخ موفق به تاریخچه ذخیره‌شده اضافه می‌شود
+        user_turn = {"role": "user", "parts": [{"text": user_message}]}
+
+        # فقط بخشی از تاریخچه که در بودجه توکن جا می‌شود (به همراه خلاصه نوبت‌های قدیمی) ارسال می‌شود
+        with STAGE_DURATION.time(stage="context"):
+            context = await context_manager.build(session_id, current_history + [user_turn])
+        payload = build_chat_payload(context)
+
+        try:
+            gemini_response_text = await call_gemini_api("chat", payload, session_id=session_id)
+        
+            model_turn = {"role": "model", "parts": [{"text": gemini_response_text}]}
+            with STAGE_DURATION.time(stage="history"):
+                version = await chat_sessions.aappend(session_id, user_turn, model_turn)
+
+            return await chat_response(request, gemini_response_text, [user_turn, model_turn], version=version)
+
+        except HTTPException as e:
+            raise e
+        except Exception as e:
+            logger.exception("خطا در /chat/gen", extra={"session_id": session_id})
+            raise HTTPException(status_code=500, detail=f"خطا در پردازش درخواست چت: {e}")
+
+chat_dispatcher.fallback = chat_message
+
+@app.post("/chat/gen", response_model=ChatResponse, response_model_exclude_none=True, dependencies=[Depends(remember_base_url)])
+async def generate_chat_response(request: ChatRequest):
+    """
+    دریافت پیام از کاربر و ارسال آن به مدل Gemini 1.5 Flash برای چت عادی.
+    اگر پیام با 'code:' یا 'img:' شروع شود، درخواست را به handler دستور مربوطه ارسال می‌کند.
+    """
+    return await chat_dispatcher.dispatch(chat_commands.parse(request.message), request)
+
+# --- Code Response Cache ---
+# cache اختیاری پاسخ‌های /code/gen با کلید hash کل payload. CODE_CACHE_BACKEND: memory | disk | off
+CODE_CACHE_BACKEND = settings.code_cache_backend.lower()
+CODE_CACHE_DEFAULT = settings.code_cache_default
+
+def create_code_response_cache() -> Optional[ResponseCache]:
+    max_entries = settings.code_cache_max_entries
+    if CODE_CACHE_BACKEND == "memory":
+        backend = MemoryCacheBackend(max_entries)
+    elif CODE_CACHE_BACKEND == "disk":
+        backend = SqliteCacheBackend(settings.code_cache_path, max_entries)
+    else:
+        return None
+    return ResponseCache(
+        backend,
+        ttl_seconds=settings.code_cache_ttl_seconds,
+        stale_seconds=settings.code_cache_stale_seconds,
+    )
+
+code_response_cache = create_code_response_cache()
+metrics.register_collector(
+    "code_cache", lambda: code_response_cache.stats() if code_response_cache else None, blocking=True
+)
+metrics.register_collector("images", lambda: image_generator_stats(OPENAI_API_KEY))
 
 # --- 7. Code Endpoint (/code/gen) ---
 @app.post("/code/gen", response_model=CodeResponse)
@@ -300,37 +762,584 @@ async def generate_code_response(request: CodeRequest):
     user_prompt = request.prompt
     verbosity_level = request.verbosity # دریافت سطح verbosity
 
-    # دریافت system instruction بر اساس سطح verbosity
-    dynamic_code_system_instruction = get_code_system_instruction(verbosity_level)
-
-    payload = {
-        "contents": [
-            {"role": "user", "parts": [{"text": user_prompt}]}
-        ],
-        "generationConfig": {
-            "responseMimeType": "text/plain"
-        },
-        "systemInstruction": {
-            "parts": [{"text": dynamic_code_system_instruction}] # استفاده از system instruction پویا
-        }
-    }
+    payload = build_code_payload(user_prompt, verbosity_level)
+    # برای verbosity: low مدل سریع‌تر کافی است (مسیر 'code:low' در models.json)
+    route = model_router.route("code", verbosity_level)
 
     try:
-        gemini_response_text = await call_gemini_api(CODE_MODEL_NAME, payload)
+        use_cache = CODE_CACHE_DEFAULT if request.cache is None else request.cache
+        if use_cache and code_response_cache is not None:
+            # payload کاملاً قطعی است؛ درخواست‌های یکسان از cache پاسخ داده می‌شوند. فقط پاسخ‌های مدل اصلی
+            # مسیر ذخیره می‌شوند (کلید، همان مدل پاسخ‌دهنده است)؛ پاسخ مدل fallback یا پاسخ بدون متن
+            # به کاربر برگردانده می‌شود اما cache نمی‌شود.
+            primary_model = model_router.primary(route)
+
+            async def compute() -> str:
+                text, served_by = await call_gemini_model(route, payload)
+                if served_by != primary_model or text == NO_TEXT_RESPONSE:
+                    raise UncacheableResponse(text)
+                return text
+
+            gemini_response_text, cached = await code_response_cache.get_or_compute(
+                payload_key(primary_model, payload), compute,
+            )
+        else:
+            gemini_response_text, cached = await call_gemini_api(route, payload), False
 
         return CodeResponse(
             prompt=user_prompt,
             code_output=gemini_response_text,
-            verbosity=verbosity_level # بازگرداندن سطح verbosity در پاسخ
+            verbosity=verbosity_level, # بازگرداندن سطح verbosity در پاسخ
+            cached=cached
         )
 
     except HTTPException as e:
         raise e
     except Exception as e:
-        print(f"خطا در /code/gen برای پرامپت '{user_prompt}': {e}")
+        logger.exception("خطا در /code/gen", extra={"verbosity": verbosity_level})
         raise HTTPException(status_code=500, detail=f"خطا در پردازش درخواست کد: {e}")
 
 
+# --- Session Store Stats ---
+@app.get("/sessions/stats")
+async def session_stats():
+    """
+    آمار ذخیره‌ساز جلسه‌ها (تعداد، حجم حافظه، تعداد حذف‌ها و انتقال به دیسک).
+    """
+    return await asyncio.to_thread(chat_sessions.stats)
+
+@app.get("/images/stats")
+async def image_stats():
+    """
+    آمار صف تولید تصویر (عمق صف، درخواست‌های در حال اجرا، تعداد موفق/ناموفق/ردشده).
+    """
+    # تا اولین درخواست تصویر، ImageGenerator (و SDK openai) ساخته نمی‌شود
+    return image_generator_stats(OPENAI_API_KEY) or {}
+
+@app.get("/code/cache/stats")
+async def code_cache_stats():
+    """
+    آمار cache پاسخ‌های /code/gen (نرخ hit/miss، تعداد ورودی‌ها).
+    """
+    if code_response_cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **await asyncio.to_thread(code_response_cache.stats)}
+
+@app.get("/translations/stats")
+async def translation_stats():
+    """
+    آمار cache ترجمه (hit درون حافظه، hit دیسک و miss).
+    """
+    return translation_cache.stats()
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    """
+    متریک‌ها با فرمت متنی Prometheus: histogram هر endpoint، هر مدل upstream و هر مرحله،
+    gaugeهای درخواست‌های در جریان و آمار ذخیره‌ساز جلسه، cacheها، صف کارها و تصویر.
+    """
+    return PlainTextResponse(await metrics.arender(), media_type="text/plain; version=0.0.4")
+
+@app.get("/upstream/stats")
+async def upstream_stats():
+    """
+    آمار لایه resilience برای Gemini (وضعیت circuit هر مدل، نرخ فعلی، تعداد throttle و تلاش مجدد)
+    و آمار مسیریاب مدل (p50/p95، نرخ خطا و ترتیب فعلی کاندیدهای هر مسیر).
+    """
+    return {
+        "gemini": gemini_resilience.stats(),
+        "router": model_router.stats(),
+        "queued": upstream_scheduler.queued(),
+        "max_concurrency": upstream_scheduler.max_concurrency,
+    }
+
+@app.get("/sessions/{session_id}/history", response_model=HistoryPage)
+async def get_session_history(session_id: str, cursor: int = 0, limit: int = 50):
+    """
+    تاریخچه جلسه به صورت صفحه‌بندی‌شده؛ cursor اندیس مطلق نوبت است (مثلاً history_version قبلی).
+    """
+    limit = max(1, min(limit, 500))
+    turns, start, version = await chat_sessions.aget_page(session_id, max(cursor, 0), limit)
+    next_cursor = start + len(turns)
+    return HistoryPage(
+        session_id=session_id,
+        turns=turns,
+        cursor=start,
+        next_cursor=next_cursor if next_cursor < version else None,
+        history_version=version,
+    )
+
+# --- 9. Background Jobs (/jobs) ---
+# تولید تصویر (ترجمه + DALL·E) به صورت کار پس‌زمینه اجرا می‌شود تا اتصال HTTP باز نماند.
+async def run_image_job(payload: Dict[str, Any]) -> Dict[str, Any]:
+    if not OPENAI_API_KEY:
+        raise ValueError("کلید API برای تولید تصویر (OpenAI) تنظیم نشده است.")
+    translated_image_prompt = await translate_prompt_if_needed(payload["prompt"])
+    image = await generate_image(translated_image_prompt, payload.get("size", "1024x1024"), payload.get("base_url"))
+    return {"prompt": translated_image_prompt, **image}
+
+JOBS_DB_PATH = settings.jobs_db_path
+job_queue = JobQueue(
+    handlers={"image": run_image_job},
+    workers=settings.job_workers,
+    max_pending=settings.job_max_pending,
+    retention_seconds=settings.job_retention_seconds,
+    lease_seconds=settings.job_lease_seconds,
+    backend=SqliteJobBackend(JOBS_DB_PATH) if JOBS_DB_PATH else None,
+)
+metrics.register_collector("jobs", job_queue.stats)
+
+@lifespan.on_startup
+async def start_job_queue():
+    await job_queue.start()
+
+@lifespan.on_shutdown
+async def stop_job_queue():
+    await job_queue.stop()
+
+@app.post("/jobs/image", dependencies=[Depends(remember_base_url)])
+async def submit_image_job(request: ImageJobRequest):
+    """
+    ثبت یک کار تولید تصویر؛ بلافاصله job_id برگردانده می‌شود.
+    """
+    try:
+        job = await job_queue.submit(
+            "image", {"prompt": request.prompt, "size": request.size, "base_url": public_base_url()}, request.priority
+        )
+    except OverflowError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    return job.to_dict()
+
+@app.get("/jobs/stats")
+async def job_stats():
+    return job_queue.stats()
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = await job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="کار یافت نشد.")
+    return job.to_dict()
+
+@app.get("/jobs/{job_id}/wait")
+async def wait_job(job_id: str, timeout: float = Query(30.0, ge=0, le=120)):
+    """
+    long-poll: تا پایان کار یا گذشتن timeout ثانیه صبر می‌کند.
+    """
+    job = await job_queue.wait(job_id, timeout)
+    if job is None:
+        raise HTTPException(status_code=404, detail="کار یافت نشد.")
+    return job.to_dict()
+
+@app.get("/jobs/{job_id}/events")
+async def job_events(job_id: str, timeout: float = Query(300.0, ge=0, le=900)):
+    """
+    SSE: وضعیت فعلی کار و سپس وضعیت نهایی آن را ارسال می‌کند.
+    """
+    job = await job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="کار یافت نشد.")
+
+    async def events():
+        yield sse_event(job.to_dict(), event="status")
+        if not job.done:
+            final = await job_queue.wait(job_id, timeout)
+            yield sse_event(final.to_dict(), event="done" if final.done else "timeout")
+        else:
+            yield sse_event(job.to_dict(), event="done")
+
+    return sse_response(events())
+
+# --- 8. Streaming Endpoints (/chat/stream, /code/stream) ---
+# این endpointها پاسخ را به صورت Server-Sent Events ارسال می‌کنند تا کاربر اولین توکن‌ها را
+# بدون انتظار برای کامل شدن پاسخ Gemini دریافت کند.
+# رویدادها: "data: {"text": ...}" برای هر تکه، و در پایان "event: done" با پاسخ کامل یا "event: error".
+def sse_event(data: Dict[str, Any], event: Optional[str] = None) -> str:
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+def sse_response(events: AsyncIterator[str]) -> StreamingResponse:
+    return StreamingResponse(
+        events,
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+async def stream_text_events(route: str, payload: Dict[str, Any], collected: List[str], prefix: str = "", suffix: str = "", session_id: Optional[str] = None) -> AsyncIterator[str]:
+    """
+    تکه‌های متن را به صورت رویداد SSE تولید می‌کند و متن خام مدل را در لیست collected جمع می‌کند.
+    """
+    if prefix:
+        yield sse_event({"text": prefix})
+    async for text in stream_gemini_api(route, payload, session_id=session_id):
+        collected.append(text)
+        yield sse_event({"text": text})
+    if suffix:
+        yield sse_event({"text": suffix})
+
+stream_dispatcher = Dispatcher()
+
+@stream_dispatcher.on("img")
+async def stream_image_command(command: Command, request: ChatRequest) -> AsyncIterator[str]:
+    # تولید تصویر قابل stream شدن نیست؛ نتیجه handler دستور img در /chat/gen به صورت یک رویداد ارسال می‌شود
+    result = await chat_image_command(command, request)
+    yield sse_event({"text": result.response})
+    yield sse_event({"session_id": request.session_id, "response": result.response}, event="done")
+
+@stream_dispatcher.on("code")
+async def stream_code_command(command: Command, request: ChatRequest) -> AsyncIterator[str]:
+    session_id = request.session_id
+    verbosity_level = command.options["verbosity"]
+    logger.info("درخواست کد (stream) از چت", extra={"session_id": session_id, "verbosity": verbosity_level})
+    # هشدارها قبل از کد ارسال می‌شوند تا بلوک کد در پیام کاربر دست‌نخورده بماند
+    prefix = with_warnings(command, f"**پاسخ کدنویسی (verbosity: {verbosity_level}):**\n```\n")
+    collected: List[str] = []
+    async for event in stream_text_events(model_router.route("code", verbosity_level), build_code_payload(command.text, verbosity_level), collected, prefix, "\n```", session_id=session_id):
+        yield event
+    full_text = with_warnings(command, format_code_output(verbosity_level, "".join(collected)))
+    yield sse_event({"session_id": session_id, "response": full_text}, event="done")
+
+async def stream_chat_message(command: Command, request: ChatRequest) -> AsyncIterator[str]:
+    # چت عادی: تاریخچه موقت شامل پیام جدید ساخته می‌شود و فقط پس از موفقیت ذخیره می‌شود
+    session_id = request.session_id
+    async with chat_sessions.lock(session_id):
+        history = await chat_sessions.aget(session_id)
+        user_turn = {"role": "user", "parts": [{"text": request.message}]}
+        collected: List[str] = []
+        context = await context_manager.build(session_id, history + [user_turn])
+        async for event in stream_text_events("chat", build_chat_payload(context), collected, session_id=session_id):
+            yield event
+        full_text = "".join(collected)
+        version = await chat_sessions.aappend(session_id, user_turn, {"role": "model", "parts": [{"text": full_text}]})
+    yield sse_event({"session_id": session_id, "response": full_text, "history_version": version}, event="done")
+
+stream_dispatcher.fallback = stream_chat_message
+
+@app.post("/chat/stream", dependencies=[Depends(remember_base_url)])
+async def stream_chat_response(request: ChatRequest):
+    """
+    نسخه streaming از /chat/gen. تاریخچه جلسه فقط پس از کامل شدن stream ثبت می‌شود.
+    """
+    session_id = request.session_id
+    command = chat_commands.parse(request.message)
+
+    async def events():
+        try:
+            async for event in stream_dispatcher.handler(command.name)(command, request):
+                yield event
+        except HTTPException as e:
+            yield sse_event({"detail": e.detail}, event="error")
+        except Exception as e:
+            logger.exception("خطا در /chat/stream", extra={"session_id": session_id})
+            yield sse_event({"detail": f"خطا در پردازش درخواست چت: {e}"}, event="error")
+
+    return sse_response(events())
+
+@app.post("/code/stream")
+async def stream_code_response(request: CodeRequest):
+    """
+    نسخه streaming از /code/gen.
+    """
+    async def events():
+        try:
+            collected: List[str] = []
+            async for event in stream_text_events(model_router.route("code", request.verbosity), build_code_payload(request.prompt, request.verbosity), collected):
+                yield event
+            full_text = "".join(collected)
+            yield sse_event(
+                {"prompt": request.prompt, "code_output": full_text, "verbosity": request.verbosity},
+                event="done",
+            )
+        except HTTPException as e:
+            yield sse_event({"detail": e.detail}, event="error")
+        except Exception as e:
+            logger.exception("خطا در /code/stream", extra={"verbosity": request.verbosity})
+            yield sse_event({"detail": f"خطا در پردازش درخواست کد: {e}"}, event="error")
+
+    return sse_response(events())
+
+
+# --- 10. Batch Endpoint (/batch) ---
+# ابزارهای داخلی به جای صدها درخواست HTTP جداگانه، یک درخواست با چند آیتم chat/code/translate می‌فرستند.
+# آیتم‌ها با سقف همزمانی BATCH_CONCURRENCY اجرا می‌شوند و خطای هر آیتم فقط در نتیجه همان آیتم ثبت می‌شود.
+BATCH_MAX_ITEMS = settings.batch_max_items
+BATCH_CONCURRENCY = settings.batch_concurrency
+
+async def run_batch_item(index: int, item, semaphore: asyncio.Semaphore) -> Dict[str, Any]:
+    """
+    یک آیتم batch را اجرا می‌کند و نتیجه یا خطای آن را (همراه با اندیس آیتم) برمی‌گرداند.
+    """
+    async with semaphore:
+        try:
+            if item.kind == "chat":
+                result = (await generate_chat_response(item)).model_dump(exclude_none=True)
+            elif item.kind == "code":
+                result = (await generate_code_response(item)).model_dump()
+            else:
+                result = {"text": item.text, "translation": await translator.translate_if_needed(item.text)}
+            return {"index": index, "ok": True, "result": result}
+        except HTTPException as e:
+            return {"index": index, "ok": False, "status": e.status_code, "error": e.detail}
+        except Exception as e:
+            logger.exception("خطا در آیتم batch", extra={"index": index})
+            return {"index": index, "ok": False, "status": 500, "error": str(e)}
+
+@app.post("/batch", dependencies=[Depends(remember_base_url)])
+async def run_batch(request: BatchRequest, stream: bool = False):
+    """
+    اجرای همزمان چند درخواست chat/code/translate.
+    به طور پیش‌فرض نتایج به ترتیب آیتم‌ها در {"results": [...]} برگردانده می‌شوند؛ با stream=true هر نتیجه
+    به محض آماده شدن به صورت یک خط NDJSON (با فیلد index) ارسال می‌شود.
+    """
+    if len(request.items) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"حداکثر {BATCH_MAX_ITEMS} آیتم در هر batch مجاز است.")
+    semaphore = asyncio.Semaphore(BATCH_CONCURRENCY)
+
+    if not stream:
+        results = await asyncio.gather(*(run_batch_item(i, item, semaphore) for i, item in enumerate(request.items)))
+        return {"results": results}
+
+    async def lines():
+        tasks = [asyncio.create_task(run_batch_item(i, item, semaphore)) for i, item in enumerate(request.items)]
+        try:
+            for finished in asyncio.as_completed(tasks):
+                yield json.dumps(await finished, ensure_ascii=False) + "\n"
+        finally:
+            # اگر کلاینت اتصال را قطع کند، آیتم‌های باقی‌مانده لغو می‌شوند
+            for task in tasks:
+                task.cancel()
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+
+# --- 11. Workspace Files (/workspace/files) ---
+# فایل‌های workspace (کد و خروجی‌های تولیدشده، لاگ‌ها) بدون بارگذاری کامل در حافظه خوانده و نوشته می‌شوند:
+# GET با هدر Range یا ?line_start=&line_count=، PUT جایگزینی اتمیک (بدنه به صورت stream روی دیسک نوشته می‌شود)،
+# POST افزودن به انتهای فایل و PATCH?offset= نوشتن از یک offset مشخص (function/workspace.py).
+WORKSPACE_MAX_UPLOAD_BYTES = settings.workspace_max_upload_bytes
+
+# ایندکس فایل‌ها (مسیر، اندازه، mtime و محتوای متنی با trigram) که با هر تغییر از طریق workspace به‌روز می‌شود؛
+# همین workspace مشترک در ابزارهای دیگر (test/file_test.py) هم استفاده می‌شود
+workspace = get_workspace()
+workspace_index = get_workspace_index()
+metrics.register_collector("workspace_index", workspace_index.stats, blocking=True)
+
+async def rebuild_workspace_index() -> Dict[str, int]:
+    started = time.perf_counter()
+    counts = await asyncio.to_thread(workspace_index.rebuild)
+    logger.info("ایندکس workspace همگام شد", extra={**counts, "seconds": round(time.perf_counter() - started, 3)})
+    return counts
+
+@lifespan.on_startup
+async def start_workspace_index():
+    # تغییراتی که خارج از gateway رخ داده‌اند (یا هنگام خاموش بودن آن) در پس‌زمینه همگام می‌شوند
+    app.state.workspace_index_sync = asyncio.create_task(rebuild_workspace_index())
+
+def workspace_http_exception(e: Exception) -> HTTPException:
+    if isinstance(e, FileNotFoundError):
+        return HTTPException(status_code=404, detail="فایل پیدا نشد.")
+    if isinstance(e, FileExistsError):
+        return HTTPException(status_code=409, detail="فایل از قبل وجود دارد.")
+    if isinstance(e, (ValueError, IsADirectoryError, NotADirectoryError)):
+        return HTTPException(status_code=400, detail=str(e))
+    logger.exception("خطا در I/O فایل workspace")
+    return HTTPException(status_code=500, detail=f"خطا در دسترسی به فایل: {e}")
+
+def parse_byte_range(header: str, size: int):
+    """
+    هدر 'Range: bytes=start-end' (فقط یک بازه) را به بازه نیمه‌باز [start, end) تبدیل می‌کند.
+    """
+    unit, _, spec = header.partition("=")
+    first, _, last = spec.strip().partition("-")
+    try:
+        if unit.strip() != "bytes" or "," in spec:
+            raise ValueError(header)
+        if not first:
+            # bytes=-500: پانصد بایت آخر
+            start, end = max(size - int(last), 0), size
+        else:
+            start, end = int(first), min(int(last) + 1, size) if last else size
+    except ValueError:
+        raise HTTPException(status_code=416, detail="هدر Range نامعتبر است.", headers={"Content-Range": f"bytes */{size}"})
+    if start >= size or start >= end:
+        raise HTTPException(status_code=416, detail="بازه درخواستی خارج از فایل است.", headers={"Content-Range": f"bytes */{size}"})
+    return start, end
+
+async def limited_body(request: Request) -> AsyncIterator[bytes]:
+    # بدنه درخواست تکه‌تکه خوانده می‌شود و با عبور از سقف WORKSPACE_MAX_UPLOAD_BYTES قطع می‌شود
+    received = 0
+    async for chunk in request.stream():
+        received += len(chunk)
+        if received > WORKSPACE_MAX_UPLOAD_BYTES:
+            raise HTTPException(status_code=413, detail=f"حداکثر حجم مجاز {WORKSPACE_MAX_UPLOAD_BYTES} بایت است.")
+        if chunk:
+            yield chunk
+
+async def read_limited_body(request: Request) -> bytes:
+    return b"".join([chunk async for chunk in limited_body(request)])
+
+@app.get("/workspace/files/{path:path}")
+async def read_workspace_file(
+    path: str,
+    request: Request,
+    line_start: Optional[int] = Query(None, ge=0),
+    line_count: Optional[int] = Query(None, ge=0),
+):
+    """
+    محتوای فایل به صورت stream (تکه‌های 64KB). از هدر Range (پاسخ 206) و بازه خطوط پشتیبانی می‌کند.
+    """
+    media_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+    try:
+        if line_start is not None or line_count is not None:
+            data = await asyncio.to_thread(workspace.read_lines, path, line_start or 0, line_count)
+            return Response(data, media_type="text/plain; charset=utf-8")
+
+        size = workspace.size(path)
+        range_header = request.headers.get("range")
+        if range_header:
+            start, end = parse_byte_range(range_header, size)
+            return StreamingResponse(
+                workspace.iter_chunks(path, start, end),
+                status_code=206,
+                media_type=media_type,
+                headers={
+                    "Content-Range": f"bytes {start}-{end - 1}/{size}",
+                    "Content-Length": str(end - start),
+                    "Accept-Ranges": "bytes",
+                },
+            )
+        return StreamingResponse(
+            workspace.iter_chunks(path),
+            media_type=media_type,
+            headers={"Content-Length": str(size), "Accept-Ranges": "bytes"},
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise workspace_http_exception(e)
+
+@app.put("/workspace/files/{path:path}")
+async def write_workspace_file(path: str, request: Request):
+    """
+    جایگزینی کامل فایل به صورت اتمیک؛ خواننده‌ها تا پایان آپلود نسخه قبلی را می‌بینند.
+    """
+    try:
+        target = workspace.open_atomic(path)
+        try:
+            written = 0
+            async for chunk in limited_body(request):
+                written += await asyncio.to_thread(target.write, chunk)
+            # fsync، rename و به‌روزرسانی ایندکس در thread انجام می‌شوند
+            await asyncio.to_thread(target.commit)
+        finally:
+            target.abort()
+        return {"path": path, "size": written}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise workspace_http_exception(e)
+
+@app.post("/workspace/files/{path:path}")
+async def append_workspace_file(path: str, request: Request):
+    """
+    بدنه درخواست به انتهای فایل اضافه می‌شود (فایل در صورت نبود ساخته می‌شود).
+    """
+    data = await read_limited_body(request)
+    try:
+        size = await asyncio.to_thread(workspace.append, path, data)
+        return {"path": path, "size": size}
+    except Exception as e:
+        raise workspace_http_exception(e)
+
+@app.patch("/workspace/files/{path:path}")
+async def patch_workspace_file(path: str, request: Request, offset: int = Query(..., ge=0)):
+    """
+    بدنه درخواست از offset به بعد روی فایل نوشته می‌شود؛ بقیه فایل دست نمی‌خورد.
+    """
+    data = await read_limited_body(request)
+    try:
+        size = await asyncio.to_thread(workspace.patch, path, offset, data)
+        return {"path": path, "size": size}
+    except Exception as e:
+        raise workspace_http_exception(e)
+
+@app.get("/workspace/list")
+async def list_workspace_files(
+    prefix: str = "",
+    cursor: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=1000),
+):
+    """
+    فهرست فایل‌ها به ترتیب مسیر (از ایندکس، بدون پیمایش پوشه‌ها). next_cursor را برای صفحه بعد ارسال کنید.
+    """
+    items, next_cursor = await asyncio.to_thread(workspace_index.list, prefix, cursor, limit)
+    return {"items": items, "next_cursor": next_cursor}
+
+@app.get("/workspace/search")
+async def search_workspace_files(
+    q: str = Query(..., min_length=3),
+    field: Literal["content", "path"] = "content",
+    cursor: Optional[int] = None,
+    limit: int = Query(50, ge=1, le=500),
+):
+    """
+    جستجوی زیررشته در محتوا (field=content) یا مسیر (field=path) فایل‌ها با ایندکس trigram.
+    """
+    try:
+        items, next_cursor = await asyncio.to_thread(workspace_index.search, q, field, cursor, limit)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"items": items, "next_cursor": next_cursor}
+
+@app.post("/workspace/reindex")
+async def reindex_workspace():
+    """
+    همگام‌سازی کامل ایندکس با دیسک (فقط فایل‌های تغییرکرده دوباره خوانده می‌شوند).
+    """
+    return await rebuild_workspace_index()
+
+# --- 12. Stored Images (/images/{key}.{ext}) ---
+# بعد از /images/stats تعریف می‌شود تا مسیر stats به عنوان کلید تصویر تفسیر نشود.
+IMAGE_WAIT_TIMEOUT = 30.0
+IMAGE_EXTENSIONS = set(EXTENSIONS.values())
+
+@app.get("/images/{filename}")
+async def get_stored_image(request: Request, filename: str, thumbnail: bool = False):
+    """
+    تصویر ذخیره‌شده (یا thumbnail آن). نام فایل کلید تصویر با یا بدون پسوند است (پسوند فقط برای تشخیص
+    تصویر در کلاینت‌هاست و Content-Type از نوع واقعی فایل تعیین می‌شود).
+    ETag همان hash محتواست، پس پاسخ برای همیشه قابل cache است؛
+    If-None-Match پاسخ 304 و هدر Range پاسخ 206 می‌گیرد. فایل بدون خواندن در حافظه ارسال می‌شود
+    (در سرورهای پشتیبان http.response.pathsend به صورت zero-copy).
+    """
+    if image_store is None:
+        raise HTTPException(status_code=404, detail="ذخیره‌سازی تصاویر غیرفعال است.")
+    key, _, extension = filename.partition(".")
+    if extension and extension not in IMAGE_EXTENSIONS:
+        raise HTTPException(status_code=404, detail="تصویر پیدا نشد.")
+    # تصویری که هنوز در حال دانلود است: صبر تا پایان دانلود
+    record = await image_store.wait(key, IMAGE_WAIT_TIMEOUT)
+    if record is None:
+        source_url = image_store.source_url(key)
+        if source_url:
+            # دانلود ناموفق بوده است؛ تا وقتی لینک اصلی معتبر است به آن ارجاع داده می‌شود
+            return RedirectResponse(source_url, status_code=307)
+        if image_store.pending(key):
+            raise HTTPException(status_code=503, detail="تصویر هنوز در حال دانلود است.", headers={"Retry-After": "5"})
+        raise HTTPException(status_code=404, detail="تصویر پیدا نشد.")
+
+    thumbnail = thumbnail and record["thumbnail"]
+    etag = f'"{record["digest"]}{"-thumb" if thumbnail else ""}"'
+    headers = {"ETag": etag, "Cache-Control": "public, max-age=31536000, immutable"}
+    if etag in [tag.strip() for tag in request.headers.get("if-none-match", "").split(",")]:
+        return Response(status_code=304, headers=headers)
+    return FileResponse(
+        image_store.path(record, thumbnail=thumbnail),
+        media_type="image/png" if thumbnail else record["content_type"],
+        headers=headers,
+    )
+
+
 # --- اجرای برنامه FastAPI ---
 # برای اجرای این برنامه، در ترمینال خود (در پوشه حاوی main.py و .env) دستور زیر را اجرا کنید:
 # uvicorn main:app --reload --host 0.0.0.0 --port 8000
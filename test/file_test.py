@@ -1,35 +1,41 @@
+import codecs
 import os
+from typing import Optional
 
-BASE_DIR = "workspace"  # همه فایل‌ها اینجا ذخیره می‌شن
+from function.workspace_index import get_workspace
+
+# همه فایل‌ها در workspace برنامه (WORKSPACE_DIR) ذخیره می‌شن؛ همان نمونه gateway تا تغییرات در ایندکس ثبت شوند
+workspace = get_workspace()
+BASE_DIR = workspace.root
+
+def file_name(name: str, format: str) -> str:
+    return f"{name}.{format}"
 
 def safe_path(name, format):
     """
-    تولید مسیر امن برای فایل.
+    تولید مسیر امن برای فایل (مسیرهای خارج از workspace مثل '../x' رد می‌شوند).
     """
-    os.makedirs(BASE_DIR, exist_ok=True)
-    return os.path.join(BASE_DIR, f"{name}.{format}")
+    return workspace.resolve(file_name(name, format))
 
 def create_file(name: str, format: str) -> bool:
     """
     ایجاد فایل در پوشه workspace. اگر وجود داشته باشه، کاری نمی‌کنه.
     """
     path = safe_path(name, format)
-    if os.path.exists(path):
-        print(f"⚠️ فایل '{path}' از قبل وجود دارد.")
-        return False
-
     try:
-        with open(path, "w", encoding="utf-8") as f:
-            f.write("")
+        workspace.create(file_name(name, format))
         print(f"📄 فایل '{path}' ساخته شد.")
         return True
+    except FileExistsError:
+        print(f"⚠️ فایل '{path}' از قبل وجود دارد.")
+        return False
     except Exception as e:
         print(f"❌ خطا در ساخت فایل: {e}")
         return False
 
 def edit_file(name: str, format: str, content: str) -> bool:
     """
-    جایگزینی محتوای فایل با مقدار داده شده.
+    جایگزینی محتوای فایل با مقدار داده شده (به صورت اتمیک: فایل موقت و سپس rename).
     """
     path = safe_path(name, format)
     if not os.path.exists(path):
@@ -37,25 +43,47 @@ def edit_file(name: str, format: str, content: str) -> bool:
         return False
 
     try:
-        with open(path, "w", encoding="utf-8") as f:
-            f.write(content)
+        workspace.write_atomic(file_name(name, format), content.encode("utf-8"))
         print(f"✅ محتوای فایل '{path}' ویرایش شد.")
         return True
     except Exception as e:
         print(f"❌ خطا در ویرایش فایل: {e}")
         return False
 
-def show_file(name: str, format: str) -> str:
+def append_file(name: str, format: str, content: str) -> bool:
+    """
+    افزودن محتوا به انتهای فایل بدون بازنویسی بقیه آن.
+    """
+    path = safe_path(name, format)
+    if not os.path.exists(path):
+        print(f"❌ فایل '{path}' برای ویرایش وجود ندارد.")
+        return False
+
+    try:
+        workspace.append(file_name(name, format), content.encode("utf-8"), create=False)
+        print(f"✅ محتوا به فایل '{path}' اضافه شد.")
+        return True
+    except Exception as e:
+        print(f"❌ خطا در ویرایش فایل: {e}")
+        return False
+
+def show_file(name: str, format: str, max_bytes: Optional[int] = None) -> str:
     """
     نمایش محتوای فایل. اگر فایل وجود نداشته باشد، پیام خطا بازمی‌گرداند.
+    با max_bytes فقط این تعداد بایت اول فایل نمایش داده می‌شود (پیش‌فرض: کل فایل).
     """
     path = safe_path(name, format)
     if not os.path.exists(path):
         return f"❌ فایل '{path}' پیدا نشد."
 
     try:
-        with open(path, "r", encoding="utf-8") as f:
-            content = f.read()
+        size = workspace.size(file_name(name, format))
+        end = size if max_bytes is None else min(size, max_bytes)
+        # کاراکتر چندبایتی که در مرز max_bytes بریده شده نمایش داده نمی‌شود؛ بقیه متن باید UTF-8 معتبر باشد
+        data = workspace.read_range(file_name(name, format), 0, end)
+        content = codecs.getincrementaldecoder("utf-8")().decode(data, final=end == size)
+        if end < size:
+            content += f"\n... ({size - end} بایت دیگر نمایش داده نشد)"
         return f"📂 محتویات فایل '{path}':\n{'-'*40}\n{content}\n{'-'*40}"
     except Exception as e:
-        return f"❌ خطا در خواندن فایل: {e}"
\ No newline at end of file
+        return f"❌ خطا در خواندن فایل: {e}"
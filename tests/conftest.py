@@ -0,0 +1,39 @@
+import importlib
+import sys
+
+import pytest
+
+from function.settings import get_settings
+from function.workspace_index import get_workspace, get_workspace_index
+
+# مسیر فایل‌هایی که main.py هنگام import می‌سازد؛ در تست‌ها به یک پوشه موقت منتقل می‌شوند
+APP_PATHS = {
+    "TRANSLATION_CACHE_PATH": "translations.db",
+    "CODE_CACHE_PATH": "code_responses.db",
+    "IMAGE_STORE_DIR": "images",
+    "JOBS_DB_PATH": "jobs.db",
+    "WORKSPACE_DIR": "workspace",
+    "WORKSPACE_INDEX_PATH": "workspace_index.db",
+}
+
+
+def clear_caches():
+    for cached in (get_settings, get_workspace, get_workspace_index):
+        cached.cache_clear()
+
+
+@pytest.fixture(scope="session")
+def app_module(tmp_path_factory):
+    """
+    main.py یک بار با مسیرهای موقت import می‌شود (lifespan اجرا نمی‌شود، پس کلید API لازم نیست).
+    """
+    root = tmp_path_factory.mktemp("app")
+    with pytest.MonkeyPatch.context() as patch:
+        for name, path in APP_PATHS.items():
+            patch.setenv(name, str(root / path))
+        patch.setenv("PUBLIC_BASE_URL", "http://gateway")
+        clear_caches()
+        sys.modules.pop("main", None)
+        module = importlib.import_module("main")
+    clear_caches()
+    return module
@@ -0,0 +1,78 @@
+import asyncio
+import json
+
+import httpx
+import pytest
+from fastapi import HTTPException
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+ITEMS = [
+    {"kind": "chat", "session_id": "s1", "message": "slow"},
+    {"kind": "code", "prompt": "broken"},
+    {"kind": "translate", "text": "سلام"},
+    {"kind": "chat", "session_id": "s2", "message": "fast"},
+]
+
+
+class FakeTranslator:
+    async def translate_if_needed(self, text):
+        return "hello"
+
+
+@pytest.fixture
+def gateway(app_module, monkeypatch):
+    async def chat(request):
+        # آیتم کند دیرتر از بقیه تمام می‌شود تا ترتیب خروجی NDJSON با ترتیب آیتم‌ها فرق کند
+        await asyncio.sleep(0.05 if request.message == "slow" else 0)
+        return app_module.ChatResponse(session_id=request.session_id, response=f"re: {request.message}")
+
+    async def code(request):
+        raise HTTPException(status_code=503, detail="upstream down")
+
+    monkeypatch.setattr(app_module, "generate_chat_response", chat)
+    monkeypatch.setattr(app_module, "generate_code_response", code)
+    monkeypatch.setattr(app_module, "translator", FakeTranslator())
+    return app_module
+
+
+def post(app_module, **params):
+    async def request():
+        transport = httpx.ASGITransport(app=app_module.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://gateway") as http:
+            return await http.post("/batch", json={"items": ITEMS}, params=params)
+
+    return run(request())
+
+
+def test_failing_item_does_not_fail_the_batch(gateway):
+    response = post(gateway)
+    assert response.status_code == 200
+    results = response.json()["results"]
+    assert [result["index"] for result in results] == [0, 1, 2, 3]
+    assert [result["ok"] for result in results] == [True, False, True, True]
+    assert results[1]["status"] == 503 and results[1]["error"] == "upstream down"
+    assert results[0]["result"]["response"] == "re: slow"
+    assert results[2]["result"] == {"text": "سلام", "translation": "hello"}
+
+
+def test_streamed_batch_returns_one_line_per_item(gateway):
+    response = post(gateway, stream="true")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert len(lines) == len(ITEMS)
+    assert sorted(line["index"] for line in lines) == [0, 1, 2, 3]
+    # نتایج به ترتیب پایان ارسال می‌شوند؛ آیتم کند آخر می‌آید
+    assert lines[-1]["index"] == 0
+    by_index = {line["index"]: line for line in lines}
+    assert by_index[1]["ok"] is False and by_index[1]["status"] == 503
+    assert by_index[3]["result"]["response"] == "re: fast"
+
+
+def test_batch_size_is_limited(gateway, monkeypatch):
+    monkeypatch.setattr(gateway, "BATCH_MAX_ITEMS", 2)
+    assert post(gateway).status_code == 413
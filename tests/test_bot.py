@@ -0,0 +1,107 @@
+import asyncio
+
+import pytest
+
+from bot import MESSAGE_LIMIT, StreamedReply, split_message
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def fence_lines(chunk):
+    return [line.strip() for line in chunk.split("\n") if line.strip().startswith("```")]
+
+
+def assert_valid(chunks, limit):
+    for chunk in chunks:
+        assert 0 < len(chunk) <= limit
+        # هر پیام به تنهایی درست نمایش داده می‌شود: بلوک کد بازی در انتهای آن نمی‌ماند
+        assert len(fence_lines(chunk)) % 2 == 0, chunk
+
+
+def code_answer(lines=200):
+    body = "\n".join(f"    value_{i} = compute({i})  # step {i}" for i in range(lines))
+    return f"توضیح کوتاه:\n\n```python\ndef main():\n{body}\n```\n\nپایان پاسخ."
+
+
+def test_short_message_is_not_split():
+    assert split_message("سلام") == ["سلام"]
+    assert split_message("x" * MESSAGE_LIMIT) == ["x" * MESSAGE_LIMIT]
+
+
+@pytest.mark.parametrize("limit", [200, 500, MESSAGE_LIMIT])
+def test_code_block_is_closed_and_reopened_with_language(limit):
+    chunks = split_message(code_answer(), limit)
+    assert len(chunks) > 1
+    assert_valid(chunks, limit)
+    # بلوکی که وسط کد بسته شده، در پیام بعد با همان زبان باز می‌شود
+    assert any(chunk.startswith("```python\n") for chunk in chunks[1:])
+    for chunk in chunks:
+        code = chunk.find("compute(")
+        if code >= 0:
+            assert "```python\n" in chunk[:code]
+    assert chunks[-1].endswith("پایان پاسخ.")
+    # هیچ خط کدی گم یا تکرار نمی‌شود
+    joined = "\n".join(chunks)
+    for i in (0, 100, 199):
+        assert joined.count(f"compute({i})") == 1
+
+
+def test_text_without_newlines_is_hard_split():
+    text = "ا" * 5000
+    chunks = split_message(text, 1000)
+    assert_valid(chunks, 1000)
+    assert "".join(chunks) == text
+
+
+def test_single_long_line_inside_fence_is_hard_split():
+    text = "```python\n" + "x" * 500 + "\n```"
+    chunks = split_message(text, 100)
+    assert_valid(chunks, 100)
+    assert all(chunk.startswith("```python\n") for chunk in chunks)
+    assert sum(chunk.count("x") for chunk in chunks) == 500
+
+
+def test_earlier_chunks_do_not_change_as_text_grows():
+    text = code_answer()
+    final = split_message(text, 300)
+    for end in range(300, len(text), 97):
+        partial = split_message(text[:end], 300)
+        assert partial[:-1] == final[:len(partial) - 1]
+
+
+class FakeMessage:
+    def __init__(self, content):
+        self.content = content
+        self.edits = 0
+
+    async def edit(self, content):
+        self.content = content
+        self.edits += 1
+
+
+class FakeChannel:
+    def __init__(self):
+        self.sent = []
+
+    async def send(self, content):
+        message = FakeMessage(content)
+        self.sent.append(message)
+        return message
+
+
+def test_streamed_reply_edits_only_the_changed_message():
+    channel = FakeChannel()
+    reply = StreamedReply(channel)
+    text = code_answer(300)
+
+    async def scenario():
+        await reply.update(text[:1000])
+        await reply.update(text[:3000])
+        await reply.update(text)
+
+    run(scenario())
+    assert [message.content for message in channel.sent] == split_message(text)
+    # پیام‌های کامل‌شده فقط تا رسیدن به شکل نهایی ویرایش می‌شوند
+    assert sum(message.edits for message in channel.sent) <= 3
@@ -0,0 +1,92 @@
+import asyncio
+
+import pytest
+
+from function.commands import CHAT_COMMAND, MAX_PREFIX_LENGTH, Command, CommandRegistry, Dispatcher
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+@pytest.fixture
+def registry():
+    registry = CommandRegistry()
+    registry.command("img", choices={"size": ("1024x1024", "1792x1024", "1024x1792")}, defaults={"size": "1024x1024"})
+    registry.command("code", choices={"verbosity": ("low", "medium", "high")}, defaults={"verbosity": "medium"})
+    return registry
+
+
+def test_prefix_is_case_insensitive_and_stripped(registry):
+    command = registry.parse("  IMG: یک گربه روی ماه")
+    assert command.name == "img"
+    assert command.text == "یک گربه روی ماه"
+    assert command.options == {"size": "1024x1024"}
+    assert command.warnings == []
+
+
+def test_options_are_extracted_from_anywhere_in_the_message(registry):
+    command = registry.parse("code: verbosity: HIGH write a parser for csv")
+    assert command.options == {"verbosity": "high"}
+    assert command.text == "write a parser for csv"
+
+    command = registry.parse("img: a red car size:1792x1024 at night")
+    assert command.options == {"size": "1792x1024"}
+    assert command.text == "a red car at night"
+
+
+def test_invalid_option_falls_back_to_default_with_warning(registry):
+    command = registry.parse("code: verbosity: extreme sort a list")
+    assert command.options == {"verbosity": "medium"}
+    assert command.text == "sort a list"
+    assert len(command.warnings) == 1
+    assert "extreme" in command.warnings[0] and "medium" in command.warnings[0]
+
+
+def test_option_name_must_be_a_separate_word(registry):
+    command = registry.parse("code: xverbosity: high")
+    assert command.options == {"verbosity": "medium"}
+    assert command.text == "xverbosity: high"
+
+
+@pytest.mark.parametrize("message", [
+    "hello there",
+    "unknown: do something",
+    "time is 10:30",
+    ": empty prefix",
+    "x" * MAX_PREFIX_LENGTH + "code: too far",
+])
+def test_unknown_or_missing_prefix_is_chat(registry, message):
+    command = registry.parse(message)
+    assert command.name == CHAT_COMMAND
+    assert command.text == message
+    assert command.options == {} and command.warnings == []
+
+
+def test_dispatcher_routes_by_name_and_falls_back(registry):
+    calls = []
+
+    async def fallback(command, extra):
+        calls.append(("fallback", command.name, extra))
+        return "chat"
+
+    dispatcher = Dispatcher(fallback)
+
+    @dispatcher.on("img")
+    async def image(command, extra):
+        calls.append(("img", command.text, extra))
+        return "image"
+
+    assert run(dispatcher.dispatch(registry.parse("img: a tree"), 1)) == "image"
+    # code ثبت شده ولی handler ندارد؛ به fallback می‌رود
+    assert run(dispatcher.dispatch(registry.parse("code: x"), 2)) == "chat"
+    assert run(dispatcher.dispatch(registry.parse("hi"), 3)) == "chat"
+    assert calls == [("img", "a tree", 1), ("fallback", "code", 2), ("fallback", CHAT_COMMAND, 3)]
+
+
+def test_dispatcher_without_fallback_raises_lookup_error():
+    dispatcher = Dispatcher()
+    with pytest.raises(LookupError):
+        dispatcher.handler("chat")
+    with pytest.raises(LookupError):
+        run(dispatcher.dispatch(Command("code", "x", {}, [])))
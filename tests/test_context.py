@@ -0,0 +1,120 @@
+import asyncio
+
+from function.context import SUMMARY_PREFIX, ContextManager, estimate_turn_tokens
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def turn(role, text):
+    return {"role": role, "parts": [{"text": text}]}
+
+
+def conversation(count):
+    # هر نوبت ۱۴ توکن تخمینی است؛ تاریخچه همیشه با پیام کاربر تمام می‌شود
+    return [turn("user" if i % 2 == 0 else "model", f"{i:02d}" + "x" * 34) for i in range(count)]
+
+
+def texts(turns):
+    return [t["parts"][0]["text"] for t in turns]
+
+
+class Summarizer:
+    def __init__(self, fail_times=0):
+        self.fail_times = fail_times
+        self.calls = []
+
+    async def __call__(self, previous, turns):
+        self.calls.append((previous, texts(turns)))
+        if len(self.calls) <= self.fail_times:
+            raise RuntimeError("summarizer down")
+        return f"summary of {len(turns)} turns"
+
+
+async def settle(manager):
+    await asyncio.gather(*list(manager._pending.values()))
+
+
+def test_budget_trimming_keeps_last_turn_and_starts_with_user():
+    history = conversation(7)
+    assert estimate_turn_tokens(history[0]) == 14
+    manager = ContextManager(budget_tokens=60, keep_ratio=0.5)
+    sent = run(manager.build("s", history))
+    # دو نوبت آخر در ۳۰ توکن جا می‌شوند، ولی بخش نگه‌داشته‌شده باید با نوبت کاربر شروع شود
+    assert sent == history[6:]
+    assert manager.metrics["trimmed_requests"] == 1
+
+    huge = history[:6] + [turn("user", "y" * 1000)]
+    assert run(ContextManager(budget_tokens=60).build("s", huge)) == huge[6:]
+
+
+def test_history_within_budget_is_sent_unchanged():
+    history = conversation(3)
+    assert run(ContextManager(budget_tokens=1000, summarizer=Summarizer()).build("s", history)) == history
+
+
+def test_successful_fold_prepends_summary_turns():
+    history = conversation(9)
+    summarizer = Summarizer()
+    manager = ContextManager(budget_tokens=100, keep_ratio=0.5, summarizer=summarizer)
+
+    async def scenario():
+        first = await manager.build("s", history)
+        await settle(manager)
+        return first, await manager.build("s", history)
+
+    first, second = run(scenario())
+    # تا آماده شدن خلاصه، فقط نوبت‌های اخیر ارسال می‌شوند
+    assert first == history[6:]
+    assert summarizer.calls == [(None, texts(history[:6]))]
+    assert texts(second[:1]) == [SUMMARY_PREFIX + "summary of 6 turns"]
+    assert second[0]["role"] == "user" and second[1]["role"] == "model"
+    assert second[2:] == history[6:]
+    assert manager.metrics["summaries_created"] == 1
+
+
+def test_summary_is_reanchored_when_leading_turns_are_dropped():
+    history = conversation(9)
+    manager = ContextManager(budget_tokens=100, keep_ratio=0.5, summarizer=Summarizer())
+
+    async def scenario():
+        await manager.build("s", history)
+        await settle(manager)
+        # ذخیره‌ساز جلسه دو نوبت اول را حذف کرده است
+        return await manager.build("s", history[2:])
+
+    sent = run(scenario())
+    assert sent[2:] == history[6:]
+    assert manager._summaries["s"].covered == 4
+
+    # اگر آخرین نوبت خلاصه‌شده دیگر در تاریخچه نباشد، خلاصه کنار گذاشته می‌شود
+    assert run(manager.build("s", history[6:])) == history[6:]
+    assert "s" not in manager._summaries
+
+
+def test_summarizer_failure_does_not_lose_turns():
+    history = conversation(9)
+    summarizer = Summarizer(fail_times=1)
+    manager = ContextManager(budget_tokens=100, keep_ratio=0.5, summarizer=summarizer, retry_seconds=60)
+
+    async def scenario():
+        await manager.build("s", history)
+        await settle(manager)
+        assert "s" not in manager._summaries
+        # در دوره backoff خلاصه‌ساز دوباره صدا زده نمی‌شود
+        await manager.build("s", history)
+        await settle(manager)
+        assert len(summarizer.calls) == 1
+        manager._failures["s"] = (1, 0.0)
+        await manager.build("s", history)
+        await settle(manager)
+        return await manager.build("s", history)
+
+    sent = run(scenario())
+    assert manager.metrics["summary_failures"] == 1
+    # تلاش دوم همان نوبت‌هایی را خلاصه می‌کند که بار اول خلاصه نشدند
+    assert summarizer.calls[1] == (None, texts(history[:6]))
+    assert texts(sent[:1]) == [SUMMARY_PREFIX + "summary of 6 turns"]
+    assert sent[2:] == history[6:]
+    assert "s" not in manager._failures
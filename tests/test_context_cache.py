@@ -0,0 +1,151 @@
+import asyncio
+
+import httpx
+import pytest
+
+from function.context_cache import ContextCache, is_cache_error
+
+MODEL = "gemini-1.5-flash-latest"
+INSTRUCTION = "You are a careful assistant. " * 300
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def status_error(status: int, message: str) -> httpx.HTTPStatusError:
+    request = httpx.Request("POST", "https://example.test/v1beta/models/x:generateContent")
+    response = httpx.Response(status, json={"error": {"code": status, "message": message}}, request=request)
+    return httpx.HTTPStatusError(message, request=request, response=response)
+
+
+def chat_payload(text: str = "hi", instruction: str = INSTRUCTION):
+    return {
+        "systemInstruction": {"parts": [{"text": instruction}]},
+        "generationConfig": {"temperature": 0},
+        "contents": [{"role": "user", "parts": [{"text": text}]}],
+    }
+
+
+class FakeClient:
+    def __init__(self):
+        self.created = []
+        self.renewed = []
+
+    async def create_cached_content(self, body):
+        self.created.append(body)
+        return {"name": f"cachedContents/c{len(self.created)}"}
+
+    async def update_cached_content_ttl(self, name, ttl_seconds):
+        self.renewed.append(name)
+        return {"name": name}
+
+
+class Sender:
+    """
+    send(payload) ساختگی: خطاهای errors را به ترتیب برای payloadهای cache‌شده برمی‌گرداند.
+    """
+
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.sent = []
+
+    async def __call__(self, payload):
+        self.sent.append(dict(payload))
+        if "cachedContent" in payload and self.errors:
+            raise self.errors.pop(0)
+        return {"ok": True}
+
+
+def test_prefix_is_cached_once_and_reused():
+    client = FakeClient()
+    cache = ContextCache(client)
+    send = Sender()
+    run(cache.call(MODEL, chat_payload("a"), send))
+    run(cache.call(MODEL, chat_payload("b"), send))
+
+    assert len(client.created) == 1
+    assert client.created[0]["systemInstruction"] == chat_payload()["systemInstruction"]
+    for sent in send.sent:
+        assert sent["cachedContent"] == "cachedContents/c1"
+        assert "systemInstruction" not in sent
+        assert sent["generationConfig"] == {"temperature": 0}
+    assert [sent["contents"][0]["parts"][0]["text"] for sent in send.sent] == ["a", "b"]
+    assert cache.metrics["created"] == 1 and cache.metrics["hits"] == 1
+
+
+def test_missing_cache_falls_back_and_is_rebuilt():
+    client = FakeClient()
+    cache = ContextCache(client)
+    send = Sender(status_error(404, "CachedContent not found (or permission denied)"))
+
+    assert run(cache.call(MODEL, chat_payload(), send)) == {"ok": True}
+    assert len(send.sent) == 2
+    assert "cachedContent" in send.sent[0] and "systemInstruction" in send.sent[1]
+    assert cache.metrics["fallbacks"] == 1
+
+    run(cache.call(MODEL, chat_payload(), send))
+    assert len(client.created) == 2
+
+
+def test_genuine_bad_request_is_not_sent_twice():
+    client = FakeClient()
+    cache = ContextCache(client)
+    send = Sender(status_error(400, "Invalid JSON payload received. Unknown name \"foo\""))
+
+    with pytest.raises(httpx.HTTPStatusError):
+        run(cache.call(MODEL, chat_payload(), send))
+    assert len(send.sent) == 1
+    assert cache.metrics["fallbacks"] == 0
+    # cache همچنان معتبر است و دوباره ساخته نمی‌شود
+    run(cache.call(MODEL, chat_payload(), send))
+    assert len(client.created) == 1
+
+
+def test_stream_falls_back_only_for_cache_errors():
+    async def collect(cache, send):
+        async def open_stream(payload):
+            await send(payload)
+            yield "chunk"
+        return [chunk async for chunk in cache.stream(MODEL, chat_payload(), open_stream)]
+
+    send = Sender(status_error(403, "Permission denied on resource cachedContents/c1 (or it may not exist)"))
+    assert run(collect(ContextCache(FakeClient()), send)) == ["chunk"]
+    assert len(send.sent) == 2
+
+    send = Sender(status_error(400, "User location is not supported for the API use."))
+    with pytest.raises(httpx.HTTPStatusError):
+        run(collect(ContextCache(FakeClient()), send))
+    assert len(send.sent) == 1
+
+
+def test_small_prefix_is_not_cached():
+    client = FakeClient()
+    cache = ContextCache(client, min_bytes=4096)
+    send = Sender()
+    run(cache.call(MODEL, chat_payload(instruction="short"), send))
+    assert client.created == []
+    assert "systemInstruction" in send.sent[0]
+    assert cache.metrics["skipped"] == 1
+
+
+def test_entry_near_expiry_is_renewed_in_background():
+    client = FakeClient()
+    cache = ContextCache(client, ttl_seconds=60, renew_seconds=120)
+
+    async def scenario():
+        send = Sender()
+        await cache.call(MODEL, chat_payload(), send)
+        await cache.call(MODEL, chat_payload(), send)
+        await asyncio.gather(*cache._renewals)
+
+    run(scenario())
+    assert client.renewed == ["cachedContents/c1"]
+    assert cache.metrics["renewed"] == 1
+
+
+def test_is_cache_error():
+    assert is_cache_error(status_error(404, "CachedContent not found"))
+    assert not is_cache_error(status_error(404, "models/foo is not found for API version v1beta"))
+    assert not is_cache_error(status_error(500, "cachedContent backend error"))
+    assert not is_cache_error(ValueError("cachedContent"))
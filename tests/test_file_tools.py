@@ -0,0 +1,58 @@
+import importlib.util
+import os
+
+import pytest
+
+from function.settings import get_settings
+from function.workspace_index import get_workspace, get_workspace_index
+
+
+# نام پوشه test با بسته test کتابخانه استاندارد یکی است، پس ماژول از مسیر فایل بارگذاری می‌شود
+FILE_TEST_PATH = os.path.join(os.path.dirname(__file__), os.pardir, "test", "file_test.py")
+
+
+def clear_caches():
+    for cached in (get_settings, get_workspace, get_workspace_index):
+        cached.cache_clear()
+
+
+@pytest.fixture
+def file_tools(tmp_path, monkeypatch):
+    monkeypatch.setenv("WORKSPACE_DIR", str(tmp_path / "workspace"))
+    monkeypatch.setenv("WORKSPACE_INDEX_PATH", str(tmp_path / "workspace_index.db"))
+    clear_caches()
+    spec = importlib.util.spec_from_file_location("file_test", FILE_TEST_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    yield module
+    clear_caches()
+
+
+def test_edits_reach_the_shared_workspace_index(file_tools):
+    assert file_tools.workspace is get_workspace()
+    assert file_tools.create_file("notes", "txt")
+    assert file_tools.edit_file("notes", "txt", "trigram search works")
+    assert file_tools.append_file("notes", "txt", "\nappended line")
+
+    items, _ = get_workspace_index().search("appended")
+    assert [item["path"] for item in items] == ["notes.txt"]
+
+
+def test_show_file_reads_the_whole_file_by_default(file_tools):
+    content = "سلام دنیا\n" * 10_000  # بیشتر از ۶۴ کیلوبایت
+    file_tools.create_file("big", "txt")
+    file_tools.edit_file("big", "txt", content)
+
+    shown = file_tools.show_file("big", "txt")
+    assert content in shown
+    assert "نمایش داده نشد" not in shown
+
+
+def test_show_file_limit_does_not_split_characters(file_tools):
+    file_tools.create_file("fa", "txt")
+    file_tools.edit_file("fa", "txt", "سلام")  # هر حرف دو بایت
+
+    shown = file_tools.show_file("fa", "txt", max_bytes=3)
+    assert "\nس\n" in shown
+    assert "(5 بایت دیگر نمایش داده نشد)" in shown
+    assert "�" not in shown
@@ -0,0 +1,141 @@
+import asyncio
+
+import httpx
+import pytest
+
+from function.image_store import ImageStore, image_filename, image_key
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_lookup_returns_filename_with_stored_extension(tmp_path):
+    store = ImageStore(str(tmp_path / "images"))
+    assert store.lookup("a fox", "1024x1024") is None
+
+    store.put("a fox", "1024x1024", b"\xff\xd8jpeg-bytes", content_type="image/jpeg")
+    key = image_key("a fox", "1024x1024")
+    assert store.lookup("a fox", "1024x1024") == f"{key}.jpg"
+    assert store.metrics["hits"] == 1 and store.metrics["misses"] == 1
+
+
+def test_image_filename_defaults_to_png():
+    assert image_filename("k") == "k.png"
+    assert image_filename("k", "image/webp") == "k.webp"
+    assert image_filename("k", "application/octet-stream") == "k.png"
+
+
+# --- مسیر /images و generate_image در main.py ---
+PNG = b"\x89PNG\r\n\x1a\n" + b"pixels" * 100
+SOURCE_URL = "https://dalle.example/temporary.png"
+
+
+def serve_source(status=200):
+    # پاسخ لینک موقت DALL·E برای دانلود پس‌زمینه ذخیره‌ساز
+    def handler(request):
+        return httpx.Response(status, content=PNG, headers={"content-type": "image/png"})
+
+    return httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+
+@pytest.fixture
+def gateway(app_module, tmp_path, monkeypatch):
+    store = ImageStore(str(tmp_path / "images"))
+    calls = []
+
+    async def create_img(prompt, size, openai_api_key=None):
+        calls.append((prompt, size))
+        return SOURCE_URL
+
+    monkeypatch.setattr(app_module, "image_store", store)
+    monkeypatch.setattr(app_module, "create_img", create_img)
+    return app_module, store, calls
+
+
+def client(app_module):
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=app_module.app), base_url="http://gateway")
+
+
+def test_repeated_prompt_is_served_from_store(gateway):
+    app_module, store, calls = gateway
+    store._client = serve_source()
+
+    async def scenario():
+        first = await app_module.generate_image("a fox", "1024x1024")
+        await store.wait(image_key("a fox", "1024x1024"))
+        second = await app_module.generate_image("a fox", "1024x1024")
+        await store.aclose()
+        return first, second
+
+    first, second = run(scenario())
+    key = image_key("a fox", "1024x1024")
+    assert first == {"image_url": f"http://gateway/images/{key}.png", "cached": False, "source_url": SOURCE_URL}
+    assert second == {"image_url": f"http://gateway/images/{key}.png", "cached": True, "source_url": None}
+    assert calls == [("a fox", "1024x1024")]
+
+
+def test_etag_and_range_requests(gateway):
+    app_module, store, _ = gateway
+    record = store.put("a fox", "1024x1024", PNG)
+
+    async def scenario():
+        async with client(app_module) as http:
+            full = await http.get(f"/images/{record['key']}.png")
+            cached = await http.get(f"/images/{record['key']}", headers={"If-None-Match": full.headers["etag"]})
+            ranged = await http.get(f"/images/{record['key']}.png", headers={"Range": "bytes=0-7"})
+            return full, cached, ranged
+
+    full, cached, ranged = run(scenario())
+    assert full.status_code == 200 and full.content == PNG
+    assert full.headers["etag"] == f'"{record["digest"]}"'
+    assert full.headers["content-type"] == "image/png"
+    assert cached.status_code == 304 and cached.content == b""
+    assert ranged.status_code == 206 and ranged.content == PNG[:8]
+
+
+def test_thumbnail_has_its_own_etag(gateway, monkeypatch):
+    app_module, store, _ = gateway
+
+    def fake_thumbnail(record, data):
+        # بدون وابستگی به Pillow: یک فایل thumbnail ساختگی در مسیر واقعی آن
+        store._write_atomic(store.path({**record, "thumbnail": True}, thumbnail=True), b"thumb")
+        return True
+
+    monkeypatch.setattr(store, "_make_thumbnail", fake_thumbnail)
+    record = store.put("a fox", "1024x1024", PNG)
+
+    async def scenario():
+        async with client(app_module) as http:
+            thumb = await http.get(f"/images/{record['key']}.png", params={"thumbnail": "true"})
+            stale = await http.get(
+                f"/images/{record['key']}.png", params={"thumbnail": "true"},
+                headers={"If-None-Match": f'"{record["digest"]}"'},
+            )
+            return thumb, stale
+
+    thumb, stale = run(scenario())
+    assert thumb.status_code == 200 and thumb.content == b"thumb"
+    assert thumb.headers["etag"] == f'"{record["digest"]}-thumb"'
+    # ETag نسخه اصلی برای thumbnail معتبر نیست
+    assert stale.status_code == 200
+
+
+def test_failed_download_redirects_to_source_url(gateway):
+    app_module, store, _ = gateway
+    store._client = serve_source(status=500)
+
+    async def scenario():
+        generated = await app_module.generate_image("a fox", "1024x1024")
+        key = image_key("a fox", "1024x1024")
+        async with client(app_module) as http:
+            response = await http.get(f"/images/{key}.png")
+            missing = await http.get(f"/images/{image_key('other', '1024x1024')}.png")
+        await store.aclose()
+        return generated, response, missing
+
+    generated, response, missing = run(scenario())
+    assert generated["cached"] is False
+    assert response.status_code == 307 and response.headers["location"] == SOURCE_URL
+    assert store.metrics["download_failures"] == 1
+    assert missing.status_code == 404
@@ -0,0 +1,108 @@
+import asyncio
+import time
+
+from function.jobs import Job, JobQueue, SqliteJobBackend
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_worker_does_not_steal_leased_jobs(tmp_path):
+    path = str(tmp_path / "jobs.db")
+    started = []
+
+    async def slow(payload):
+        started.append(payload["n"])
+        await asyncio.sleep(10)
+        return {}
+
+    async def scenario():
+        first = JobQueue({"image": slow}, workers=1, backend=SqliteJobBackend(path))
+        await first.start()
+        job = await first.submit("image", {"n": 1})
+        await asyncio.sleep(0.05)
+
+        # worker دوم روی همان پایگاه‌داده نباید کار در حال اجرای worker اول را دوباره اجرا کند
+        second = JobQueue({"image": slow}, workers=1, backend=SqliteJobBackend(path))
+        await second.start()
+        await asyncio.sleep(0.05)
+        recovered = second.metrics["recovered"]
+        await second.stop()
+        await first.stop()
+        return job, recovered
+
+    job, recovered = run(scenario())
+    assert recovered == 0
+    assert started == [1]
+
+    # پس از توقف worker اول lease آزاد شده و کار بازیابی می‌شود
+    async def restart():
+        queue = JobQueue({"image": slow}, workers=0, backend=SqliteJobBackend(path))
+        await queue.start()
+        await queue.stop()
+        return queue.metrics["recovered"]
+
+    assert run(restart()) == 1
+
+
+def test_expired_lease_is_claimed_once(tmp_path):
+    backend = SqliteJobBackend(str(tmp_path / "jobs.db"))
+
+    job = Job("image", {"n": 1})
+    assert backend.save(job, "dead-worker", time.time() - 1)
+    claimed = backend.claim_expired("a", time.time() + 60)
+    assert [j.id for j in claimed] == [job.id]
+    assert backend.claim_expired("b", time.time() + 60) == []
+    # مالک قبلی دیگر نمی‌تواند وضعیت کار را بازنویسی کند
+    job.status = "failed"
+    assert not backend.save(job, "dead-worker", time.time() + 60)
+    assert backend.load(job.id).status == "queued"
+
+
+def test_wait_polls_jobs_owned_by_another_worker(tmp_path):
+    path = str(tmp_path / "jobs.db")
+
+    async def quick(payload):
+        await asyncio.sleep(0.2)
+        return {"ok": True}
+
+    async def scenario():
+        owner = JobQueue({"image": quick}, workers=1, backend=SqliteJobBackend(path))
+        observer = JobQueue({"image": quick}, workers=0, backend=SqliteJobBackend(path), poll_interval=0.05)
+        await owner.start()
+        await observer.start()
+        job = await owner.submit("image", {})
+        final = await observer.wait(job.id, timeout=5)
+        await owner.stop()
+        await observer.stop()
+        return final
+
+    final = run(scenario())
+    assert final.status == "succeeded"
+    assert final.result == {"ok": True}
+
+
+def test_finished_jobs_are_purged_while_running(tmp_path):
+    backend = SqliteJobBackend(str(tmp_path / "jobs.db"))
+
+    async def quick(payload):
+        return {"ok": True}
+
+    async def scenario():
+        queue = JobQueue(
+            {"image": quick}, workers=1, backend=backend, retention_seconds=0.05, lease_seconds=0.06, purge_interval=0
+        )
+        await queue.start()
+        job = await queue.submit("image", {})
+        await queue.wait(job.id, timeout=5)
+        assert backend.load(job.id).status == "succeeded"
+        # بدون راه‌اندازی دوباره، حلقه تمدید lease کار تمام‌شده را پس از retention حذف می‌کند
+        await asyncio.sleep(0.2)
+        await queue.stop()
+        return job, queue
+
+    job, queue = run(scenario())
+    assert backend.load(job.id) is None
+    assert queue.metrics["purged"] == 1
+    assert job.id not in queue._jobs
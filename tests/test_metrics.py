@@ -0,0 +1,36 @@
+import asyncio
+import threading
+
+from function.metrics import Registry
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_blocking_collectors_run_off_the_event_loop():
+    registry = Registry("gw")
+    threads = {}
+
+    def collector(name):
+        def collect():
+            threads[name] = threading.current_thread()
+            return {"count": 3, "label": "ignored"}
+        return collect
+
+    def broken():
+        raise RuntimeError("db is locked")
+
+    registry.register_collector("memory", collector("memory"))
+    registry.register_collector("disk", collector("disk"), blocking=True)
+    registry.register_collector("broken", broken, blocking=True)
+    registry.counter("requests_total", "requests").inc()
+
+    text = run(registry.arender())
+    assert threads["memory"] is threading.main_thread()
+    assert threads["disk"] is not threading.main_thread()
+    assert "gw_disk_count 3" in text and "gw_memory_count 3" in text
+    assert "gw_requests_total 1" in text
+    # خطای collector فقط خروجی همان collector را حذف می‌کند
+    assert "gw_broken" not in text
+    assert registry.render() == text
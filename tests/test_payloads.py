@@ -0,0 +1,49 @@
+import json
+
+import pytest
+
+from function import payloads
+from function.payloads import PayloadTemplate, encode_payload, user_contents
+
+SYSTEM = {"parts": [{"text": "شما یک دستیار برنامه‌نویسی هستید. \"نقل قول\" و \\ را حفظ کن."}]}
+CONFIG = {"temperature": 0.2, "maxOutputTokens": 2048, "stopSequences": ["```\n"]}
+
+TEMPLATES = [
+    {},
+    {"generationConfig": CONFIG},
+    {"systemInstruction": SYSTEM, "generationConfig": CONFIG},
+]
+CONTENTS = [
+    [],
+    user_contents("سلام! یک تابع پایتون برای مرتب‌سازی بنویس 🙂"),
+    user_contents("hi") + [{"role": "model", "parts": [{"text": "خط اول\nخط دوم\t«گیومه»"}]}],
+]
+
+
+@pytest.fixture(params=["orjson", "json"])
+def encoder(request, monkeypatch):
+    if request.param == "json":
+        monkeypatch.setattr(payloads, "orjson", None)
+    elif payloads.orjson is None:
+        pytest.skip("orjson نصب نیست")
+    return request.param
+
+
+@pytest.mark.parametrize("static", TEMPLATES)
+@pytest.mark.parametrize("contents", CONTENTS)
+def test_pre_encoded_body_matches_plain_json(encoder, static, contents):
+    payload = PayloadTemplate(static).build(contents)
+    expected = {"contents": contents, **static}
+    # بدنه از پیش encode‌شده همان شیئی است که json.dumps از dict معادل می‌سازد
+    assert json.loads(payload.body()) == json.loads(json.dumps(expected)) == expected
+    assert dict(payload) == expected
+    assert encode_payload(payload) == payload.body()
+    assert json.loads(encode_payload(expected)) == expected
+
+
+def test_non_ascii_text_is_sent_as_utf8(encoder):
+    payload = PayloadTemplate({"systemInstruction": SYSTEM}).build(user_contents("سلام"))
+    body = payload.body()
+    assert "سلام".encode("utf-8") in body and b"\\u" not in body
+    # بدنه پس از اولین ساخت دوباره encode نمی‌شود
+    assert payload.body() is body
@@ -0,0 +1,158 @@
+import asyncio
+import time
+
+import pytest
+
+from function.resilience import CircuitBreaker, CircuitOpenError, FairScheduler, Resilience, TokenBucket
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+class UpstreamError(Exception):
+    def __init__(self, status: int, retry_after=None):
+        super().__init__(f"HTTP {status}")
+        self.status = status
+        self.retry_after = retry_after
+
+
+def classify(exc):
+    if isinstance(exc, UpstreamError):
+        return exc.status in (429, 500, 503), exc.retry_after, exc.status
+    return False, None, None
+
+
+def test_token_bucket_aimd():
+    bucket = TokenBucket(rate=16)
+    bucket.penalize()
+    bucket.penalize()
+    assert bucket.rate == 4
+    for _ in range(100):
+        bucket.penalize()
+    assert bucket.rate == bucket.min_rate == 1
+    # افزایش جمعی: هر پاسخ موفق max_rate / 20 اضافه می‌کند و از نرخ اصلی بالاتر نمی‌رود
+    bucket.reward()
+    assert bucket.rate == pytest.approx(1.8)
+    for _ in range(100):
+        bucket.reward()
+    assert bucket.rate == 16
+
+
+def test_throttling_lowers_rate_without_opening_circuit():
+    resilience = Resilience("test", classify, default_model_rate=100, base_delay=0, retries=2, failure_threshold=1)
+    calls = []
+
+    async def throttled():
+        calls.append(1)
+        if len(calls) < 3:
+            raise UpstreamError(429)
+        return "ok"
+
+    assert run(resilience.call("m", throttled)) == "ok"
+    assert resilience.metrics["throttled"] == 2 and resilience.metrics["retries"] == 2
+    assert resilience.stats()["circuits"] == {"m": "closed"}
+    # دو 429 (نصف شدن) و یک موفقیت (افزایش جمعی)
+    assert resilience.stats()["model_rates"]["m"] == pytest.approx(100 / 4 + 100 / 20)
+
+
+def test_non_retryable_error_is_raised_immediately():
+    resilience = Resilience("test", classify, base_delay=0, failure_threshold=1)
+    calls = []
+
+    async def bad_request():
+        calls.append(1)
+        raise UpstreamError(400)
+
+    with pytest.raises(UpstreamError):
+        run(resilience.call("m", bad_request))
+    assert len(calls) == 1
+    assert resilience.stats()["circuits"] == {"m": "closed"}
+
+
+def test_circuit_breaker_open_half_open_close():
+    breaker = CircuitBreaker("m", failure_threshold=2, recovery_timeout=0.05)
+    for _ in range(2):
+        breaker.before_call()
+        breaker.record_failure()
+    assert breaker.state == "open"
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+    time.sleep(0.06)
+    breaker.before_call()
+    assert breaker.state == "half_open"
+    # فقط یک درخواست آزمایشی همزمان مجاز است
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+    breaker.record_success()
+    assert breaker.state == "closed"
+    breaker.before_call()
+
+
+def test_failed_probe_reopens_circuit():
+    breaker = CircuitBreaker("m", failure_threshold=1, recovery_timeout=0.05)
+    breaker.before_call()
+    breaker.record_failure()
+    time.sleep(0.06)
+    breaker.before_call()
+    breaker.record_failure()
+    assert breaker.state == "open"
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+
+def test_open_circuit_rejects_without_calling_upstream():
+    resilience = Resilience("test", classify, base_delay=0, retries=0, failure_threshold=2, recovery_timeout=60)
+    calls = []
+
+    async def down():
+        calls.append(1)
+        raise UpstreamError(503)
+
+    for _ in range(2):
+        with pytest.raises(UpstreamError):
+            run(resilience.call("m", down))
+    with pytest.raises(CircuitOpenError):
+        run(resilience.call("m", down))
+    assert len(calls) == 2
+    assert resilience.metrics["rejected_open_circuit"] == 1
+
+
+def test_fair_scheduler_round_robin_between_sessions():
+    scheduler = FairScheduler(max_concurrency=1)
+    order = []
+
+    async def job(session_id, name):
+        async with scheduler.slot(session_id):
+            order.append(name)
+            await asyncio.sleep(0)
+
+    async def scenario():
+        async with scheduler.slot("holder"):
+            tasks = [asyncio.create_task(job("heavy", f"heavy{i}")) for i in range(3)]
+            tasks.append(asyncio.create_task(job("light", "light0")))
+            await asyncio.sleep(0)
+            assert scheduler.queued() == 4
+        await asyncio.gather(*tasks)
+
+    run(scenario())
+    # کاربر پرمصرف با وجود ورود زودتر، نوبت کاربر دیگر را نمی‌گیرد
+    assert order == ["heavy0", "light0", "heavy1", "heavy2"]
+    assert scheduler.queued() == 0
+
+
+def test_fair_scheduler_cancelled_waiter_does_not_leak_capacity():
+    scheduler = FairScheduler(max_concurrency=1)
+
+    async def scenario():
+        async with scheduler.slot("a"):
+            waiter = asyncio.create_task(scheduler.slot("b").__aenter__())
+            await asyncio.sleep(0)
+            waiter.cancel()
+            await asyncio.gather(waiter, return_exceptions=True)
+        async with scheduler.slot("c"):
+            return scheduler.queued()
+
+    assert run(scenario()) == 0
+    assert scheduler._active == 0
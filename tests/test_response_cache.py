@@ -0,0 +1,54 @@
+import asyncio
+
+from function.response_cache import MemoryCacheBackend, ResponseCache, UncacheableResponse, payload_key
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_uncacheable_response_is_returned_but_not_stored():
+    cache = ResponseCache(MemoryCacheBackend())
+    answers = iter(["fallback answer", "primary answer"])
+
+    async def compute():
+        value = next(answers)
+        if value == "fallback answer":
+            raise UncacheableResponse(value)
+        return value
+
+    assert run(cache.get_or_compute("k", compute)) == ("fallback answer", False)
+    assert run(cache.get_or_compute("k", compute)) == ("primary answer", False)
+    assert run(cache.get_or_compute("k", compute)) == ("primary answer", True)
+    assert cache.metrics["uncacheable"] == 1
+
+
+def test_stale_refresh_keeps_previous_value_when_uncacheable():
+    cache = ResponseCache(MemoryCacheBackend(), ttl_seconds=0, stale_seconds=60)
+
+    async def scenario():
+        await cache.get_or_compute("k", _value("old"))
+        value, cached = await cache.get_or_compute("k", _uncacheable("fallback"))
+        await asyncio.gather(*cache._refreshing.values())
+        return value, cached
+
+    assert run(scenario()) == ("old", True)
+    assert cache.backend.get("k")[0] == "old"
+    assert cache.metrics["uncacheable"] == 1
+
+
+def test_payload_key_depends_on_model():
+    payload = {"contents": [{"role": "user", "parts": [{"text": "x"}]}]}
+    assert payload_key("gemini-1.5-pro-latest", payload) != payload_key("gemini-1.5-flash-latest", payload)
+
+
+def _value(value):
+    async def compute():
+        return value
+    return compute
+
+
+def _uncacheable(value):
+    async def compute():
+        raise UncacheableResponse(value)
+    return compute
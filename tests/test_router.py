@@ -0,0 +1,140 @@
+import asyncio
+import json
+
+import pytest
+
+from function.router import DEFAULT_CONFIG, ModelRouter, load_model_config
+
+CONFIG = {
+    "models": {"primary": {}, "secondary": {}, "last": {}},
+    "routes": {
+        "code": {"models": ["primary", "secondary", "last"], "strategy": "ordered"},
+        "code:low": {"models": ["secondary", "primary"], "strategy": "ordered"},
+        "fast": {"models": ["primary", "secondary"], "strategy": "fastest"},
+    },
+}
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+class Overloaded(Exception):
+    pass
+
+
+class BadRequest(Exception):
+    pass
+
+
+def should_fallback(exc):
+    # (انتقال به کاندید بعدی؟، مدل پر است؟)
+    if isinstance(exc, Overloaded):
+        return True, True
+    return False, False
+
+
+def make_router(**kwargs):
+    return ModelRouter(CONFIG, should_fallback, **kwargs)
+
+
+def failing(*models, error=Overloaded):
+    calls = []
+
+    async def attempt(model, has_fallback):
+        calls.append((model, has_fallback))
+        if model in models:
+            raise error(model)
+        return f"answer from {model}"
+
+    return attempt, calls
+
+
+def test_fallback_chain_reports_serving_model():
+    router = make_router()
+    attempt, calls = failing("primary", "secondary")
+    model, result = run(router.serve("code", attempt))
+    assert (model, result) == ("last", "answer from last")
+    # has_fallback فقط برای آخرین کاندید False است
+    assert calls == [("primary", True), ("secondary", True), ("last", False)]
+    assert router.metrics["fallbacks"] == 2
+    # call همان نتیجه را بدون نام مدل برمی‌گرداند؛ دو مدل اول هنوز در cooldown هستند
+    assert run(router.call("code", failing()[0])) == "answer from last"
+
+
+def test_overloaded_model_is_skipped_while_cooling_down():
+    router = make_router(cooldown_seconds=60)
+    run(router.serve("code", failing("primary")[0]))
+    attempt, calls = failing()
+    # مدل اصلی در cooldown است؛ پاسخ از مدل دوم می‌آید، پس نباید به جای پاسخ مدل اصلی cache شود
+    assert run(router.serve("code", attempt))[0] == "secondary"
+    assert calls[0][0] == "secondary"
+    assert router.preferred("code") == "secondary"
+    assert router.primary("code") == "primary"
+    assert router.candidates("code") == ["secondary", "last", "primary"]
+
+
+def test_non_fallback_error_is_raised_without_trying_others():
+    router = make_router()
+    attempt, calls = failing("primary", error=BadRequest)
+    with pytest.raises(BadRequest):
+        run(router.serve("code", attempt))
+    assert [model for model, _ in calls] == ["primary"]
+    assert router.metrics["fallbacks"] == 0
+
+
+def test_all_candidates_failing_raises_last_error():
+    router = make_router()
+    attempt, calls = failing("primary", "secondary", "last")
+    with pytest.raises(Overloaded, match="last"):
+        run(router.serve("code", attempt))
+    assert len(calls) == 3
+
+
+def test_fastest_strategy_prefers_lower_p50():
+    router = make_router(min_samples=2)
+    for _ in range(2):
+        router.succeeded("primary", 0.5)
+        router.succeeded("secondary", 0.1)
+    assert router.candidates("fast") == ["secondary", "primary"]
+    # ترتیب مسیر ordered تغییر نمی‌کند
+    assert router.candidates("code")[0] == "primary"
+
+
+def test_route_variants_and_config(tmp_path):
+    router = make_router()
+    assert router.route("code", "low") == "code:low"
+    assert router.route("code", "high") == "code"
+    with pytest.raises(KeyError):
+        router.route("missing")
+
+    assert load_model_config(str(tmp_path / "missing.json")) is DEFAULT_CONFIG
+    path = tmp_path / "models.json"
+    path.write_text(json.dumps({"routes": {"chat": {"models": ["a"], "strategy": "random"}}}))
+    with pytest.raises(ValueError):
+        load_model_config(str(path))
+
+
+def test_reading_candidates_does_not_change_model_state():
+    router = make_router(min_samples=1, max_error_rate=0.5)
+    router.succeeded("primary", 0.2)
+    for _ in range(3):
+        router.failed("primary", Overloaded("busy"))
+    stats = router._model_stats("primary")
+    stats.cooldown_until = 0.0
+    # نرخ خطای مدل اصلی بالاست؛ خواندن آمار و کلید single-flight نباید cooldown شروع کند
+    for _ in range(2):
+        assert router.candidates("code") == ["secondary", "last", "primary"]
+        assert router.preferred("code") == "secondary"
+        router.stats()
+    assert stats.cooldown_until == 0.0 and stats.requests == 4
+
+    assert router.select("code") == ["secondary", "last", "primary"]
+    assert stats.cooldown_until > 0
+
+    # پس از پایان cooldown، خواندن آمار، پنجره خطا و تاخیر مدل را پاک نمی‌کند؛ فقط select این کار را می‌کند
+    stats.cooldown_until = 1.0
+    assert router.candidates("code")[0] == "primary"
+    assert stats.error_rate > 0.5 and stats.samples == 1
+    router.select("code")
+    assert stats.error_rate == 0.0 and stats.samples == 0
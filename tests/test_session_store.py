@@ -0,0 +1,49 @@
+import asyncio
+import json
+import sqlite3
+
+from function.session_store import SessionStore, SharedSessionStore, SqliteSessionBackend
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def turn(role, text):
+    return {"role": role, "parts": [{"text": text}]}
+
+
+def test_shared_store_async_access_and_version(tmp_path):
+    store = SharedSessionStore(SqliteSessionBackend(str(tmp_path / "s.db")), max_turns_per_session=4)
+
+    async def scenario():
+        for i in range(3):
+            version = await store.aappend("s", turn("user", f"q{i}"), turn("model", f"a{i}"))
+        return version, await store.aversion("s"), await store.aget("s"), await store.aget_page("s", 0, 10)
+
+    version, current, history, (page, start, page_version) = run(scenario())
+    # دو نوبت اول به خاطر سقف ۴ نوبت حذف شده‌اند؛ نسخه همچنان تعداد کل نوبت‌هاست
+    assert version == current == page_version == 6
+    assert len(history) == 4 and start == 2 and page == history
+    assert store.version("missing") == 0
+
+
+def test_turns_column_is_backfilled_for_existing_databases(tmp_path):
+    path = str(tmp_path / "s.db")
+    conn = sqlite3.connect(path)
+    conn.execute(
+        "CREATE TABLE sessions (session_id TEXT PRIMARY KEY, history TEXT NOT NULL, "
+        "history_offset INTEGER NOT NULL DEFAULT 0, updated_at REAL NOT NULL)"
+    )
+    conn.execute("INSERT INTO sessions VALUES ('s', ?, 3, 0)", (json.dumps([turn("user", "q"), turn("model", "a")]),))
+    conn.commit()
+    conn.close()
+
+    assert SqliteSessionBackend(path).version("s") == 5
+
+
+def test_memory_store_without_backend_stays_on_the_event_loop():
+    store = SessionStore()
+    assert not store.blocking
+    assert run(store.aappend("s", turn("user", "q"), turn("model", "a"))) == 2
+    assert SessionStore(backend=SqliteSessionBackend(":memory:")).blocking
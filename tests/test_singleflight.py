@@ -0,0 +1,106 @@
+import asyncio
+
+import pytest
+
+from function.singleflight import SingleFlight
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+class Upstream:
+    def __init__(self, result="answer", error=None):
+        self.result = result
+        self.error = error
+        self.calls = 0
+        self.release = None
+
+    async def __call__(self):
+        self.calls += 1
+        await self.release.wait()
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+def start(flight, upstream, count, key="k"):
+    # همه منتظرها پیش از پایان فراخوانی مشترک وارد do می‌شوند
+    upstream.release = asyncio.Event()
+    return [asyncio.create_task(flight.do(key, upstream)) for _ in range(count)]
+
+
+def test_concurrent_callers_share_one_call_and_release_key():
+    flight = SingleFlight()
+    upstream = Upstream()
+
+    async def scenario():
+        tasks = start(flight, upstream, 5)
+        await asyncio.sleep(0)
+        assert flight.in_flight() == 1
+        upstream.release.set()
+        return await asyncio.gather(*tasks)
+
+    assert run(scenario()) == ["answer"] * 5
+    assert upstream.calls == 1
+    assert flight.metrics == {"leaders": 1, "followers": 4}
+    # پس از پایان، کلید آزاد شده و فراخوانی بعدی دوباره upstream را صدا می‌زند
+    assert flight.in_flight() == 0
+
+    async def again():
+        tasks = start(flight, upstream, 1)
+        upstream.release.set()
+        return await asyncio.gather(*tasks)
+
+    assert run(again()) == ["answer"]
+    assert upstream.calls == 2
+
+
+def test_error_reaches_every_waiter():
+    flight = SingleFlight()
+    upstream = Upstream(error=RuntimeError("upstream down"))
+
+    async def scenario():
+        tasks = start(flight, upstream, 3)
+        await asyncio.sleep(0)
+        upstream.release.set()
+        return await asyncio.gather(*tasks, return_exceptions=True)
+
+    results = run(scenario())
+    assert [str(result) for result in results] == ["upstream down"] * 3
+    assert all(isinstance(result, RuntimeError) for result in results)
+    assert upstream.calls == 1 and flight.in_flight() == 0
+
+
+def test_cancelled_waiter_does_not_cancel_shared_call():
+    flight = SingleFlight()
+    upstream = Upstream()
+
+    async def scenario():
+        leader, follower = start(flight, upstream, 2)
+        await asyncio.sleep(0)
+        # لغو درخواست اول (که فراخوانی را شروع کرده) نباید منتظر دیگر را بی‌پاسخ بگذارد
+        leader.cancel()
+        await asyncio.sleep(0)
+        upstream.release.set()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return await follower
+
+    assert run(scenario()) == "answer"
+    assert upstream.calls == 1 and flight.in_flight() == 0
+
+
+def test_different_keys_are_not_coalesced():
+    flight = SingleFlight()
+    upstream = Upstream()
+
+    async def scenario():
+        upstream.release = asyncio.Event()
+        tasks = [asyncio.create_task(flight.do(key, upstream)) for key in ("a", "b")]
+        await asyncio.sleep(0)
+        upstream.release.set()
+        return await asyncio.gather(*tasks)
+
+    assert run(scenario()) == ["answer", "answer"]
+    assert upstream.calls == 2
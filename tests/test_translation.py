@@ -0,0 +1,62 @@
+import asyncio
+import sqlite3
+import time
+
+import pytest
+
+from function import translation
+from function.translation import EmptyTranslationError, TranslationCache, Translator, cache_key, normalize_prompt
+
+PROMPT = "یک درخت در زیر باران"
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_failed_translation_is_not_cached(tmp_path):
+    cache = TranslationCache(path=str(tmp_path / "t.db"))
+    calls = []
+
+    async def flaky(text):
+        calls.append(text)
+        if len(calls) == 1:
+            raise RuntimeError("no text")
+        return "a tree in the rain"
+
+    translator = Translator(flaky, cache)
+    with pytest.raises(RuntimeError):
+        run(translator.translate_if_needed(PROMPT))
+    assert run(translator.translate_if_needed(PROMPT)) == "a tree in the rain"
+    assert len(calls) == 2
+
+
+def test_empty_translation_is_not_cached(tmp_path):
+    cache = TranslationCache(path=str(tmp_path / "t.db"))
+
+    async def empty(text):
+        return "  "
+
+    with pytest.raises(EmptyTranslationError):
+        run(Translator(empty, cache).translate_if_needed(PROMPT))
+    assert run(cache.get(cache_key(normalize_prompt(PROMPT)))) is None
+
+
+def test_entries_expire_in_memory_and_on_disk(tmp_path):
+    path = str(tmp_path / "t.db")
+    cache = TranslationCache(path=path, ttl_seconds=60)
+    run(cache.put("k", "value"))
+    assert run(cache.get("k")) == "value"
+
+    # ورودی قدیمی‌تر از TTL (در حافظه و روی دیسک) دیگر برگردانده نمی‌شود
+    cache._memory["k"] = ("value", time.time() - 120)
+    with sqlite3.connect(path) as conn:
+        conn.execute("UPDATE translations SET created_at = ?", (time.time() - 120,))
+    assert run(cache.get("k")) is None
+    assert run(TranslationCache(path=path, ttl_seconds=60).get("k")) is None
+
+
+def test_cache_version_is_part_of_key(monkeypatch):
+    key = cache_key("متن")
+    monkeypatch.setattr(translation, "CACHE_VERSION", translation.CACHE_VERSION + 1)
+    assert cache_key("متن") != key
@@ -0,0 +1,102 @@
+import sqlite3
+
+import pytest
+
+from function import workspace_index
+from function.workspace import Workspace
+from function.workspace_index import WorkspaceIndex
+
+
+class NoTrigramConnection(sqlite3.Connection):
+    # مانند SQLite قدیمی‌تر از 3.34 که tokenizer سه‌حرفی ندارد
+    def execute(self, sql, *args):
+        if "tokenize='trigram'" in sql:
+            raise sqlite3.OperationalError("no such tokenizer: trigram")
+        return super().execute(sql, *args)
+
+
+@pytest.fixture(params=["trigram", "scan"])
+def indexed(request, tmp_path, monkeypatch):
+    if request.param == "scan":
+        connect = sqlite3.connect
+        monkeypatch.setattr(
+            workspace_index.sqlite3, "connect", lambda *args, **kwargs: connect(*args, factory=NoTrigramConnection, **kwargs)
+        )
+    root = tmp_path / "workspace"
+    index = WorkspaceIndex(str(root), str(tmp_path / "index.db"))
+    if request.param == "trigram" and not index.fts:
+        pytest.skip("SQLite بدون پشتیبانی از trigram")
+    assert index.fts == (request.param == "trigram")
+    workspace = Workspace(str(root))
+    workspace.listeners.append(index.update)
+    return workspace, index
+
+
+def all_pages(fetch, limit):
+    pages, cursor = [], None
+    while True:
+        items, cursor = fetch(cursor, limit)
+        pages.append([item["path"] for item in items])
+        if cursor is None:
+            return pages
+
+
+def test_prefix_is_a_range_bound(indexed):
+    workspace, index = indexed
+    for path in ("a/x.txt", "a/y.txt", "a0.txt", "ab.txt", "b.txt", "a/ژ.txt"):
+        workspace.create(path, b"data")
+    items, cursor = index.list(prefix="a/")
+    # "a0" و "ab" با "a" شروع می‌شوند ولی در پوشه a/ نیستند
+    assert [item["path"] for item in items] == ["a/x.txt", "a/y.txt", "a/ژ.txt"]
+    assert cursor is None
+    assert [item["path"] for item in index.list(prefix="a")[0]] == ["a/x.txt", "a/y.txt", "a/ژ.txt", "a0.txt", "ab.txt"]
+
+
+def test_list_cursor_on_page_boundary(indexed):
+    workspace, index = indexed
+    for i in range(6):
+        workspace.create(f"f{i}.txt", b"x")
+    # تعداد فایل‌ها مضرب اندازه صفحه است: صفحه آخر پر است و صفحه خالی اضافه‌ای برنمی‌گردد
+    assert all_pages(lambda cursor, limit: index.list(cursor=cursor, limit=limit), 3) == [
+        ["f0.txt", "f1.txt", "f2.txt"], ["f3.txt", "f4.txt", "f5.txt"],
+    ]
+    assert index.list(limit=6)[1] is None
+    assert index.list(limit=5)[1] == "f4.txt"
+    assert index.list(cursor="f5.txt") == ([], None)
+
+
+def test_search_cursor_on_page_boundary(indexed):
+    workspace, index = indexed
+    for i in range(4):
+        workspace.create(f"doc{i}.md", f"line {i}: needle here".encode())
+    workspace.create("other.md", b"nothing")
+    pages = all_pages(lambda cursor, limit: index.search("NEEDLE", cursor=cursor, limit=limit), 2)
+    assert pages == [["doc0.md", "doc1.md"], ["doc2.md", "doc3.md"]]
+    items, _ = index.search("needle", limit=10)
+    assert items[0]["snippet"] == "line 0: needle here"
+
+
+def test_search_query_with_quotes_and_operators(indexed):
+    workspace, index = indexed
+    workspace.create("quote.py", b'print("say \\"hi\\"") # NOT AND OR')
+    workspace.create("plain.py", b"print('say hi')")
+    assert [item["path"] for item in index.search('"say \\"hi')[0]] == ["quote.py"]
+    assert [item["path"] for item in index.search("NOT AND")[0]] == ["quote.py"]
+    assert [item["path"] for item in index.search("say", field="path")[0]] == []
+    assert [item["path"] for item in index.search("quote", field="path")[0]] == ["quote.py"]
+    with pytest.raises(ValueError):
+        index.search("ab")
+
+
+def test_rebuild_removes_files_deleted_outside_gateway(indexed, tmp_path):
+    workspace, index = indexed
+    workspace.create("kept.txt", b"keep me")
+    workspace.create("gone.txt", b"delete me")
+    (tmp_path / "workspace" / "gone.txt").unlink()
+    (tmp_path / "workspace" / "new.txt").write_bytes(b"added outside")
+    assert index.rebuild() == {"scanned": 2, "updated": 1, "removed": 1}
+    assert [item["path"] for item in index.list()[0]] == ["kept.txt", "new.txt"]
+    assert index.search("delete")[0] == []
+    assert [item["path"] for item in index.search("outside")[0]] == ["new.txt"]
+    # بار دوم چیزی تغییر نکرده است
+    assert index.rebuild() == {"scanned": 2, "updated": 0, "removed": 0}